@@ -3,13 +3,28 @@ import streamlit as st
 import pandas as pd
 
 filename = 'perceptron_model.pkl'
-with open(os.path.join('models', filename), 'rb') as f:
-    perceptron, variables = pickle.load(f)
+#training sketch of the model features, copied from output/models/{prefix}_drift_reference.json
+drift_reference = os.path.join('models', 'drift_reference.json')
+#permutation importance cache of the models, copied from output/models/explanations
+explanations = os.path.join('models', 'explanations')
+
+@st.cache_resource
+def load_model() -> tuple:
+    '''Load the model and its variables once, on the first scoring request. The compiled model of
+    the export stage is used when it is up to date, so scoring does not import sklearn'''
+    from src.data_processing.compiled_model import load_compiled_model
+    compiled = load_compiled_model(os.path.join('models', filename))
+    if compiled is not None:
+        return compiled, compiled.variables
+    with open(os.path.join('models', filename), 'rb') as f:
+        perceptron, variables = pickle.load(f)
+    return perceptron, variables
 
 st.title('Predicción de abandono de cargo en empresa del sector construcción')
 data = st.file_uploader('Introduzca el set de deployment (csv format)', type='csv')
 if data is not None:
     data = pd.read_csv(data)
+    perceptron, variables = load_model()
     #validating data
     validation = set(variables)-set(data.columns)
     if len(validation):
@@ -19,4 +34,16 @@ if data is not None:
     predictions = perceptron.predict(X)
     predictions = ['Abandona' if pred==1 else 'Permanece' for pred in predictions]
     df = X.assign(Predicción=predictions)
-    df
\ No newline at end of file
+    from src.data_processing import explanation
+    model_explanation = explanation.load_explanation(os.path.join('models', filename), explanations)
+    if model_explanation is not None:
+        attributions = explanation.row_attributions(perceptron, X, model_explanation['feature_means'])
+        df['Factores principales'] = explanation.top_factors(attributions)
+    df
+    if os.path.exists(drift_reference):
+        from src.data_processing import drift_monitor
+        #only the model variables are scored, the rest of the training features are not in X
+        reference = drift_monitor.sketch_subset(drift_monitor.load_sketch(drift_reference), X.columns)
+        sketch = drift_monitor.update_sketch(drift_monitor.empty_sketch(reference), X)
+        st.subheader('Drift de las variables frente al entrenamiento')
+        drift_monitor.drift_report(reference, sketch)
@@ -0,0 +1,27 @@
+import argparse, os
+from src.benchmarks.import_time import check_import_budgets
+from src.benchmarks.runner import run_benchmarks
+from src.benchmarks.synthetic_data import write_synthetic_inputs
+from src.commons.tools import output_path
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages over synthetic data')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=.2)
+    parser.add_argument('--history', default=os.path.join(output_path, 'benchmarks', 'history.jsonl'))
+    parser.add_argument('--write-inputs', metavar='DIR', help='only write the synthetic input files to DIR, with --scales[0] rows')
+    parser.add_argument('--imports', action='store_true', help='only check the import time budget of the modules')
+    args = parser.parse_args()
+    if args.imports:
+        results = check_import_budgets(args.repeat)
+        print(results.to_string(index=False))
+        if not results.ok.all():
+            print('import time budget exceeded')
+    elif args.write_inputs:
+        write_synthetic_inputs(args.write_inputs, args.scales[0])
+    else:
+        results = run_benchmarks(args.scales, args.history, args.repeat, args.tolerance)
+        print(results[['scale', 'stage', 'min', 'median', 'baseline', 'regression']].to_string(index=False))
+        if results.regression.any():
+            print('performance regressions found')
@@ -1,16 +1,87 @@
-from src.data_processing.precurated import preprocess_data
-from src.data_processing.geocode_data import geocoding
-from src.data_processing.curated import curate_without_featuring
-from src.data_processing.predictive_data_mining import get_train_deploy_datasets
-from src.data_processing.descriptive_data_mining import process_descriptive_sets
-from src.commons.tools import check_directories
+import argparse, os
+from src.commons.tools import check_directories, output_path
+from src.commons.instrumentation import start_trace, save_trace
 
-check_directories()
+stages = ['preprocess', 'geocoding', 'curated', 'predictive', 'descriptive']
+#stages only run when requested with --stage
+optional_stages = ['explanation', 'incremental', 'export', 'profiling']
+
+def run_stage(stage: str, args: argparse.Namespace) -> None:
+    '''Run a single stage of the pipeline. Stage modules are imported here, so a stage only loads
+    the libraries it needs (e.g. descriptive mining does not load the geospatial or plotting stacks)
+    Parameters
+    ----------
+    stage : str
+        Stage to run, one of stages
+    args : argparse.Namespace
+        Command line arguments'''
+    if stage=='preprocess':
+        from src.data_processing.precurated import preprocess_data
+        preprocess_data(prefix=args.prefix)
+    elif stage=='geocoding' and args.delta_from is not None:
+        from src.data_processing.delta import delta_geocoding
+        delta_geocoding(prefix=args.prefix, previous_prefix=args.delta_from)
+    elif stage=='geocoding':
+        from src.data_processing.geocode_data import geocoding
+        geocoding(geocode_data=args.geocode, merge_dane=args.merge_dane, prefix=args.prefix)
+    elif stage=='curated':
+        from src.data_processing.curated import curate_without_featuring
+        curate_without_featuring(prefix=args.prefix, backend=args.backend)
+    elif stage=='predictive':
+        from src.data_processing.predictive_data_mining import get_train_deploy_datasets
+        get_train_deploy_datasets(prefix=args.prefix, backend=args.backend)
+    elif stage=='descriptive':
+        from src.data_processing.descriptive_data_mining import process_descriptive_sets
+        process_descriptive_sets(prefix=args.prefix, backend=args.backend)
+    elif stage=='explanation':
+        from src.data_processing.explanation import explain_model
+        explain_model(args.model, prefix=args.prefix)
+    elif stage=='incremental':
+        from src.data_processing.incremental_training import incremental_training
+        incremental_training(args.model, prefix=args.prefix)
+    elif stage=='export':
+        from src.data_processing.compiled_model import export_model
+        export_model(args.model, prefix=args.prefix)
+    elif stage=='profiling':
+        from src.data_processing.profiling import profile_datasets
+        profile_datasets(prefix=args.prefix)
 
 if __name__=='__main__':
-    prefix = 'final1'
-    preprocess_data(prefix=prefix)
-    geocoding(geocode_data=False, merge_dane=False, prefix=prefix)
-    curate_without_featuring(prefix=prefix)
-    get_train_deploy_datasets(prefix=prefix)
-    process_descriptive_sets(prefix=prefix)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Run the recruitment optimization data pipeline')
+    parser.add_argument('--prefix', default='final1', help='identifier of the files input-output of the run')
+    parser.add_argument('--stage', choices=stages+optional_stages, nargs='+', default=stages, help='stages to run, by default all but the optional ones')
+    parser.add_argument('--partitioned', action='store_true', help='process curation, featuring and descriptive stages by project in parallel')
+    parser.add_argument('--backend', choices=['pandas', 'polars'], default='pandas', help='dataframe engine of the curated, predictive and descriptive stages')
+    parser.add_argument('--geocode', action='store_true', help='geocode the precurated data with the Here API')
+    parser.add_argument('--merge-dane', action='store_true', help='merge the geocoded data with DANE microdata')
+    parser.add_argument('--delta-from', default=None, help='prefix of a previous run: only the changed contracts are geocoded, merged with DANE microdata and featured row-wise')
+    parser.add_argument('--model', default=os.path.join('models', 'perceptron_model.pkl'), help='pickled (model, variables) to explain, update or export')
+    parser.add_argument('--profile-stage', default=None, help="name of a stage function to run under cProfile, e.g. 'feature_dane'")
+    args = parser.parse_args()
+    if (args.partitioned or args.delta_from is not None) and args.backend!='pandas' and set(args.stage)&{'curated', 'predictive', 'descriptive'}:
+        parser.error('--partitioned and --delta-from run the pandas backend, they can not be combined with --backend polars')
+
+    check_directories()
+    start_trace(os.path.join(output_path, 'traces'), prefix=args.prefix, profile_stage=args.profile_stage)
+    try:
+        featuring_stages = [stage for stage in ['curated', 'predictive', 'descriptive'] if stage in args.stage]
+        for stage in stages:
+            if stage in args.stage and not ((args.partitioned or args.delta_from is not None) and stage in featuring_stages):
+                run_stage(stage, args)
+        if args.delta_from is not None and featuring_stages:
+            #delta execution curates every row and computes the row-wise features of the changed contracts only
+            from src.data_processing.delta import delta_processing
+            delta_processing(prefix=args.prefix, previous_prefix=args.delta_from, stages=featuring_stages)
+        elif args.partitioned and featuring_stages:
+            #partitioned execution covers the requested curated, predictive and descriptive stages
+            from src.data_processing.partitioned import process_partitioned
+            process_partitioned(prefix=args.prefix, stages=featuring_stages)
+        if set(args.stage)&{'explanation', 'incremental', 'export'}:
+            #the model stages need the model variables in the train dataset, checked before running any
+            from src.data_processing.predictive_data_mining import check_model_variables
+            check_model_variables(args.model, prefix=args.prefix)
+        for stage in optional_stages:
+            if stage in args.stage:
+                run_stage(stage, args)
+    finally:
+        print(f'trace saved to {save_trace()}')
@@ -0,0 +1,69 @@
+#Import time budget of the entry points and stage modules. Every module is imported in a fresh
+#interpreter, timing the import and checking that no heavy library is loaded eagerly.
+import json, os, statistics, subprocess, sys
+import pandas as pd
+
+repo_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+heavy_modules = ['geopandas', 'matplotlib', 'scipy', 'sklearn', 'requests', 'dotenv', 'polars']
+#seconds and heavy libraries allowed by module
+import_budgets = {
+    'process_data': (1., []),
+    'src.data_processing.precurated': (1., []),
+    'src.data_processing.geocode_data': (1., []),
+    'src.data_processing.curated': (1., []),
+    'src.data_processing.predictive_data_mining': (1., []),
+    'src.data_processing.descriptive_data_mining': (1., []),
+    'src.data_processing.partitioned': (1., []),
+    'src.data_processing.explanation': (1., []),
+    'src.data_processing.feature_scoring': (1., []),
+    'src.data_processing.incremental_training': (1., []),
+    'src.data_processing.profiling': (1., []),
+    'src.data_processing.compiled_model': (1., [])
+}
+probe = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter()-start
+print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {heavy} if m in sys.modules]}}))
+'''
+
+def measure_import(module: str, repeat: int=3) -> dict:
+    '''Import a module in fresh interpreters from the repository folder.
+    Parameters
+    ----------
+    module : str
+        Module to import
+    repeat : int, optional
+        Number of imports, by default 3
+    Returns
+    -------
+    dict
+        Dictionary with the median seconds and the heavy libraries loaded'''
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', probe.format(module=module, heavy=heavy_modules)],
+            cwd=repo_path, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {'seconds': round(statistics.median(run['seconds'] for run in runs), 4), 'heavy': runs[-1]['heavy']}
+
+def check_import_budgets(repeat: int=3) -> pd.DataFrame:
+    '''Measure the import time of every module in import_budgets and check it against its budget.
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the seconds, budget, heavy libraries loaded and whether the budget is met'''
+    results = []
+    for module, (budget, allowed) in import_budgets.items():
+        measure = measure_import(module, repeat)
+        unexpected = [heavy for heavy in measure['heavy'] if heavy not in allowed]
+        results.append({
+            'module': module,
+            'seconds': measure['seconds'],
+            'budget': budget,
+            'heavy': ', '.join(unexpected),
+            'ok': measure['seconds']<=budget and not unexpected
+        })
+    return pd.DataFrame(results)
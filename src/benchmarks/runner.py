@@ -0,0 +1,171 @@
+#Benchmark of the pipeline stages over synthetic data. Results are appended to a JSON lines history
+#and every stage is compared with its best previous median at the same scale to catch regressions.
+import datetime, json, os, pickle, shutil, statistics, subprocess, tempfile, time, warnings
+import pandas as pd, numpy as np
+
+from src.benchmarks import synthetic_data
+
+repo_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+model_path = os.path.join(repo_path, 'models', 'perceptron_model.pkl')
+
+def time_call(func, make_args, repeat: int=3) -> dict:
+    '''Time a function call several times. The arguments are rebuilt before every call (outside the
+    timing) because most stages modify their inputs.
+    Parameters
+    ----------
+    func : callable
+        Function to time
+    make_args : callable
+        Function returning the tuple of arguments of func
+    repeat : int, optional
+        Number of timed calls, by default 3
+    Returns
+    -------
+    dict
+        Dictionary with the min and median seconds'''
+    times = []
+    for _ in range(repeat):
+        args = make_args()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter()-start)
+    return {'min': round(min(times), 5), 'median': round(statistics.median(times), 5)}
+
+def git_commit() -> str:
+    '''Current commit of the repository, None outside a git checkout'''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_path, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def scoring_benchmark(n_rows: int, seed: int=0):
+    '''Build the model scoring call over random features, None if the model can not be loaded'''
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            with open(model_path, 'rb') as f:
+                model, variables = pickle.load(f)
+    except Exception as error:
+        print(f'     skipping model scoring: {error}')
+        return None
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.random((n_rows, len(variables))), columns=list(variables))
+    return model.predict, lambda: (X,)
+
+def stage_benchmarks(n_rows: int, work_dir: str, seed: int=0) -> dict:
+    '''Build the benchmarked stages over synthetic data of n_rows contracts. The pipeline modules
+    are imported from work_dir/run so their relative input paths resolve to the synthetic inputs.
+    Returns
+    -------
+    dict
+        Dictionary with the stage names as keys and (function, arguments builder) as values'''
+    from src.data_processing import precurated, curated, predictive_data_mining, descriptive_data_mining, feature_scoring
+    import src.commons.tools as data_tools
+
+    employees = synthetic_data.generate_employees(n_rows, seed)
+    def raw_inputs():
+        df_inputs = {key: value.copy() for key, value in employees.items()}
+        df_inputs['employees'] = df_inputs['employees_'].join(
+            df_inputs['drops'].set_index('id_contrato'), on='id.1', how='inner', rsuffix='_'
+        )[['salario_mes', 'descripcion.4', 'id.1']]
+        df_inputs['df'] = df_inputs['df_'].join(df_inputs['employees'].set_index('id.1'), on='id.1', how='inner')
+        return (df_inputs,)
+
+    dane_enriched = synthetic_data.generate_dane_enriched(n_rows, seed)
+    dane_dict, business_dict = synthetic_data.generate_dictionaries()
+    base_curated, _ = curated.input_missing_values(dane_enriched.copy(), dane_dict, business_dict)
+    sets = curated.split_sets(base_curated)
+    train = data_tools.outliers_remotion(data_tools.years_computing(sets['train'].copy()))
+    train = data_tools.get_dummies(train, predictive_data_mining.cat_cols)
+    train = predictive_data_mining.drop_non_variant_cols(train).astype(float)
+    file_path = os.path.join(work_dir, 'run', 'train_without_featuring.csv')
+    #every scoring call writes to a new cache folder, so the cached scores are not timed
+    scoring_args = lambda: (train, 'causa_retiro', None, seed, tempfile.mkdtemp(dir=work_dir))
+    scores = feature_scoring.score_features(*scoring_args())
+    numeric_dane = sets['descriptive'][[col for col in synthetic_data.dane_columns() if col in base_curated.columns]]
+    descriptive = descriptive_data_mining.descriptive_row_features(sets['descriptive'].copy())
+    descriptive = descriptive_data_mining.descriptive_global_features(descriptive)
+
+    stages = {
+        'build_raw_data': (precurated.build_raw_data, raw_inputs),
+        'input_missing_values': (curated.input_missing_values, lambda: (dane_enriched.copy(), dane_dict, business_dict)),
+        'feature_dane': (data_tools.feature_dane, lambda: (numeric_dane.copy(),)),
+        'drop_non_variant_cols': (predictive_data_mining.drop_non_variant_cols, lambda: (train,)),
+        'score_features': (feature_scoring.score_features, scoring_args),
+        'dropping_irrelevant_variables': (predictive_data_mining.dropping_irrelevant_variables, lambda: (train, file_path, scores)),
+        'get_high_correlated_features': (predictive_data_mining.get_high_correlated_features, lambda: (train,)),
+        'numeric_binner': (descriptive_data_mining.numeric_binner, lambda: (descriptive,))
+    }
+    scoring = scoring_benchmark(n_rows, seed)
+    if scoring is not None:
+        stages['model_scoring'] = scoring
+    return stages
+
+def check_regressions(results: list, history: list, tolerance: float) -> list:
+    '''Compare every result with the best previous median of the same stage and scale.
+    Returns
+    -------
+    list
+        The results with the baseline median and the regression flag'''
+    for result in results:
+        previous = [
+            record['median'] for record in history
+            if record['stage']==result['stage'] and record['scale']==result['scale']
+        ]
+        result['baseline'] = min(previous) if previous else None
+        result['regression'] = bool(previous) and result['median']>min(previous)*(1+tolerance)
+    return results
+
+def read_history(history_path: str) -> list:
+    '''Read the benchmark history (JSON lines), empty if it does not exist'''
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def run_benchmarks(scales: list, history_path: str, repeat: int=3, tolerance: float=.2, seed: int=0) -> pd.DataFrame:
+    '''Run the stage benchmarks at every scale, append the results to the history and report
+    the regressions.
+    Parameters
+    ----------
+    scales : list
+        Numbers of synthetic contracts, e.g. [10000, 100000, 1000000]
+    history_path : str
+        Path of the JSON lines history of the benchmarks
+    repeat : int, optional
+        Number of timed calls by stage, by default 3
+    tolerance : float, optional
+        Allowed slowdown over the best previous median before flagging a regression, by default .2
+    seed : int, optional
+        Random seed of the synthetic data, by default 0
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with a row per stage and scale'''
+    history_path = os.path.abspath(history_path)
+    history = read_history(history_path)
+    commit, date = git_commit(), datetime.datetime.now().isoformat(timespec='seconds')
+    work_dir, cwd = tempfile.mkdtemp(), os.getcwd()
+    results = []
+    try:
+        #pipeline modules read their configuration files from ../input
+        synthetic_data.write_synthetic_inputs(os.path.join(work_dir, 'input'), 0, block_layer=False)
+        os.makedirs(os.path.join(work_dir, 'run'))
+        os.chdir(os.path.join(work_dir, 'run'))
+        for scale in scales:
+            print(f'benchmarking {scale} rows...')
+            for stage, (func, make_args) in stage_benchmarks(scale, work_dir, seed).items():
+                print(f'     {stage}...')
+                timing = time_call(func, make_args, repeat)
+                results.append({'date': date, 'commit': commit, 'scale': scale, 'stage': stage, **timing})
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+    results = check_regressions(results, history, tolerance)
+    os.makedirs(os.path.dirname(history_path), exist_ok=True)
+    with open(history_path, 'a', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps({key: value for key, value in result.items() if key not in ['baseline', 'regression']})+'\n')
+    return pd.DataFrame(results)
@@ -0,0 +1,313 @@
+#Synthetic versions of the confidential HR exports, the DANE enriched database and the DANE block
+#layer with the schema expected by the pipeline. They are used to benchmark it at any scale.
+import json, os, shutil, tempfile
+import pandas as pd, numpy as np
+
+from src.commons.tools import normalize_dates
+
+projects = ['Contrato Subestructura S2', 'Contrato Puente calle 26', 'WF4']
+plants = ['OPERATIVOS', 'ADMINISTRATIVOS']
+jobs = [
+    'AYUDANTE DE OBRA tasa 6.96', 'AUXILIAR AMBIENTAL', 'AUXILIAR DE SERVICIOS GENERALES',
+    'CADENERO I', 'CONTROLADOR VIAL', 'INSPECTOR SST I', 'OFICIAL I', 'OFICIAL II',
+    'OPERADOR DE RETROEXCAVADORA', 'OPERADOR GRUA TELESCOPICA', 'PERFORISTA -LANZADOR', 'SOLDADOR I',
+    'CONDUCTOR VOLQUETA DAF', 'AUXILIAR ADMINISTRATIVA'
+]
+drop_causes = [
+    'TERMINACION DE CONTRATO', 'RENUNCIA VOLUNTARIA', 'TERMINACION PERIODO DE PRUEBA',
+    'DESPIDO CON JUSTA CAUSA', 'MUERTE DEL TRABAJADOR'
+]
+drop_causes_p = [.55, .3, .1, .049, .001]
+localities = ['KENNEDY', 'BOSA', 'SUBA', 'ENGATIVA', 'CIUDAD BOLIVAR', 'USME', 'FONTIBON', 'TEUSAQUILLO']
+#DANE totals and the counts that feature_dane divides by them
+dane_totals = ['TP27_PERSO', 'TVIVIENDA', 'CTNENCUEST', 'TP16_HOG']
+dane_counts = {
+    'TP27_PERSO': [
+        'TP51_13_ED', 'TP51SUPERI', 'TP51SECUND', 'TP51PRIMAR', 'TP51_99_ED', 'TP34_6_EDA',
+        'TP34_8_EDA', 'TP34_7_EDA', 'TP34_3_EDA', 'TP34_5_EDA', 'TP34_9_EDA', 'TP34_4_EDA',
+        'TP34_2_EDA', 'TP34_1_EDA', 'TP32_1_SEX', 'TP32_2_SEX', 'TP51POSTGR', 'PERSONAS_S'
+    ],
+    'TVIVIENDA': [
+        'TP9_1_USO', 'TP19_INTE1', 'TP19_GAS_1', 'TP19_ACU_1', 'TP19_GAS_9', 'TP19_EE_E2',
+        'TP19_EE_E3', 'TP19_EE_E5', 'TP19_EE_E6', 'TP15_1_OCU', 'TP14_2_TIP', 'TP9_2_USO',
+        'TP14_6_TIP', 'TP15_2_OCU', 'TP14_4_TIP', 'TP19_RECB1', 'TP19_INTE2', 'TP19_EE_1',
+        'TP19_ALC_1', 'TP19_INTE9', 'TP15_4_OCU', 'TP19_RECB2', 'TP14_5_TIP', 'TP15_3_OCU',
+        'TP19_EE_2', 'TP19_GAS_2', 'TP9_2_1_MI', 'TP9_2_2_MI', 'TP9_2_9_MI', 'TP9_3_5_NO',
+        'TP9_3_6_NO', 'TP9_3_10_N', 'TP9_3_99_N', 'TP19_INTE6'
+    ],
+    'CTNENCUEST': ['TP4_2_NO', 'TP3_2_NO'],
+    'TP16_HOG': []
+}
+#DANE columns with missing values after the spatial join (the first one over the 15% threshold)
+dane_missing = {'TP19_INTE6': .2, 'TP9_3_99_N': .05, 'TP19_GAS_2': .02}
+#columns configuration equivalent to input/colum-cleaning.json and input/column-curated.json
+cleaning_config = {
+    'idents': ['id', 'id.1', 'nombre'],
+    'drop_cols': ['nombre'],
+    'useless_cols': ['sanguineo', 'rh', 'peso', 'estatura', 'forma_pago'],
+    'duplicated_cols': ['fecha_ingreso', 'fecha_retiro'],
+    'dates': ['fecha_ingreso.1', 'fecha_retiro.1', 'fecha_nacimiento', 'fecha_final'],
+    'projects': projects,
+    'precurated_filter': ['Planta', 'id']
+}
+curated_config = {
+    'irrelevant_cols': ['id_contrato'],
+    'geocoded_dane_col_drops': ['city', 'district', 'latitude', 'longitude', 'index_right', 'COD_DANE_A', 'geometry']
+}
+
+def dane_columns() -> list:
+    '''DANE block variables in the synthetic layer'''
+    return dane_totals+[col for counts in dane_counts.values() for col in counts]
+
+def format_dates(days: np.ndarray, rng: np.random.Generator, time_suffix: float=.3) -> np.ndarray:
+    '''Format days since 1970-01-01 as the exports do: d/mm/YYYY, sometimes followed by ' 0:00' '''
+    dates = pd.to_datetime(days, unit='D')
+    dates = pd.Series(dates.day.astype(str))+'/'+pd.Series(dates.strftime('%m/%Y'))
+    suffix = np.where(rng.random(len(days))<time_suffix, ' 0:00', '')
+    return (dates+suffix).to_numpy()
+
+def addresses(n_rows: int, rng: np.random.Generator) -> np.ndarray:
+    '''Generate Bogotá nomenclature addresses like 'CL 45 # 12 - 30' '''
+    numbers = pd.DataFrame(rng.integers(1, 200, (n_rows, 3))).astype(str)
+    streets = pd.Series(rng.choice(['CL', 'KR', 'DG', 'TV'], n_rows))
+    return (streets+' '+numbers[0]+' # '+numbers[1]+' - '+numbers[2]).to_numpy()
+
+def generate_employees(n_rows: int, seed: int=0, start: int=0) -> dict:
+    '''Generate the three HR exports with the schema expected by precurated.read_inputs.
+    Parameters
+    ----------
+    n_rows : int
+        Number of contracts
+    seed : int, optional
+        Random seed, by default 0
+    start : int, optional
+        First contract id, to generate the exports in chunks, by default 0
+    Returns
+    -------
+    dict
+        A dictionary with the DataFrames employees_ (Empleados_AR.csv), drops (Retiros_Causa.csv)
+        and df_ (Empleados_Activos_Retirados_V1.csv)'''
+    rng = np.random.default_rng(seed+start)
+    ids = np.arange(start, start+n_rows)+100000
+    retired = rng.random(n_rows)<.8
+    admission = rng.integers(16000, 20000, n_rows) #days since 1970, 2013 to 2024
+    permanence = rng.integers(-5, 900, n_rows)
+    birth = admission-rng.integers(16*365, 66*365, n_rows)
+    retirement = format_dates(admission+permanence, rng)
+    retirement[~retired] = '1/01/2500'
+    final = format_dates(admission+rng.integers(90, 1000, n_rows), rng)
+    df_ = pd.DataFrame({
+        'id': rng.integers(1000000, 99999999, n_rows),
+        'id.1': ids,
+        'nombre': 'EMPLEADO',
+        'Planta': rng.choice(plants, n_rows, p=[.9, .1]),
+        'Proyecto': rng.choice(projects+['OTRO PROYECTO'], n_rows, p=[.35, .3, .3, .05]),
+        'Desc_Cargo': rng.choice(jobs, n_rows),
+        'genero': rng.choice(['M', 'F'], n_rows, p=[.85, .15]),
+        'fecha_nacimiento': format_dates(birth, rng),
+        'fecha_ingreso': format_dates(admission, rng, 0),
+        'fecha_retiro': retirement,
+        'fecha_ingreso.1': format_dates(admission, rng),
+        'fecha_retiro.1': retirement,
+        'fecha_final': final,
+        'id_tipo_contrato': rng.integers(1, 4, n_rows),
+        'id_estado_civil': rng.integers(1, 6, n_rows),
+        'id_turno': rng.integers(1, 3, n_rows),
+        'id_destino': rng.integers(1, 10, n_rows),
+        'id_nivel_academico': rng.integers(1, 8, n_rows),
+        'subsidio_tte': rng.choice([0, 1], n_rows),
+        'direccion': addresses(n_rows, rng),
+        'barrio': rng.choice(localities, n_rows),
+        'id_ciudad': 11001,
+        'id_area': rng.integers(1, 20, n_rows),
+        'id_ciudad_residencia': 11001,
+        'id_departamento_exp': 11,
+        'id_departamento_res': 11,
+        'sanguineo': None,
+        'rh': None,
+        'peso': 0,
+        'estatura': 0,
+        'forma_pago': 'B'
+    })
+    employees_ = pd.DataFrame({
+        'id.1': ids,
+        'salario_mes': rng.integers(1300, 6000, n_rows)*1000
+    })
+    drops = pd.DataFrame({
+        'id_contrato': ids[retired],
+        'descripcion.4': rng.choice(drop_causes, retired.sum(), p=drop_causes_p)
+    })
+    return {'employees_': employees_, 'drops': drops, 'df_': df_}
+
+def generate_dane_blocks(n_rows: int, seed: int=0) -> pd.DataFrame:
+    '''Generate DANE block attributes with consistent totals and counts.
+    Parameters
+    ----------
+    n_rows : int
+        Number of blocks (or enriched rows)
+    seed : int, optional
+        Random seed, by default 0
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the DANE columns'''
+    rng = np.random.default_rng(seed)
+    homes = rng.integers(5, 400, n_rows)
+    data = {
+        'TP16_HOG': homes,
+        'TVIVIENDA': (homes*rng.uniform(.8, 1.1, n_rows)).astype(int)+1,
+        'CTNENCUEST': (homes*rng.uniform(.9, 1.2, n_rows)).astype(int)+1,
+        'TP27_PERSO': (homes*rng.uniform(2., 4., n_rows)).astype(int)+1
+    }
+    for total, counts in dane_counts.items():
+        for col in counts:
+            data[col] = rng.binomial(data[total], rng.uniform(.05, .6))
+    dane = pd.DataFrame(data).astype(float)
+    for col, fraction in dane_missing.items():
+        dane.loc[rng.random(n_rows)<fraction, col] = np.nan
+    return dane
+
+def generate_dane_enriched(n_rows: int, seed: int=0) -> pd.DataFrame:
+    '''Generate the DANE enriched database read by curated.read_data (geocode_data output), with
+    parsed dates.
+    Parameters
+    ----------
+    n_rows : int
+        Number of contracts
+    seed : int, optional
+        Random seed, by default 0
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the schema of {prefix}_dane_enriched_db.csv'''
+    rng = np.random.default_rng(seed)
+    df_ = generate_employees(n_rows, seed)['df_']
+    df_ = df_.drop(cleaning_config['drop_cols']+cleaning_config['useless_cols']+cleaning_config['duplicated_cols'], axis=1)
+    df_ = df_.drop(['direccion', 'barrio', 'id_ciudad', 'id_area', 'id_ciudad_residencia', 'id_departamento_exp', 'id_departamento_res'], axis=1)
+    df_ = df_.drop(cleaning_config['precurated_filter'], axis=1)
+    df_ = normalize_dates(df_, cleaning_config['dates'])
+    df_ = df_.rename({'id.1': 'id_contrato', 'fecha_ingreso.1': 'fecha_ingreso', 'fecha_retiro.1': 'fecha_retiro'}, axis=1)
+    causes = rng.choice(drop_causes, n_rows, p=drop_causes_p).astype(object)
+    causes[df_.fecha_retiro.isna()] = 'Activo'
+    df_['causa_retiro'] = causes
+    df_['salario_mes'] = rng.integers(1300, 6000, n_rows)*1000
+    df_['city'] = 'Bogotá'
+    df_['district'] = rng.choice(localities, n_rows)
+    df_['latitude'] = rng.uniform(4.5, 4.8, n_rows)
+    df_['longitude'] = rng.uniform(-74.2, -74.0, n_rows)
+    df_['index_right'] = rng.integers(0, 40000, n_rows)
+    df_['COD_DANE_A'] = '11001'+df_['index_right'].astype(str).str.zfill(17)
+    df_['NMB_LC_CM'] = df_['district']
+    df_['geometry'] = 'POINT EMPTY'
+    return df_.join(generate_dane_blocks(n_rows, seed))
+
+def generate_dictionaries() -> tuple:
+    '''Generate the DANE and business data dictionaries read by curated.read_data.
+    Returns
+    -------
+    tuple
+        Tuple with the DataFrames: dane_dict, business_dict'''
+    dane_dict = pd.DataFrame({'VARIABLE': dane_columns(), 'TIPO': 'Double'})
+    business_dict = pd.DataFrame({'Variable': ['salario_mes', 'id_tipo_contrato'], 'Tipo': ['Continua', 'Discreta']})
+    return dane_dict, business_dict
+
+def generate_block_layer(n_side: int=40, seed: int=0):
+    '''Generate a small square grid of DANE blocks over Bogotá, in EPSG:4326.
+    Parameters
+    ----------
+    n_side : int, optional
+        Blocks by side of the grid, by default 40
+    seed : int, optional
+        Random seed, by default 0
+    Returns
+    -------
+    gpd.GeoDataFrame
+        GeoDataFrame with COD_DANE_A, NMB_LC_CM, the DANE columns and the block polygons'''
+    import geopandas as gpd
+    from shapely.geometry import box
+    rng = np.random.default_rng(seed)
+    lats, lngs = np.linspace(4.5, 4.8, n_side+1), np.linspace(-74.2, -74.0, n_side+1)
+    polygons = [box(lngs[j], lats[i], lngs[j+1], lats[i+1]) for i in range(n_side) for j in range(n_side)]
+    blocks = generate_dane_blocks(len(polygons), seed).fillna(0)
+    blocks.insert(0, 'NMB_LC_CM', rng.choice(localities, len(polygons)))
+    blocks.insert(0, 'COD_DANE_A', [f'11001{k:017d}' for k in range(len(polygons))])
+    return gpd.GeoDataFrame(blocks, geometry=polygons, crs='EPSG:4326')
+
+def write_dictionaries(input_dir: str) -> None:
+    '''Write the synthetic data dictionaries as the workbooks read by curated.read_dictionaries,
+    with the sheet names and header rows of the real ones'''
+    dane_dict, business_dict = generate_dictionaries()
+    with pd.ExcelWriter(os.path.join(input_dir, 'DICCIONARIO_DATOS_DANE.xlsx')) as writer:
+        dane_dict.to_excel(writer, sheet_name='MGN_ANM_MANZANA', startrow=6, index=False)
+    #the business dictionary starts with an unnamed column, dropped by the readers
+    with pd.ExcelWriter(os.path.join(input_dir, 'DICCIONARIO 1.xlsx')) as writer:
+        business_dict.to_excel(writer, sheet_name='DICCIONARIO FINAL', startrow=3)
+
+def write_model_schema(input_dir: str, model_path: str) -> None:
+    '''Write data-mining-schema.json with the variables of a pickled (model, variables) tuple and the target'''
+    import pickle, warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with open(model_path, 'rb') as f:
+            _, variables = pickle.load(f)
+    with open(os.path.join(input_dir, 'data-mining-schema.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'schema': list(variables)+['retiro']}, indent=4))
+
+def write_synthetic_inputs(
+    input_dir: str,
+    n_rows: int,
+    seed: int=0,
+    chunk_size: int=1000000,
+    block_layer: bool=True,
+    model_path: str=os.path.join('models', 'perceptron_model.pkl')
+    ) -> None:
+    '''Write the synthetic HR exports, column configurations, data dictionaries, model schema and
+    DANE block layer to input_dir, with the names, separators and encodings of the real inputs.
+    The exports are written in chunks so big scales fit in memory.
+    Parameters
+    ----------
+    input_dir : str
+        Directory to write the inputs to
+    n_rows : int
+        Number of contracts
+    seed : int, optional
+        Random seed, by default 0
+    chunk_size : int, optional
+        Contracts generated by chunk, by default 1000000
+    block_layer : bool, optional
+        Whether to write DANE_microdata_2018.zip (needs geopandas), by default True
+    model_path : str, optional
+        Pickled (model, variables) tuple whose variables are written to data-mining-schema.json. If
+        None or missing the schema is not written and the deploy set uses the selected features,
+        by default models/perceptron_model.pkl'''
+    os.makedirs(input_dir, exist_ok=True)
+    files = {
+        'employees_': ('Empleados_AR.csv', ';'),
+        'drops': ('Retiros_Causa.csv', ','),
+        'df_': ('Empleados_Activos_Retirados_V1.csv', ';')
+    }
+    for start in range(0, n_rows, chunk_size):
+        chunk = generate_employees(min(chunk_size, n_rows-start), seed, start)
+        for key, (file_name, sep) in files.items():
+            chunk[key].to_csv(
+                os.path.join(input_dir, file_name),
+                sep=sep,
+                index=0,
+                encoding='latin-1',
+                mode='w' if start==0 else 'a',
+                header=start==0
+            )
+    with open(os.path.join(input_dir, 'colum-cleaning.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(cleaning_config, indent=4))
+    with open(os.path.join(input_dir, 'column-curated.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(curated_config, indent=4))
+    write_dictionaries(input_dir)
+    if model_path is not None and os.path.exists(model_path):
+        write_model_schema(input_dir, model_path)
+    if block_layer:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            generate_block_layer(seed=seed).to_file(os.path.join(tmp_dir, 'MGN_ANM_MANZANA.shp'))
+            shutil.make_archive(os.path.join(input_dir, 'DANE_microdata_2018'), 'zip', tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,135 @@
+import cProfile, datetime, functools, json, os, sys, time
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#Active trace of the run. None means the instrumentation is disabled and the decorated
+#functions run without any overhead
+trace = None
+
+def peak_rss() -> float:
+    '''Peak resident set size of the process in MB. It is the high-water mark since the process
+    started, so the value recorded for a stage is the peak reached up to the end of it'''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak/1024**2 if sys.platform=='darwin' else peak/1024, 2)
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, 'peak_wset', memory.rss)/1024**2, 2)
+    return None
+
+def io_bytes() -> tuple:
+    '''Bytes read and written by the process so far, None if psutil is not installed'''
+    if psutil is None:
+        return None, None
+    try:
+        counters = psutil.Process().io_counters()
+    except (AttributeError, psutil.Error):
+        return None, None
+    return getattr(counters, 'read_chars', counters.read_bytes), getattr(counters, 'write_chars', counters.write_bytes)
+
+def frame_shapes(obj):
+    '''Rows and columns of the DataFrames in obj. It looks into dicts, tuples and lists, returning
+    the shapes with the same structure'''
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return list(obj.shape) if obj.ndim==2 else [len(obj), 1]
+    if isinstance(obj, dict):
+        shapes = {str(key): frame_shapes(value) for key, value in obj.items()}
+        shapes = {key: value for key, value in shapes.items() if value is not None}
+        return shapes or None
+    if isinstance(obj, (tuple, list)):
+        shapes = [frame_shapes(value) for value in obj]
+        shapes = [value for value in shapes if value is not None]
+        return shapes or None
+    return None
+
+def start_trace(traces_path: str, prefix: str='', profile_stage: str=None) -> dict:
+    '''Start the instrumentation of a pipeline run.
+    Parameters
+    ----------
+    traces_path : str
+        Directory where the trace and the profiling stats are saved
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    profile_stage : str, optional
+        Name of a stage (function name) to run under cProfile, by default None
+    Returns
+    -------
+    dict
+        The active trace'''
+    global trace
+    trace = {
+        'prefix': prefix,
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'profile_stage': profile_stage,
+        'stages': [],
+        '_path': traces_path,
+        '_stack': []
+    }
+    return trace
+
+def save_trace() -> str:
+    '''Save the active trace to {traces_path}/{prefix}_trace.json and stop the instrumentation.
+    Returns
+    -------
+    str
+        Path of the saved trace, None if no trace was started'''
+    global trace
+    if trace is None:
+        return None
+    path = os.path.join(trace['_path'], f'{trace["prefix"]}_trace.json')
+    data = {key: value for key, value in trace.items() if not key.startswith('_')}
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(data, indent=4, default=str))
+    trace = None
+    return path
+
+def instrumented(func):
+    '''Decorator recording in the active trace the wall time, CPU time, peak RSS, input/output
+    DataFrame shapes and bytes read/written of every call to func. Nested calls are recorded with
+    their full path, e.g. preprocess_data/build_raw_data'''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if trace is None:
+            return func(*args, **kwargs)
+        stack = trace['_stack']
+        stack.append(func.__name__)
+        name = '/'.join(stack)
+        profiler = cProfile.Profile() if trace['profile_stage']==func.__name__ else None
+        input_shapes = frame_shapes(list(args)+list(kwargs.values()))
+        read_start, written_start = io_bytes()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            if profiler is None:
+                result = func(*args, **kwargs)
+            else:
+                result = profiler.runcall(func, *args, **kwargs)
+        finally:
+            stack.pop()
+        record = {
+            'stage': name,
+            'wall_time': round(time.perf_counter()-wall_start, 4),
+            'cpu_time': round(time.process_time()-cpu_start, 4),
+            'peak_rss_mb': peak_rss(),
+            'input_shapes': input_shapes,
+            'output_shapes': frame_shapes(result)
+        }
+        read_end, written_end = io_bytes()
+        if read_start is not None and read_end is not None:
+            record['bytes_read'] = read_end-read_start
+            record['bytes_written'] = written_end-written_start
+        if profiler is not None:
+            profile_path = os.path.join(trace['_path'], f'{trace["prefix"]}_{func.__name__}.prof')
+            profiler.dump_stats(profile_path)
+            record['profile'] = profile_path
+        trace['stages'].append(record)
+        return result
+    return wrapper
@@ -0,0 +1,142 @@
+#Polars lazy backend of the row-wise curation and featuring steps. Every function adds steps to a
+#LazyFrame query plan, so the CSV is scanned once, only the used columns are read (projection
+#pushdown) and the plan runs multi-threaded on collect. Results are returned as pandas DataFrames
+#identical to the ones of the pandas functions in tools, so the steps that need the whole dataset
+#(correlations, KNN imputation, feature scoring, bins) and the savers are shared by both backends.
+import datetime
+import pandas as pd
+import polars as pl
+
+def scan_csv_dates(file_path: str, date_cols: list) -> pl.LazyFrame:
+    '''Scan a CSV written by the pipeline, parsing the date columns (persisted as YYYY-MM-DD)
+    Parameters
+    ----------
+    file_path : str
+        Path of the CSV file
+    date_cols : list
+        Date columns
+    Returns
+    -------
+    pl.LazyFrame
+        LazyFrame with datetime date columns'''
+    lf = pl.scan_csv(file_path, infer_schema_length=None, schema_overrides={col: pl.String for col in date_cols})
+    return lf.with_columns(pl.col(date_cols).str.to_datetime('%Y-%m-%d', time_unit='ns'))
+
+def missing_columns(lf: pl.LazyFrame) -> list:
+    '''Columns with missing values'''
+    null_counts = lf.select(pl.all().null_count()).collect()
+    return [col for col in null_counts.columns if null_counts[col][0]]
+
+def apply_imputation_plan(lf: pl.LazyFrame, plan: dict) -> pl.LazyFrame:
+    '''Input missing values with precomputed global statistics, like curated.apply_imputation_plan'''
+    lf = lf.with_columns([pl.col(col).fill_null(value) for col, value in plan['fill_values'].items()])
+    return lf.drop(plan['dropped_cols'])
+
+def fill_value(col: str) -> pl.Expr:
+    '''Expression of the value to input missing values in a numeric column, like
+    tools.numeric_fill_value: the mean if the column is almost symmetric (|skew|<0.5), otherwise the median'''
+    return pl.when(pl.col(col).skew().abs()<.5).then(pl.col(col).mean()).otherwise(pl.col(col).median())
+
+def years_computing(lf: pl.LazyFrame, now: datetime.datetime=None) -> pl.LazyFrame:
+    '''Compute years from date of birth and clean some values, like tools.years_computing
+    Parameters
+    ----------
+    lf : pl.LazyFrame
+        LazyFrame with date of birth column
+    now : datetime.datetime, optional
+        Reference date of the years. If None uses the current time, by default None
+    Returns
+    -------
+    pl.LazyFrame
+        LazyFrame with years column and cleaned values'''
+    desc_cargo_eq = {
+        "CONDUCTOR VOLQUETA DAF": "CONDUCTOR DE VOLQUETA DAF",
+        "AUXILIAR ADMINISTRATIVA": "AUXILIAR ADMINSTRATIVO",
+        "INSPECTOR SST": "INSPECTOR SST I",
+        "SOLDADOR ": "SOLDADOR I"
+    }
+    now = datetime.datetime.now() if now is None else now
+    columns = lf.collect_schema().names()
+    #anios is placed as the 11th column, like the pandas insert
+    columns = columns[:10]+['anios']+columns[10:]
+    columns.remove('fecha_nacimiento')
+    lf = lf.with_columns(
+        pl.col('Desc_Cargo').replace(desc_cargo_eq),
+        ((pl.lit(now)-pl.col('fecha_nacimiento')).dt.total_days()//365.25).cast(pl.Float64).alias('anios')
+    )
+    return lf.filter(~pl.col('causa_retiro').eq_missing('MUERTE DEL TRABAJADOR')).select(columns)
+
+def mark_outliers(lf: pl.LazyFrame) -> pl.LazyFrame:
+    '''Set as missing the outliers in the years column, like tools.mark_outliers'''
+    return lf.with_columns(pl.when((pl.col('anios')<18)|(pl.col('anios')>60)).then(None).otherwise(pl.col('anios')).alias('anios'))
+
+def input_numeric_col(lf: pl.LazyFrame, col: str) -> pl.LazyFrame:
+    '''Input missing values in a numeric column with fill_value'''
+    return lf.with_columns(pl.col(col).fill_null(fill_value(col)))
+
+def outliers_remotion(lf: pl.LazyFrame) -> pl.LazyFrame:
+    '''Remove outliers in the years column, like tools.outliers_remotion'''
+    return input_numeric_col(mark_outliers(lf), 'anios')
+
+def category(col: str) -> pl.Expr:
+    '''Categorical column as strings, missing values as 'nan' like pandas astype(str)'''
+    return pl.col(col).cast(pl.String).fill_null('nan')
+
+def dummy_vocabulary(lf: pl.LazyFrame, cat_cols: list, min_count: int=1) -> dict:
+    '''Learn the categories of every categorical column, like tools.dummy_vocabulary. Only the
+    categorical columns are read'''
+    from src.commons.tools import reference_categories
+    counts = lf.select([category(col).value_counts().implode() for col in cat_cols]).collect()
+    vocabulary = {}
+    for col in cat_cols:
+        values = counts[col][0].struct.unnest()
+        vocabulary[col] = sorted(
+            value for value, count in zip(values[col], values['count'])
+            if count>=min_count and value!=reference_categories.get(col)
+        )
+    return vocabulary
+
+def get_dummies(lf: pl.LazyFrame, cat_cols: list, labeling_scope: bool=True, vocabulary: dict=None) -> pl.LazyFrame:
+    '''Get uint8 dummies for categorical columns and encode objective variable, like tools.get_dummies
+    Parameters
+    ----------
+    lf : pl.LazyFrame
+        LazyFrame with categorical columns
+    cat_cols : list
+        List with categorical columns
+    labeling_scope : bool, optional
+        If True, encode objective variable for scope analysis, by default True
+    vocabulary : dict, optional
+        Fixed categories by column. If None it is learnt with dummy_vocabulary, without the other
+        bucket, by default None
+    Returns
+    -------
+    pl.LazyFrame
+        LazyFrame with dummies and encoded objective variable'''
+    from src.commons.tools import reference_categories, other_category
+    other = vocabulary is not None
+    vocabulary = dummy_vocabulary(lf, cat_cols) if vocabulary is None else vocabulary
+    dummies = []
+    for col, categories in vocabulary.items():
+        dummies.extend([(category(col)==value).cast(pl.UInt8).alias(f'{col}_{value}') for value in categories])
+        if other:
+            known = categories+[reference_categories[col]] if col in reference_categories else categories
+            dummies.append((~category(col).is_in(known)).cast(pl.UInt8).alias(f'{col}_{other_category}'))
+    numeric_cols = [pl.col(col) if col!='anios' else pl.col('anios').cast(pl.Int64) for col in lf.collect_schema().names() if col not in cat_cols+['causa_retiro']]
+    objective_var = pl.col('causa_retiro')
+    if labeling_scope:
+        objective_var = (objective_var=='TERMINACION DE CONTRATO').fill_null(False).cast(pl.Int64)
+    return lf.select(dummies+numeric_cols+[objective_var])
+
+def descriptive_row_features(lf: pl.LazyFrame, now: datetime.datetime=None) -> pl.LazyFrame:
+    '''Compute the row-wise features of the descriptive base: years, permanence contract time and
+    outliers marking, like descriptive_data_mining.descriptive_row_features'''
+    lf = years_computing(lf, now)
+    #integer days, as float only when there are missing values (like the pandas column)
+    permanencia = (pl.col('fecha_retiro')-pl.col('fecha_ingreso')).dt.total_days()
+    lf = lf.with_columns(pl.when(permanencia<=0).then(None).otherwise(permanencia).alias('permanencia'))
+    return mark_outliers(lf.drop(['fecha_ingreso', 'fecha_retiro']))
+
+def collect(lf: pl.LazyFrame) -> pd.DataFrame:
+    '''Run the query plan and return a pandas DataFrame'''
+    return lf.collect().to_pandas()
@@ -1,10 +1,17 @@
-import datetime, os
-from scipy import stats
+import datetime, functools, hashlib, json, os
 import pandas as pd, numpy as np
-from sklearn.impute import KNNImputer
+
+from src.commons.instrumentation import instrumented
 
 input_path = os.path.join('..', 'input')
 output_path = os.path.join('..', 'output')
+#placeholder dates of the HR exports: 1/01/2500 for active contracts and 1/01/1900 for unknown dates
+date_placeholders = ['1/01/2500', '1/01/1900']
+time_suffix = r'\s+\d{1,2}:\d{2}(:\d{2})?$'
+#reference categories, left without dummy column so the dummies of a column are not collinear
+reference_categories = {'genero': 'F'}
+#bucket of the categories out of the vocabulary
+other_category = 'other'
 cols_high_correlated = [
     'Desc_Cargo_AYUDANTE DE OBRA tasa 6.96', 'CTNENCUEST', 'TP16_HOG',
     'TVIVIENDA', 'TP9_2_2_MI', 'TP19_RECB1', 'TP19_INTE2', 'TP19_EE_1',
@@ -20,12 +27,121 @@ def check_directories() -> None:
         os.path.join(output_path, 'descriptive_mining'),
         os.path.join(output_path, 'predictive_mining'),
         os.path.join(output_path, 'predictive_mining', 'train_set'),
-        os.path.join(output_path, 'predictive_mining', 'deploy_set')
+        os.path.join(output_path, 'predictive_mining', 'deploy_set'),
+        os.path.join(output_path, 'partitions'),
+        os.path.join(output_path, 'profiling'),
+        os.path.join(output_path, 'traces')
     ]
     for path in paths:
         if not os.path.exists(path):
             os.mkdir(path)
 
+def file_hash(file_path: str) -> str:
+    '''SHA-256 of a file, used to identify a pickled model'''
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def dataset_hash(dataset: pd.DataFrame) -> str:
+    '''SHA-256 of the content and columns of a DataFrame, used as key of the cached results'''
+    digest = hashlib.sha256(pd.util.hash_pandas_object(dataset, index=False).to_numpy().tobytes())
+    digest.update(','.join(map(str, dataset.columns)).encode())
+    return digest.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def read_config(file_name: str) -> dict:
+    '''Read a JSON configuration file of the input folder. It is read on first use and cached, so
+    importing the modules does not touch the file system
+    Parameters
+    ----------
+    file_name : str
+        Name of the JSON file in the input folder
+    Returns
+    -------
+    dict
+        Parsed configuration'''
+    with open(os.path.join(input_path, file_name), 'r', encoding='utf-8') as f:
+        config = json.loads(f.read())
+    return config
+
+def parse_dates(values: pd.Series, date_format: str='%Y-%m-%d') -> pd.Series:
+    '''Parse a column of date strings parsing every unique value only once
+    Parameters
+    ----------
+    values : pd.Series
+        Column with date strings
+    date_format : str, optional
+        Format of the dates, by default '%Y-%m-%d' (the format the pipeline persists dates with)
+    Returns
+    -------
+    pd.Series
+        Column of datetime64 dtype'''
+    codes, uniques = pd.factorize(values)
+    dates = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    if len(uniques):
+        parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=date_format).to_numpy(dtype='datetime64[ns]')
+        dates[codes>=0] = parsed[codes[codes>=0]]
+    return pd.Series(dates, index=values.index, name=values.name)
+
+def normalize_dates(df: pd.DataFrame, columns: list, date_format: str='%d/%m/%Y') -> pd.DataFrame:
+    '''Normalize the raw date columns of the HR exports: time suffixes (' 0:00') are removed,
+    placeholder dates (date_placeholders) become missing values and the dates are parsed once
+    per unique value. Only the given columns are touched. Contracts with a placeholder retirement
+    date are identified by the missing fecha_retiro and the 'Activo' retirement cause
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame with raw date columns
+    columns : list
+        Date columns
+    date_format : str, optional
+        Format of the dates without time suffix, by default '%d/%m/%Y'
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with datetime64 date columns'''
+    for column in columns:
+        codes, uniques = pd.factorize(df[column])
+        uniques = pd.Series(uniques, dtype=object).astype(str).str.replace(time_suffix, '', regex=True)
+        uniques = uniques.mask(uniques.isin(date_placeholders))
+        df[column] = parse_dates(pd.Series(uniques.to_numpy()[codes], index=df.index).where(codes>=0), date_format)
+    return df
+
+def read_csv_dates(file_path: str, date_cols: list, **kwargs) -> pd.DataFrame:
+    '''Read a CSV written by the pipeline, parsing the date columns once per unique value
+    Parameters
+    ----------
+    file_path : str
+        Path of the CSV file
+    date_cols : list
+        Date columns, persisted as YYYY-MM-DD
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with datetime64 date columns'''
+    df = pd.read_csv(file_path, dtype={col: str for col in date_cols}, **kwargs)
+    for col in date_cols:
+        df[col] = parse_dates(df[col])
+    return df
+
+def numeric_fill_value(values: pd.Series) -> float:
+    '''Compute the value to input missing values in a numeric column: the mean if the column is
+    almost symmetric (|skew|<0.5), otherwise the median
+    Parameters
+    ----------
+    values : pd.Series
+        Numeric column with missing values
+    Returns
+    -------
+    float
+        Value to fill the missing values'''
+    from scipy import stats
+    if -0.5<stats.skew(values.dropna())<0.5:
+        return values.mean()
+    return values.median()
+
 def input_numeric_col(df: pd.DataFrame, col: str='knn') -> pd.DataFrame:
     '''Input missing values in numeric columns
     Parameters
@@ -40,22 +156,23 @@ def input_numeric_col(df: pd.DataFrame, col: str='knn') -> pd.DataFrame:
         DataFrame with inputed missing values'''
     assert col in df.columns.tolist() or col=='knn', 'Column not in DataFrame'
     if col!='knn':
-        if -0.5<stats.skew(df[col].dropna())<0.5:
-            df[col] = df[col].fillna(df[col].mean())
-        else:
-            df[col] = df[col].fillna(df[col].median())
+        df[col] = df[col].fillna(numeric_fill_value(df[col]))
     else:
+        from sklearn.impute import KNNImputer
         imputer = KNNImputer(n_neighbors=3)
         df_imputed = imputer.fit_transform(df)
         df = pd.DataFrame(df_imputed, columns=df.columns)
     return df
 
-def years_computing(dataset: pd.DataFrame) -> pd.DataFrame:
+@instrumented
+def years_computing(dataset: pd.DataFrame, now: datetime.datetime=None) -> pd.DataFrame:
     '''Compute years from date of birth and clean some values
     Parameters
     ----------
     dataset : pd.DataFrame
         DataFrame with date of birth column
+    now : datetime.datetime, optional
+        Reference date of the years. If None uses the current time, by default None
     Returns
     -------
     pd.DataFrame
@@ -68,11 +185,35 @@ def years_computing(dataset: pd.DataFrame) -> pd.DataFrame:
     }
     dataset['Desc_Cargo'] = dataset['Desc_Cargo'].replace(desc_cargo_eq)
     dataset_ = dataset.copy()
-    dataset_.insert(10, 'anios', (datetime.datetime.now()-dataset.fecha_nacimiento).dt.days//365.25)
+    now = datetime.datetime.now() if now is None else now
+    dataset_.insert(10, 'anios', (now-dataset.fecha_nacimiento).dt.days//365.25)
     dataset_ = dataset_.drop('fecha_nacimiento', axis=1)
     dataset_ = dataset_[~(dataset_.causa_retiro=='MUERTE DEL TRABAJADOR')]
     return dataset_
 
+#DANE totals, feature_dane divides the counts of feature_bars by them
+total_counting = {
+    'TP27_PERSO': 'persons', #número total de personas
+    'TVIVIENDA': 'houses', #conteo de viviendas
+    'CTNENCUEST': 'surveys', #cantidad de encuestas
+    'TP16_HOG': 'homes'
+}
+feature_bars = {
+    'TP27_PERSO': [
+        'TP51_13_ED', 'TP51SUPERI', 'TP51SECUND', 'TP51PRIMAR', 'TP51_99_ED', 'TP34_6_EDA',
+        'TP34_8_EDA', 'TP34_7_EDA', 'TP34_3_EDA', 'TP34_5_EDA', 'TP34_9_EDA', 'TP34_4_EDA',
+        'TP34_2_EDA', 'TP34_1_EDA', 'TP32_1_SEX', 'TP32_2_SEX', 'TP51POSTGR'
+    ],
+    'TVIVIENDA': [
+        'TP9_1_USO', 'TP19_INTE1', 'TP19_GAS_1', 'TP19_ACU_1', 'TP19_GAS_9',
+        'TP19_EE_E2', 'TP19_EE_E3', 'TP19_EE_E5', 'TP19_EE_E6', 'TP15_1_OCU',
+        'TP14_2_TIP', 'TP9_2_USO', 'TP14_6_TIP', 'TP15_2_OCU', 'TP14_4_TIP',
+    ],
+    'CTNENCUEST': ['TP4_2_NO', 'TP3_2_NO'],
+    'TP16_HOG': ['TP27_PERSO']
+}
+
+@instrumented
 def feature_dane(df: pd.DataFrame) -> pd.DataFrame:
     '''Feature engineering for DANE columns. It divides for total feature count in the fields of
     Persons, Houses, Surveys and Homes. This is done to avoid high correlation between these 
@@ -85,26 +226,6 @@ def feature_dane(df: pd.DataFrame) -> pd.DataFrame:
     -------
     pd.DataFrame
         DataFrame with featured DANE columns'''
-    total_counting = {
-        'TP27_PERSO': 'persons', #número total de personas
-        'TVIVIENDA': 'houses', #conteo de viviendas
-        'CTNENCUEST': 'surveys', #cantidad de encuestas
-        'TP16_HOG': 'homes'
-    }
-    feature_bars = {
-        'TP27_PERSO': [
-            'TP51_13_ED', 'TP51SUPERI', 'TP51SECUND', 'TP51PRIMAR', 'TP51_99_ED', 'TP34_6_EDA',
-            'TP34_8_EDA', 'TP34_7_EDA', 'TP34_3_EDA', 'TP34_5_EDA', 'TP34_9_EDA', 'TP34_4_EDA',
-            'TP34_2_EDA', 'TP34_1_EDA', 'TP32_1_SEX', 'TP32_2_SEX', 'TP51POSTGR'
-        ],
-        'TVIVIENDA': [
-            'TP9_1_USO', 'TP19_INTE1', 'TP19_GAS_1', 'TP19_ACU_1', 'TP19_GAS_9',
-            'TP19_EE_E2', 'TP19_EE_E3', 'TP19_EE_E5', 'TP19_EE_E6', 'TP15_1_OCU',
-            'TP14_2_TIP', 'TP9_2_USO', 'TP14_6_TIP', 'TP15_2_OCU', 'TP14_4_TIP',
-        ],
-        'CTNENCUEST': ['TP4_2_NO', 'TP3_2_NO'],
-        'TP16_HOG': ['TP27_PERSO']
-    }
     featured_dataset, drop_vars = df.copy(), []
     for key, value in feature_bars.items():
         for var in value:
@@ -114,6 +235,21 @@ def feature_dane(df: pd.DataFrame) -> pd.DataFrame:
     featured_dataset = featured_dataset.drop(np.unique(drop_vars), axis=1)
     return featured_dataset
 
+def mark_outliers(dataset_: pd.DataFrame) -> pd.DataFrame:
+    '''Set as missing the outliers in the years column
+    Parameters
+    ----------
+    dataset_ : pd.DataFrame
+        DataFrame with years column
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with missing values in place of the outliers in years column'''
+    dataset_.loc[dataset_.anios<18, 'anios'] = np.nan
+    dataset_.loc[dataset_.anios>60, 'anios'] = np.nan
+    return dataset_
+
+@instrumented
 def outliers_remotion(dataset_: pd.DataFrame) -> pd.DataFrame:
     '''Remove outliers in the years column
     Parameters
@@ -124,13 +260,116 @@ def outliers_remotion(dataset_: pd.DataFrame) -> pd.DataFrame:
     -------
     pd.DataFrame
         DataFrame without outliers in years column'''
-    dataset_.loc[dataset_.anios<18, 'anios'] = np.nan
-    dataset_.loc[dataset_.anios>60, 'anios'] = np.nan
+    dataset_ = mark_outliers(dataset_)
     dataset_ = input_numeric_col(dataset_, 'anios')
     return dataset_
 
-def get_dummies(dataset_: pd.DataFrame, cat_cols: list, labeling_scope: bool=True) -> pd.DataFrame:
-    '''Get dummies for categorical columns and encode objective variable
+def dummy_vocabulary(datasets, cat_cols: list, min_count: int=1) -> dict:
+    '''Learn the categories of every categorical column over the training data, to encode it and
+    any later batch (e.g. the deploy set) with the same dummy columns. Reference categories
+    (reference_categories) get no dummy column.
+    Parameters
+    ----------
+    datasets : pd.DataFrame or list
+        DataFrame or list of DataFrames (e.g. partitions of the same dataset) with categorical columns
+    cat_cols : list
+        List with categorical columns
+    min_count : int, optional
+        Categories with less rows are encoded in the other bucket, by default 1
+    Returns
+    -------
+    dict
+        Dictionary with the sorted categories (as str) by column'''
+    datasets = [datasets] if isinstance(datasets, pd.DataFrame) else datasets
+    vocabulary = {}
+    for col in cat_cols:
+        counts = pd.concat([dataset_[col].astype(str).value_counts() for dataset_ in datasets]).groupby(level=0).sum()
+        vocabulary[col] = sorted(
+            value for value, count in counts.items()
+            if count>=min_count and value!=reference_categories.get(col)
+        )
+    return vocabulary
+
+def dummy_columns(vocabulary: dict, other: bool=True) -> list:
+    '''Names of the dummy columns of a vocabulary: a column by category and, if other, the other bucket'''
+    return [f'{col}_{value}' for col, categories in vocabulary.items() for value in categories+[other_category]*other]
+
+def vocabulary_path(prefix: str='') -> str:
+    '''Path of the dummies vocabulary learnt on the train dataset of a run'''
+    return os.path.join(output_path, 'models', f'{prefix}_dummy_vocabulary.json')
+
+def save_vocabulary(vocabulary: dict, prefix: str='') -> None:
+    '''Save a dummies vocabulary to a JSON file'''
+    with open(vocabulary_path(prefix), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(vocabulary, indent=4))
+
+def load_vocabulary(prefix: str='') -> dict:
+    '''Load the dummies vocabulary of a run, None if the train dataset was not processed yet'''
+    if not os.path.exists(vocabulary_path(prefix)):
+        return None
+    with open(vocabulary_path(prefix), 'r', encoding='utf-8') as f:
+        return json.loads(f.read())
+
+def prediction_vocabulary(set_: str, fit, prefix: str='') -> dict:
+    '''Dummies vocabulary of a prediction set: the train set fits and saves it and the deploy set
+    loads it, so both sets get the same dummy columns (the deploy set fits its own vocabulary if the
+    train set was not processed).
+    Parameters
+    ----------
+    set_ : str
+        Dataset, 'train' or 'deploy'
+    fit : callable
+        Function without arguments that fits the vocabulary on the set, like dummy_vocabulary
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    dict
+        Dictionary with the categories by column'''
+    vocabulary = load_vocabulary(prefix) if set_=='deploy' else None
+    if vocabulary is None:
+        vocabulary = fit()
+        if set_=='train':
+            save_vocabulary(vocabulary, prefix)
+    return vocabulary
+
+def encode_categoricals(dataset_: pd.DataFrame, vocabulary: dict, other: bool=True) -> np.ndarray:
+    '''One-hot encode categorical columns with a fixed vocabulary. Categories out of the vocabulary
+    go to the other bucket of their column and reference categories have no column.
+    Parameters
+    ----------
+    dataset_ : pd.DataFrame
+        DataFrame with the categorical columns of the vocabulary
+    vocabulary : dict
+        Dictionary with the categories by column, as returned by dummy_vocabulary
+    other : bool, optional
+        If False there is no other bucket and categories out of the vocabulary get no column, by default True
+    Returns
+    -------
+    np.ndarray
+        uint8 matrix with a column by dummy_columns(vocabulary, other)'''
+    rows, cols, offset = [], [], 0
+    for col, categories in vocabulary.items():
+        values = dataset_[col].astype(str)
+        codes = pd.Categorical(values, categories=categories).codes.astype(np.int64)
+        if other:
+            codes[(codes<0)&(values!=reference_categories.get(col)).to_numpy()] = len(categories)
+        rows.append(np.flatnonzero(codes>=0))
+        cols.append(codes[codes>=0]+offset)
+        offset += len(categories)+other
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    matrix = np.zeros((len(dataset_), offset), dtype=np.uint8)
+    matrix[rows, cols] = 1
+    return matrix
+
+@instrumented
+def get_dummies(
+    dataset_: pd.DataFrame,
+    cat_cols: list,
+    labeling_scope: bool=True,
+    vocabulary: dict=None
+    ) -> pd.DataFrame:
+    '''Get uint8 dummies for categorical columns and encode objective variable
     Parameters
     ----------
     dataset_ : pd.DataFrame
@@ -139,18 +378,22 @@ def get_dummies(dataset_: pd.DataFrame, cat_cols: list, labeling_scope: bool=Tru
         List with categorical columns
     labeling_scope : bool, optional
         If True, encode objective variable for scope analysis, by default True
+    vocabulary : dict, optional
+        Fixed categories by column (see dummy_vocabulary). If None it is learnt from dataset_, without
+        the other bucket (it would have no rows), by default None
     Returns
     -------
     pd.DataFrame
         DataFrame with dummies and encoded objective variable'''
-    cat_dataset = dataset_[cat_cols]
-    cat_dataset = cat_dataset.astype({var: str for var in cat_cols})
+    other = vocabulary is not None
+    vocabulary = dummy_vocabulary(dataset_, cat_cols) if vocabulary is None else vocabulary
     numeric_data = dataset_[dataset_.columns[~dataset_.columns.isin(cat_cols)]]
     objective_var = numeric_data[['causa_retiro']]
     numeric_data = numeric_data.drop('causa_retiro', axis=1)
     #setting dtypes
     numeric_data = numeric_data.astype({'anios': int})
-    dummies = (pd.get_dummies(cat_dataset)*1).drop('genero_F', axis=1)
+    dummies = encode_categoricals(dataset_, vocabulary, other)
+    dummies = pd.DataFrame(dummies, index=dataset_.index, columns=dummy_columns(vocabulary, other))
     dataset_ = dummies.join(numeric_data).join(objective_var)
     #encoding scope variable
     if labeling_scope:
@@ -0,0 +1,197 @@
+#Offline resolver of Bogotá addresses. Addresses in the city nomenclature (e.g. 'Calle 45 # 13-20') are
+#parsed into grid coordinates: the calle number (negative to the south) and the carrera number (negative
+#to the east), where the house number moves along the block ('CL 45 # 13-20' is 20 meters after KR 13).
+#The coordinates are resolved against a gazetteer of intersections learnt from previous geocoder results.
+import os, re, unicodedata
+import pandas as pd, numpy as np
+
+from src.commons.tools import output_path
+
+#Bogotá bounding box, results of the geocoder out of it are not learnt
+bogota_bounds = {'latitude': (4.45, 4.85), 'longitude': (-74.25, -73.98)}
+via_types = {
+    'AC': ['AVENIDA CALLE', 'AV CALLE', 'AV CL', 'AVENIDA CL', 'AC'],
+    'AK': ['AVENIDA CARRERA', 'AV CARRERA', 'AV KR', 'AV CRA', 'AVENIDA KR', 'AK'],
+    'CL': ['CALLE', 'CLLE', 'CALL', 'CLL', 'CL'],
+    'KR': ['CARRERA', 'CARR', 'CRA', 'KRA', 'CRR', 'CR', 'KR'],
+    'DG': ['DIAGONAL', 'DIAG', 'DG'],
+    'TV': ['TRANSVERSAL', 'TRANSV', 'TRV', 'TV', 'TR']
+}
+#via types numbered like the calles, the rest are numbered like the carreras
+calle_types = ['CL', 'AC', 'DG']
+via_pattern = re.compile(r'^({})\b'.format('|'.join(
+    sorted([variant for variants in via_types.values() for variant in variants], key=len, reverse=True)
+)))
+via_codes = {variant: code for code, variants in via_types.items() for variant in variants}
+axis = r'(\d+) ?([A-H])?(?: ?(BIS))? ?([A-H])?'
+address_pattern = re.compile(
+    rf'^(?P<via>CL|KR|DG|TV|AC|AK) {axis}(?: (?P<q1>SUR|ESTE))? {axis} (?P<placa>\d{{1,3}})(?: (?P<q2>SUR|ESTE))?\b'
+)
+
+def normalize_address(address: str) -> str:
+    '''Normalize a Colombian address: upper case without accents, number signs and dashes, and
+    the via type abbreviated (e.g. 'Carrera 13 # 45-20 Sur' -> 'KR 13 45 20 SUR')'''
+    address = unicodedata.normalize('NFKD', str(address)).encode('ascii', 'ignore').decode().upper()
+    address = re.sub(r'\b(NO|NUM|NRO)\b|[#°º\-,.]', ' ', address)
+    address = re.sub(r'\s+', ' ', address).strip()
+    via = via_pattern.match(address)
+    if via is None:
+        return address
+    return f'{via_codes[via.group(1)]} {address[via.end():].strip()}'
+
+def axis_value(number: str, letter: str, bis: str, letter2: str) -> float:
+    '''Position of a street in the grid: 45 A BIS B -> 45 + .1 + .05 + .02'''
+    value = float(number)
+    value += (ord(letter)-64)*.1 if letter else 0
+    value += .05 if bis else 0
+    value += (ord(letter2)-64)*.01 if letter2 else 0
+    return value
+
+def parse_address(address: str) -> tuple:
+    '''Parse an address of the Bogotá nomenclature into grid coordinates.
+    Parameters
+    ----------
+    address : str
+        Raw address, like 'Calle 45 # 13-20'
+    Returns
+    -------
+    tuple
+        (calle, carrera) grid coordinates, None if the address is not in the nomenclature'''
+    if pd.isna(address):
+        return None
+    match = address_pattern.match(normalize_address(address))
+    if match is None:
+        return None
+    groups = match.groups()
+    main, cross = axis_value(*groups[1:5]), axis_value(*groups[6:10])+int(match.group('placa'))/100
+    quadrants = {match.group('q1'), match.group('q2')}
+    if match.group('via') in calle_types:
+        calle, carrera = main, cross
+    else:
+        carrera, calle = main, cross
+    return (-calle if 'SUR' in quadrants else calle, -carrera if 'ESTE' in quadrants else carrera)
+
+def parse_addresses(addresses: pd.Series) -> pd.DataFrame:
+    '''Parse a column of addresses, once per unique address.
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the calle and carrera grid coordinates, missing if the address is not parsed'''
+    codes, uniques = pd.factorize(addresses)
+    parsed = np.array([parse_address(address) or (np.nan, np.nan) for address in uniques], dtype=float).reshape(-1, 2)
+    grid = np.full((len(addresses), 2), np.nan)
+    grid[codes>=0] = parsed[codes[codes>=0]]
+    return pd.DataFrame(grid, columns=['calle', 'carrera'], index=addresses.index)
+
+def gazetteer_path() -> str:
+    '''Path of the gazetteer of intersections'''
+    return os.path.join(output_path, 'databases', 'bogota_gazetteer.csv')
+
+def load_gazetteer() -> pd.DataFrame:
+    '''Load the gazetteer of intersections, empty if it does not exist yet'''
+    if not os.path.exists(gazetteer_path()):
+        return pd.DataFrame(columns=['calle', 'carrera', 'latitude', 'longitude', 'district', 'count'])
+    return pd.read_csv(gazetteer_path())
+
+def weighted_median(points: pd.DataFrame, column: str) -> pd.Series:
+    '''Median of a column by point of the grid, with every row weighted by its count. It is the
+    median of the values repeated by their counts, without repeating them'''
+    points = points.sort_values(['calle', 'carrera', column])
+    groups = points.groupby(['calle', 'carrera'])['count']
+    cumulative, total = groups.cumsum(), groups.transform('sum')
+    keys = [points.calle, points.carrera]
+    #the values at the middle positions of the repeated values, averaged when the total is even
+    low = points[column].where(cumulative>(total-1)//2).groupby(keys).first()
+    high = points[column].where(cumulative>total//2).groupby(keys).first()
+    return (low+high)/2
+
+def update_gazetteer(gazetteer: pd.DataFrame, addresses: pd.Series, geocoded: pd.DataFrame) -> pd.DataFrame:
+    '''Learn the intersections of geocoder results: every parsed address inside Bogotá adds its
+    coordinates to the point of the grid, which keeps the median position and the most common district.
+    The gazetteer is a running summary, a row per point weighted by its count, so updating it costs
+    the points and the new results, not all the results ever learnt.
+    Parameters
+    ----------
+    gazetteer : pd.DataFrame
+        Current gazetteer, as returned by load_gazetteer
+    addresses : pd.Series
+        Raw addresses
+    geocoded : pd.DataFrame
+        Geocoder results of the addresses, with the columns district, latitude and longitude
+    Returns
+    -------
+    pd.DataFrame
+        The updated gazetteer'''
+    points = parse_addresses(addresses).join(geocoded[['latitude', 'longitude', 'district']])
+    points = points.dropna(subset=['calle', 'carrera', 'latitude', 'longitude'])
+    for col, (low, high) in bogota_bounds.items():
+        points = points[points[col].between(low, high)]
+    points = points.assign(count=1)
+    points = pd.concat([gazetteer, points] if len(gazetteer) else [points], ignore_index=True).round({'calle': 2, 'carrera': 2})
+    points = points.astype({'calle': float, 'carrera': float, 'latitude': float, 'longitude': float, 'count': int})
+    updated = points.groupby(['calle', 'carrera'])['count'].sum().to_frame()
+    updated['latitude'] = weighted_median(points, 'latitude')
+    updated['longitude'] = weighted_median(points, 'longitude')
+    #most common district by count, the first in order on ties
+    districts = points.dropna(subset=['district']).groupby(['calle', 'carrera', 'district'], as_index=False)['count'].sum()
+    districts = districts.sort_values(['count', 'district'], ascending=[False, True]).drop_duplicates(['calle', 'carrera'])
+    updated['district'] = districts.set_index(['calle', 'carrera']).district
+    updated['district'] = updated.district.astype(object).where(updated.district.notna(), None)
+    return updated.reset_index()[['calle', 'carrera', 'latitude', 'longitude', 'district', 'count']]
+
+def resolve_addresses(addresses: pd.Series, gazetteer: pd.DataFrame, neighbors: int=6, max_distance: float=5.) -> pd.DataFrame:
+    '''Resolve addresses to coordinates with the gazetteer. Addresses on a known point of the grid
+    take its position (confidence 1); the rest are interpolated with an affine fit of the grid over
+    the nearest known points, with a confidence that decreases with the distance to the nearest one
+    and is 0 when there are not enough points within max_distance streets.
+    Parameters
+    ----------
+    addresses : pd.Series
+        Raw addresses
+    gazetteer : pd.DataFrame
+        Gazetteer of intersections, as returned by update_gazetteer
+    neighbors : int, optional
+        Known points used by interpolation, by default 6
+    max_distance : float, optional
+        Maximum distance in streets to the known points, by default 5.
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the columns city, district, latitude, longitude and confidence'''
+    grid = parse_addresses(addresses)
+    resolved = pd.DataFrame(
+        {'city': None, 'district': None, 'latitude': np.nan, 'longitude': np.nan, 'confidence': 0.},
+        index=addresses.index
+    )
+    parsed = grid.dropna()
+    if len(gazetteer)<3 or not len(parsed):
+        return resolved
+    from scipy.spatial import cKDTree
+    known = gazetteer[['calle', 'carrera']].to_numpy(dtype=float)
+    positions = gazetteer[['latitude', 'longitude']].to_numpy(dtype=float)
+    distances, nearest = cKDTree(known).query(parsed.to_numpy(), k=min(neighbors, len(gazetteer)))
+    latitudes, longitudes, confidences = [], [], []
+    for point, point_distances, point_nearest in zip(parsed.to_numpy(), distances, nearest):
+        close = point_nearest[point_distances<=max_distance]
+        if point_distances[0]==0:
+            latitude, longitude = positions[point_nearest[0]]
+            confidence = 1.
+        elif len(close)>=3 and np.linalg.matrix_rank(np.c_[np.ones(len(close)), known[close]])==3:
+            design = np.c_[np.ones(len(close)), known[close]]
+            coefficients = np.linalg.lstsq(design, positions[close], rcond=None)[0]
+            latitude, longitude = np.r_[1, point]@coefficients
+            confidence = 1-point_distances[0]/max_distance
+        else:
+            latitude, longitude, confidence = np.nan, np.nan, 0.
+        if not (bogota_bounds['latitude'][0]<=latitude<=bogota_bounds['latitude'][1]) or \
+            not (bogota_bounds['longitude'][0]<=longitude<=bogota_bounds['longitude'][1]):
+            latitude, longitude, confidence = np.nan, np.nan, 0.
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+        confidences.append(confidence)
+    resolved.loc[parsed.index, 'latitude'] = latitudes
+    resolved.loc[parsed.index, 'longitude'] = longitudes
+    resolved.loc[parsed.index, 'confidence'] = confidences
+    resolved.loc[parsed.index, 'district'] = gazetteer.district.to_numpy()[nearest[:, 0]]
+    resolved.loc[resolved.confidence>0, 'city'] = 'Bogotá'
+    return resolved
@@ -0,0 +1,182 @@
+#Compiled inference of the (StandardScaler, MLPClassifier) pipeline. The fitted pipeline is exported
+#to NumPy arrays, with the scaler folded into the first layer (W' = W/scale, b' = b-(mean/scale)@W),
+#and scored with a plain forward pass, so scoring does not import sklearn nor pay its validation.
+import json, os, pickle, time, warnings
+import pandas as pd, numpy as np
+import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
+
+activations = {
+    'identity': lambda x: x,
+    'tanh': np.tanh,
+    'relu': lambda x: np.maximum(x, 0),
+    'logistic': lambda x: 1/(1+np.exp(-x))
+}
+
+def compiled_path(model_path: str) -> str:
+    '''Path of the compiled model, next to the pickled model'''
+    return f'{os.path.splitext(model_path)[0]}_compiled.npz'
+
+class CompiledModel:
+    '''Forward pass of a compiled MLP pipeline, with the predict and predict_proba interface of the
+    sklearn classifier (the only methods used to score and explain the model)'''
+    def __init__(self, weights: list, biases: list, activation: str, out_activation: str, classes: np.ndarray, variables: np.ndarray, model_hash: str=None):
+        self.weights, self.biases = weights, biases
+        self.activation, self.out_activation = activation, out_activation
+        self.classes, self.variables = classes, variables
+        self.model_hash = model_hash
+
+    def predict_proba(self, X) -> np.ndarray:
+        '''Probabilities of the classes, X is a DataFrame with the model variables or an array'''
+        if isinstance(X, pd.DataFrame):
+            #selecting the columns costs more than the forward pass, it is skipped if they are in order
+            X = X if X.columns.equals(pd.Index(self.variables)) else X[self.variables]
+            X = X.to_numpy(dtype=float)
+        x = np.asarray(X, dtype=float)
+        for weights, biases in zip(self.weights[:-1], self.biases[:-1]):
+            x = activations[self.activation](x@weights+biases)
+        x = x@self.weights[-1]+self.biases[-1]
+        if self.out_activation=='softmax':
+            x = np.exp(x-x.max(axis=1, keepdims=True))
+            return x/x.sum(axis=1, keepdims=True)
+        x = activations[self.out_activation](x)
+        return np.hstack([1-x, x])
+
+    def predict(self, X) -> np.ndarray:
+        '''Predicted classes'''
+        return self.classes[np.argmax(self.predict_proba(X), axis=1)]
+
+def compile_pipeline(model, variables, model_hash: str=None) -> CompiledModel:
+    '''Compile a fitted Pipeline of StandardScaler and MLPClassifier (or a bare MLPClassifier).
+    Parameters
+    ----------
+    model : sklearn Pipeline
+        Fitted pipeline, its steps before the classifier must be StandardScaler
+    variables : list
+        Variables of the model, in order
+    model_hash : str, optional
+        SHA-256 of the pickled model, to detect stale compiled models, by default None
+    Returns
+    -------
+    CompiledModel
+        The compiled model'''
+    #the compiled model takes the columns in the order of variables, it must be the fitted order
+    fitted = getattr(model, 'feature_names_in_', None)
+    if fitted is not None and list(fitted)!=list(variables):
+        raise ValueError('the model variables are not in the order the pipeline was fitted on')
+    steps = [step for _, step in model.steps] if hasattr(model, 'steps') else [model]
+    classifier = steps[-1]
+    weights = [np.array(coefs, dtype=float) for coefs in classifier.coefs_]
+    biases = [np.array(intercepts, dtype=float) for intercepts in classifier.intercepts_]
+    for scaler in reversed(steps[:-1]):
+        if type(scaler).__name__!='StandardScaler':
+            raise ValueError(f'only StandardScaler steps can be compiled, found {type(scaler).__name__}')
+        #mean_ is fitted even with with_mean=False, only the flags tell what transform applies
+        scale = scaler.scale_ if scaler.with_std else np.ones(weights[0].shape[0])
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(weights[0].shape[0])
+        biases[0] = biases[0]-(mean/scale)@weights[0]
+        weights[0] = weights[0]/scale[:, None]
+    return CompiledModel(
+        weights, biases, classifier.activation, classifier.out_activation_,
+        np.asarray(classifier.classes_), np.asarray(variables, dtype=str), model_hash
+    )
+
+def save_compiled(compiled: CompiledModel, file_path: str) -> None:
+    '''Save a compiled model to a npz file of NumPy arrays (no pickles)'''
+    meta = {
+        'activation': compiled.activation,
+        'out_activation': compiled.out_activation,
+        'layers': len(compiled.weights),
+        'model_hash': compiled.model_hash
+    }
+    arrays = {f'weights_{i}': weights for i, weights in enumerate(compiled.weights)}
+    arrays.update({f'biases_{i}': biases for i, biases in enumerate(compiled.biases)})
+    with open(file_path, 'wb') as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), classes=compiled.classes, variables=compiled.variables, **arrays)
+
+def load_compiled(file_path: str) -> CompiledModel:
+    '''Load a compiled model saved by save_compiled'''
+    with np.load(file_path, allow_pickle=False) as arrays:
+        meta = json.loads(str(arrays['meta']))
+        return CompiledModel(
+            [arrays[f'weights_{i}'] for i in range(meta['layers'])],
+            [arrays[f'biases_{i}'] for i in range(meta['layers'])],
+            meta['activation'], meta['out_activation'],
+            arrays['classes'], arrays['variables'], meta['model_hash']
+        )
+
+def load_compiled_model(model_path: str) -> CompiledModel:
+    '''Compiled model of a pickled model, None if it was not exported or the pickle changed after the
+    export (e.g. replaced by the incremental stage)'''
+    file_path = compiled_path(model_path)
+    if not os.path.exists(file_path):
+        return None
+    compiled = load_compiled(file_path)
+    return compiled if compiled.model_hash==data_tools.file_hash(model_path) else None
+
+def verify_compiled(model, compiled: CompiledModel, X: pd.DataFrame, atol: float=1e-9) -> float:
+    '''Check that the compiled model reproduces predict_proba and predict of the pipeline
+    Returns
+    -------
+    float
+        Maximum absolute difference of the probabilities'''
+    expected, probabilities = model.predict_proba(X), compiled.predict_proba(X)
+    difference = float(np.abs(expected-probabilities).max()) if len(X) else 0.
+    if difference>atol or not np.array_equal(model.predict(X), compiled.predict(X)):
+        raise ValueError(f'compiled model differs from the pipeline (max difference {difference})')
+    return difference
+
+def latency(predict, X: pd.DataFrame, repeat: int=200) -> float:
+    '''Median seconds of scoring a single row'''
+    rows = [X.iloc[[i % len(X)]] for i in range(repeat)]
+    times = []
+    for row in rows:
+        start = time.perf_counter()
+        predict(row)
+        times.append(time.perf_counter()-start)
+    return float(np.median(times))
+
+@instrumented
+def export_model(model_path: str, prefix: str='') -> dict:
+    '''Compile a pickled (model, variables) tuple next to it, verified against predict_proba over
+    the train dataset of the run, and save a report with the single row latency of both models.
+    Parameters
+    ----------
+    model_path : str
+        Path of the pickle with the (model, variables) tuple, like models/perceptron_model.pkl
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    dict
+        Dictionary with the compiled model path, the maximum difference and the latencies'''
+    from src.data_processing import predictive_data_mining as predictive
+    print('compiling model...')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with open(model_path, 'rb') as f:
+            model, variables = pickle.load(f)
+    compiled = compile_pipeline(model, variables, data_tools.file_hash(model_path))
+    file_path = os.path.join(data_tools.output_path, 'predictive_mining', 'train_set', f'{prefix}_non_correlated_dataset_train.csv')
+    if os.path.exists(file_path):
+        X = predictive.model_variables(pd.read_csv(file_path), variables)
+    else:
+        #without the train dataset the model is verified on random rows around the scaler statistics
+        print('     train dataset not found, verifying on random rows...')
+        scaler = model.steps[0][1] if hasattr(model, 'steps') else None
+        mean = getattr(scaler, 'mean_', None) if scaler is not None else None
+        scale = getattr(scaler, 'scale_', None) if scaler is not None else None
+        rows = np.random.default_rng(0).normal(size=(1000, len(variables)))
+        rows = rows*(1 if scale is None else scale)+(0 if mean is None else mean)
+        X = pd.DataFrame(rows, columns=list(variables))
+    report = {'model': model_path, 'compiled': compiled_path(model_path), 'rows': len(X)}
+    report['max_difference'] = verify_compiled(model, compiled, X)
+    save_compiled(compiled, compiled_path(model_path))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        report['pipeline_latency'] = latency(model.predict_proba, X)
+    report['compiled_latency'] = latency(load_compiled(compiled_path(model_path)).predict_proba, X)
+    print(f"     max difference {report['max_difference']:.2e}, single row latency {report['pipeline_latency']*1e6:.0f}us -> {report['compiled_latency']*1e6:.0f}us")
+    with open(os.path.join(data_tools.output_path, 'models', f'{prefix}_compiled_model.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(report, indent=4))
+    return report
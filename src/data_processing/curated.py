@@ -1,12 +1,22 @@
-import json, os
+import os
 from typing import Tuple, Any
 import pandas as pd
 import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
 
+date_cols = ['fecha_ingreso', 'fecha_final', 'fecha_retiro', 'fecha_nacimiento']
+#row key of the contracts of the geocoding stage, only used to match runs
+row_key_col = 'row_key'
+#contract id, kept (as the last column) in the train set to identify the contracts a model was trained on
+contract_col = 'id_contrato'
+#columns dropped from every set
+set_drops = {
+    'train': ['fecha_retiro', 'fecha_final', 'fecha_ingreso', 'NMB_LC_CM'],
+    'deploy': ['fecha_retiro', 'fecha_final', 'fecha_ingreso', 'NMB_LC_CM', contract_col],
+    'descriptive': ['fecha_final', 'id_destino', 'id_nivel_academico', 'subsidio_tte', contract_col]
+}
 
-with open(os.path.join(data_tools.input_path, 'column-curated.json'), 'r', encoding='utf-8') as f:
-    column_drops = json.loads(f.read())
-
+@instrumented
 def read_data(prefix: str='') -> Tuple[pd.DataFrame]:
     '''Read input data
     Parameters
@@ -17,11 +27,20 @@ def read_data(prefix: str='') -> Tuple[pd.DataFrame]:
     -------
     Tuple[pd.DataFrame]
         Tuple with the DataFrames: dane_enriched, dane_dict, business_dict'''
-    training_set = os.path.join(data_tools.output_path, 'databases', f'{prefix}_dane_enriched_db.csv')
-    dane_enriched = pd.read_csv(
-        training_set,
-        parse_dates=['fecha_ingreso', 'fecha_final', 'fecha_retiro', 'fecha_nacimiento']
-    )
+    dane_enriched = data_tools.read_csv_dates(enriched_path(prefix), date_cols)
+    dane_dict, business_dict = read_dictionaries()
+    return dane_enriched, dane_dict, business_dict
+
+def enriched_path(prefix: str='') -> str:
+    '''Path of the DANE enriched database of the geocoding stage'''
+    return os.path.join(data_tools.output_path, 'databases', f'{prefix}_dane_enriched_db.csv')
+
+def read_dictionaries() -> Tuple[pd.DataFrame]:
+    '''Read the DANE and business data dictionaries
+    Returns
+    -------
+    Tuple[pd.DataFrame]
+        Tuple with the DataFrames: dane_dict, business_dict'''
     dane_dict = pd.read_excel(
         os.path.join(data_tools.input_path, 'DICCIONARIO_DATOS_DANE.xlsx'),
         sheet_name='MGN_ANM_MANZANA',
@@ -32,31 +51,51 @@ def read_data(prefix: str='') -> Tuple[pd.DataFrame]:
         sheet_name='DICCIONARIO FINAL',
         skiprows=3
     ).drop('Unnamed: 0', axis=1)
-    return dane_enriched, dane_dict, business_dict
+    return dane_dict, business_dict
 
-def input_missing_values(
-    dane_enriched: pd.DataFrame,
+def drop_curated_cols(dane_enriched: pd.DataFrame) -> pd.DataFrame:
+    '''Drop the irrelevant and geocoding columns of the DANE enriched DataFrame. The contract id is
+    kept as the last column, it is dropped from the deploy and descriptive sets by split_sets
+    Parameters
+    ----------
+    dane_enriched : pd.DataFrame
+        DataFrame coming from geocode_data script
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame without irrelevant and geocoding columns'''
+    column_drops = data_tools.read_config('column-curated.json')
+    base_curated = dane_enriched.drop([col for col in column_drops['irrelevant_cols'] if col!=contract_col], axis=1)
+    base_curated = base_curated.drop([col for col in [row_key_col] if col in base_curated.columns], axis=1)
+    base_curated = base_curated.drop(column_drops['geocoded_dane_col_drops'], axis=1)
+    return base_curated[[col for col in base_curated.columns if col!=contract_col]+[contract_col]]
+
+def imputation_plan(
+    base_curated: pd.DataFrame,
     dane_dict: pd.DataFrame,
     business_dict: pd.DataFrame
-    ) -> Tuple[Any]:
-    '''Input missing values in the DataFrame
+    ) -> dict:
+    '''Compute the global statistics to input missing values: columns with more than 15% of missing
+    values are dropped, discrete columns are filled with the mode and continuous ones with the mean
+    or the median
     Parameters
     ----------
-    dane_enriched : pd.DataFrame
-        DataFrame with missing values. The DataFrame is the one coming from geocode_data script
+    base_curated : pd.DataFrame
+        DataFrame with missing values, as returned by drop_curated_cols
     dane_dict : pd.DataFrame
         DataFrame with the DANE data dictionary
     business_dict : pd.DataFrame
         DataFrame with the business data dictionary
     Returns
     -------
-    Tuple[Any]
-        Tuple with the DataFrame with inputed missing values and a list with the dropped columns'''
-    base_curated = dane_enriched.drop(column_drops['irrelevant_cols'], axis=1)
-    base_curated = base_curated.drop(column_drops['geocoded_dane_col_drops'], axis=1)
+    dict
+        Dictionary with the fill values by column (fill_values) and the columns to drop (dropped_cols)'''
     null_counts = pd.DataFrame({col: [round(base_curated[col].isna().sum()*100/len(base_curated), 2)] for col in base_curated.columns}).T
-    dropped_cols = []
+    plan = {'fill_values': {}, 'dropped_cols': []}
     for col in null_counts.index:
+        #missing dates are placeholders (e.g. retirement of active contracts), not missing values
+        if pd.api.types.is_datetime64_any_dtype(base_curated[col]):
+            continue
         if null_counts.loc[col].iloc[0]:
             if null_counts.loc[col].iloc[0]<=15:
                 if col in dane_dict.VARIABLE.tolist():
@@ -64,14 +103,86 @@ def input_missing_values(
                 else:
                     discrete =  business_dict[business_dict['Variable']==col].iloc[0]=='Discreta'
                 if discrete:
-                    base_curated[col] = base_curated[col].fillna(base_curated[col].mode().iloc[0])
+                    plan['fill_values'][col] = base_curated[col].mode().iloc[0]
                 else:
-                    base_curated = data_tools.input_numeric_col(base_curated, col)
+                    plan['fill_values'][col] = data_tools.numeric_fill_value(base_curated[col])
             else:
-                dropped_cols.append(col)
-                base_curated = base_curated.drop(col, axis=1)
-    return base_curated, dropped_cols
+                plan['dropped_cols'].append(col)
+    return plan
+
+def apply_imputation_plan(base_curated: pd.DataFrame, plan: dict) -> pd.DataFrame:
+    '''Input missing values with precomputed global statistics. Works on the whole DataFrame or
+    on any partition of it
+    Parameters
+    ----------
+    base_curated : pd.DataFrame
+        DataFrame with missing values, as returned by drop_curated_cols
+    plan : dict
+        Dictionary with the fill values and the columns to drop, as returned by imputation_plan
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with inputed missing values'''
+    base_curated = base_curated.fillna(plan['fill_values'])
+    base_curated = base_curated.drop(plan['dropped_cols'], axis=1)
+    return base_curated
+
+@instrumented
+def input_missing_values(
+    dane_enriched: pd.DataFrame,
+    dane_dict: pd.DataFrame,
+    business_dict: pd.DataFrame
+    ) -> Tuple[Any]:
+    '''Input missing values in the DataFrame
+    Parameters
+    ----------
+    dane_enriched : pd.DataFrame
+        DataFrame with missing values. The DataFrame is the one coming from geocode_data script
+    dane_dict : pd.DataFrame
+        DataFrame with the DANE data dictionary
+    business_dict : pd.DataFrame
+        DataFrame with the business data dictionary
+    Returns
+    -------
+    Tuple[Any]
+        Tuple with the DataFrame with inputed missing values and a list with the dropped columns'''
+    base_curated = drop_curated_cols(dane_enriched)
+    plan = imputation_plan(base_curated, dane_dict, business_dict)
+    base_curated = apply_imputation_plan(base_curated, plan)
+    return base_curated, plan['dropped_cols']
+
+def split_sets(base_curated: pd.DataFrame) -> dict:
+    '''Split the curated data into the sets for predictive and descriptive mining
+    Parameters
+    ----------
+    base_curated : pd.DataFrame
+        DataFrame with the curated data
+    Returns
+    -------
+    dict
+        Dictionary with the DataFrames: train, deploy, descriptive'''
+    sets = {}
+    sets['train'] = base_curated[base_curated.causa_retiro!='Activo'].drop(set_drops['train'], axis=1)
+    sets['deploy'] = base_curated[base_curated.causa_retiro=='Activo'].drop(set_drops['deploy'], axis=1)
+    sets['descriptive'] = base_curated[base_curated.causa_retiro!='Activo'].drop(set_drops['descriptive'], axis=1)
+    return sets
+
+def save_sets(sets: dict, prefix: str) -> None:
+    '''Save the sets for predictive and descriptive mining
+    Parameters
+    ----------
+    sets : dict
+        Dictionary with the DataFrames: train, deploy, descriptive
+    prefix : str
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests
+    Returns
+    -------
+    None'''
+    sets['train'].to_csv(os.path.join(data_tools.output_path, 'predictive_mining', 'train_set', f'{prefix}_train_without_featuring.csv'), sep=',', index=0)
+    sets['deploy'].to_csv(os.path.join(data_tools.output_path, 'predictive_mining', 'deploy_set', f'{prefix}_deploy_without_featuring.csv'), sep=',', index=0)
+    sets['descriptive'].to_csv(os.path.join(data_tools.output_path, 'descriptive_mining', f'{prefix}_descriptive_without_featuring.csv'), sep=',', index=0)
 
+@instrumented
 def build_sets(base_curated: pd.DataFrame, prefix: str) -> None:
     '''Build the sets for predictive and descriptive mining
     Parameters
@@ -83,32 +194,56 @@ def build_sets(base_curated: pd.DataFrame, prefix: str) -> None:
     Returns
     -------
     None'''
-    train_set = base_curated[base_curated.causa_retiro!='Activo'].drop(
-        ['fecha_retiro', 'fecha_final', 'fecha_ingreso', 'NMB_LC_CM'],
-        axis=1
-    )
-    test_set = base_curated[base_curated.causa_retiro=='Activo'].drop(
-        ['fecha_retiro', 'fecha_final', 'fecha_ingreso', 'NMB_LC_CM'],
-        axis=1
-    )
-    descriptive = base_curated[base_curated.causa_retiro!='Activo'].drop(
-        ['fecha_final', 'id_destino', 'id_nivel_academico', 'subsidio_tte'],
-        axis=1
-    )
-    train_set.to_csv(os.path.join(data_tools.output_path, 'predictive_mining', 'train_set', f'{prefix}_train_without_featuring.csv'), sep=',', index=0)
-    test_set.to_csv(os.path.join(data_tools.output_path, 'predictive_mining', 'deploy_set', f'{prefix}_deploy_without_featuring.csv'), sep=',', index=0)
-    descriptive.to_csv(os.path.join(data_tools.output_path, 'descriptive_mining', f'{prefix}_descriptive_without_featuring.csv'), sep=',', index=0)
+    save_sets(split_sets(base_curated), prefix)
+
+@instrumented
+def lazy_curated_sets(prefix: str='') -> dict:
+    '''Curate the DANE enriched data and split the sets with the Polars lazy backend. The fill
+    values are computed by imputation_plan over the columns with missing values only, and the three
+    sets are collected together, sharing the scan of the CSV.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    dict
+        Dictionary with the DataFrames: train, deploy, descriptive'''
+    import polars as pl
+    from src.commons import polars_tools
+    dane_dict, business_dict = read_dictionaries()
+    column_drops = data_tools.read_config('column-curated.json')
+    lf = polars_tools.scan_csv_dates(enriched_path(prefix), date_cols)
+    irrelevant_cols = [col for col in column_drops['irrelevant_cols'] if col!=contract_col]
+    lf = lf.drop(irrelevant_cols+column_drops['geocoded_dane_col_drops']+[row_key_col], strict=False)
+    lf = lf.select(pl.exclude(contract_col), pl.col(contract_col))
+    missing = polars_tools.collect(lf.select(polars_tools.missing_columns(lf)))
+    lf = polars_tools.apply_imputation_plan(lf, imputation_plan(missing, dane_dict, business_dict))
+    active = pl.col('causa_retiro').eq_missing('Activo')
+    plans = {
+        'train': lf.filter(~active).drop(set_drops['train']),
+        'deploy': lf.filter(active).drop(set_drops['deploy']),
+        'descriptive': lf.filter(~active).drop(set_drops['descriptive'])
+    }
+    return {set_: df.to_pandas() for set_, df in zip(plans, pl.collect_all(list(plans.values())))}
 
-def curate_without_featuring(prefix: str=''):
+@instrumented
+def curate_without_featuring(prefix: str='', backend: str='pandas'):
     '''Curate data without featuring
     Parameters
     ----------
     prefix : str, optional
         Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    backend : str, optional
+        Dataframe engine, 'pandas' or 'polars' (lazy query plan, same outputs), by default 'pandas'
     Returns
     -------
     None'''
     print('process curated data...')
+    if backend=='polars':
+        print('     curating with the polars backend...')
+        save_sets(lazy_curated_sets(prefix), prefix)
+        return
     print('     reading inputs...')
     dane_enriched, dane_dict, business_dict = read_data(prefix)
     print('     input missing values...')
@@ -0,0 +1,238 @@
+import datetime, json, os
+import pandas as pd, numpy as np
+import src.commons.tools as data_tools
+from src.commons.tools import output_path
+from src.commons.instrumentation import instrumented
+from src.data_processing import geocode_data
+import src.data_processing.curated as curated
+import src.data_processing.predictive_data_mining as predictive
+import src.data_processing.descriptive_data_mining as descriptive
+from src.data_processing.partitioned import predictive_partition
+
+key_col = 'id_contrato'
+row_key_col = geocode_data.row_key_col
+address_cols = ['direccion', 'barrio']
+position_cols = ['latitude', 'longitude']
+#days a cache of row-wise features is reused before recomputing every row (the years are kept at
+#the date the cache was started, so they are refreshed with it)
+max_cache_days = 30
+
+def database_path(name: str, prefix: str='') -> str:
+    '''Path of a database of a run, like {prefix}_precurated.csv'''
+    return os.path.join(output_path, 'databases', f'{prefix}_{name}.csv')
+
+def row_features_path(name: str, prefix: str='') -> str:
+    '''Path of the cache of the row-wise features of a set of a run'''
+    return os.path.join(output_path, 'databases', f'{prefix}_{name}_row_features.parquet')
+
+def row_hashes(df: pd.DataFrame, cols: list) -> pd.Series:
+    '''Hash of the values of some columns of every row of the precurated data, indexed by row key'''
+    hashes = pd.util.hash_pandas_object(df[cols].astype(str), index=False)
+    return pd.Series(hashes.to_numpy(), index=geocode_data.row_keys(df))
+
+def compare_runs(current: pd.DataFrame, previous: pd.DataFrame) -> pd.DataFrame:
+    '''Classify the contracts of the current precurated data against the previous run.
+    Parameters
+    ----------
+    current : pd.DataFrame
+        Precurated data of the current run
+    previous : pd.DataFrame
+        Precurated data of the previous run
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame indexed by row key with the contract id, the status ('new', 'changed' or
+        'unchanged') and whether the address changed, in the order of current'''
+    cols = [col for col in current.columns if col in previous.columns and col!=row_key_col]
+    hashes, previous_hashes = row_hashes(current, cols), row_hashes(previous, cols)
+    addresses, previous_addresses = row_hashes(current, address_cols), row_hashes(previous, address_cols)
+    known = hashes.index.isin(previous_hashes.index)
+    status = np.where(~known, 'new', np.where(hashes.to_numpy()==previous_hashes.reindex(hashes.index).to_numpy(), 'unchanged', 'changed'))
+    address_changed = ~known|(addresses.to_numpy()!=previous_addresses.reindex(addresses.index).to_numpy())
+    return pd.DataFrame(
+        {key_col: current[key_col].to_numpy(), 'status': status, 'address_changed': address_changed},
+        index=hashes.index
+    )
+
+def reuse_columns(rows: pd.DataFrame, previous: pd.DataFrame, cols: list) -> pd.DataFrame:
+    '''Take some columns of the previous run for the rows with the same row key
+    Parameters
+    ----------
+    rows : pd.DataFrame
+        Rows of the current run, with the row_key column
+    previous : pd.DataFrame
+        Database of the previous run, with the row_key column
+    cols : list
+        Columns to take
+    Returns
+    -------
+    pd.DataFrame
+        The rows with the columns of the previous run'''
+    previous = previous.set_index(row_key_col)[cols]
+    rows = rows.drop([col for col in cols if col in rows.columns], axis=1)
+    return rows.join(previous, on=row_key_col)
+
+def read_previous(prefix: str) -> dict:
+    '''Read the databases of a previous run. Databases saved before the row keys were stored get
+    them when they can be recomputed (precurated and geocoded have every row); the DANE enriched
+    database drops the unlocated rows, so without keys none of its rows is reused'''
+    names = ['precurated', 'geocoded', 'dane_enriched_db']
+    missing = [database_path(name, prefix) for name in names if not os.path.exists(database_path(name, prefix))]
+    if missing:
+        raise FileNotFoundError(f'databases of the previous run not found: {missing}. Run the geocoding stage with --prefix {prefix} (and --geocode --merge-dane) first')
+    previous = {name: pd.read_csv(database_path(name, prefix)) for name in names}
+    for name in ['precurated', 'geocoded']:
+        if row_key_col not in previous[name].columns:
+            previous[name][row_key_col] = geocode_data.row_keys(previous[name])
+    if row_key_col not in previous['dane_enriched_db'].columns:
+        print('     previous DANE enriched database without row keys, enriching every contract...')
+        previous['dane_enriched_db'] = previous['dane_enriched_db'].iloc[:0].assign(**{row_key_col: pd.Series(dtype=str)})
+    return previous
+
+@instrumented
+def delta_geocoding(prefix: str='', previous_prefix: str='') -> pd.DataFrame:
+    '''Geocode and enrich with DANE microdata only the contracts that changed since a previous run.
+    Contracts are matched by their row key (id_contrato and occurrence), computed once over the
+    precurated data and stored as a column of the geocoded and enriched databases: new contracts and contracts whose address changed are sent
+    to geocode_precurated, contracts whose position changed are joined with the DANE blocks by
+    enrich_with_dane, and the rest reuse the geocoded and DANE columns of the previous run. The
+    merged databases are saved with the names of the full run, and delta_processing runs the
+    curated, predictive and descriptive stages over them.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    previous_prefix : str, optional
+        Prefix of the previous run, by default ''
+    Returns
+    -------
+    pd.DataFrame
+        The DANE enriched database of the current run'''
+    print('geocoding changed contracts...')
+    precurated = pd.read_csv(database_path('precurated', prefix))
+    #keys are computed once over the whole precurated data and stored in the outputs
+    precurated[row_key_col] = geocode_data.row_keys(precurated)
+    previous = read_previous(previous_prefix)
+    delta = compare_runs(precurated, previous['precurated'])
+    geocode = delta.address_changed.to_numpy()
+    print(f"     {(delta.status=='new').sum()} new, {(delta.status=='changed').sum()} changed, {(delta.status=='unchanged').sum()} unchanged contracts")
+
+    geocoded = reuse_columns(
+        precurated[~geocode].drop(geocode_data.location_drops, axis=1),
+        previous['geocoded'],
+        ['city', 'district']+position_cols
+    )
+    if geocode.any():
+        geocoded = pd.concat([geocoded, geocode_data.geocode_precurated(precurated[geocode], prefix)])
+    geocoded = geocoded.loc[precurated.index]
+    geocoded.to_csv(database_path('geocoded', prefix), index=0, sep=',')
+
+    #DANE columns of the previous run are reused while the position is the same
+    dane_cols = [col for col in previous['dane_enriched_db'].columns if col not in geocoded.columns]
+    previous_positions = previous['geocoded'].set_index(row_key_col)[position_cols].reindex(geocoded[row_key_col])
+    moved = ~np.isclose(geocoded[position_cols].to_numpy(dtype=float), previous_positions.to_numpy(dtype=float), equal_nan=True).all(axis=1)
+    #contracts without DANE columns in the previous run (e.g. unlocated then) are enriched too
+    enrich = moved|(delta.status=='new').to_numpy()|~geocoded[row_key_col].isin(previous['dane_enriched_db'][row_key_col]).to_numpy()
+    located = geocoded.latitude.notna().to_numpy()
+    enriched = reuse_columns(geocoded[~enrich&located], previous['dane_enriched_db'], dane_cols)
+    if (enrich&located).any():
+        enriched = pd.concat([enriched, pd.DataFrame(geocode_data.enrich_with_dane(geocoded[enrich&located]))])
+    enriched = enriched.loc[[index for index in geocoded.index if index in enriched.index]]
+    geocode_data.save_results(enriched[previous['dane_enriched_db'].columns], prefix)
+
+    report = {
+        'previous_prefix': previous_prefix,
+        'contracts': len(precurated),
+        **{status: int((delta.status==status).sum()) for status in ['new', 'changed', 'unchanged']},
+        'removed': int((~previous['precurated'][row_key_col].isin(delta.index)).sum()),
+        'geocoded': int(geocode.sum()),
+        'dane_enriched': int((enrich&located).sum())
+    }
+    with open(os.path.join(output_path, 'databases', f'{prefix}_delta_report.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(report, indent=4))
+    delta.to_csv(database_path('delta_contracts', prefix), index=0)
+    return enriched
+
+def cached_row_features(rows: pd.DataFrame, func, name: str, prefix: str='', previous_prefix: str='') -> pd.DataFrame:
+    '''Run a row-wise step only over the rows whose input changed since the previous run. The output
+    rows of every run are cached by row key with a hash of their input row; rows with the same key
+    and input reuse the output of the previous run, the rest go through func.
+    Parameters
+    ----------
+    rows : pd.DataFrame
+        Input rows, indexed by row key
+    func : callable
+        Row-wise step, func(rows, now) with now the reference date of the years
+    name : str
+        Name of the cache, like train_predictive
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    previous_prefix : str, optional
+        Prefix of the previous run, by default ''
+    Returns
+    -------
+    pd.DataFrame
+        Output rows of the step, indexed by row key in the order of rows'''
+    hashes = pd.Series(pd.util.hash_pandas_object(rows, index=False).to_numpy(), index=rows.index)
+    now, cached = datetime.datetime.now(), None
+    if os.path.exists(row_features_path(name, previous_prefix)):
+        cached = pd.read_parquet(row_features_path(name, previous_prefix))
+        reference = cached['_reference_date'].iloc[0] if len(cached) else None
+        if reference is None or (now-reference).days>max_cache_days:
+            cached = None
+        else:
+            now = reference.to_pydatetime()
+    reuse = np.zeros(len(rows), dtype=bool) if cached is None else rows.index.isin(cached.index)
+    if reuse.any():
+        reuse[reuse] = cached['_input_hash'].loc[rows.index[reuse]].to_numpy()==hashes.to_numpy()[reuse]
+    print(f'         {name}: {(~reuse).sum()} rows computed, {reuse.sum()} reused')
+    outputs = [func(rows[~reuse].copy(), now)] if (~reuse).any() or cached is None else []
+    if reuse.any():
+        outputs.append(cached.loc[rows.index[reuse]].drop(['_input_hash', '_reference_date'], axis=1))
+    result = pd.concat(outputs) if len(outputs)>1 else outputs[0]
+    result = result.loc[rows.index[rows.index.isin(result.index)]]
+    result.assign(_input_hash=hashes.loc[result.index], _reference_date=now).to_parquet(row_features_path(name, prefix))
+    return result
+
+@instrumented
+def delta_processing(prefix: str='', previous_prefix: str='', stages: list=None) -> None:
+    '''Run the curated, predictive and descriptive stages over the databases of delta_geocoding,
+    computing the row-wise features (years, permanence, outliers marking) only for the contracts whose
+    curated row changed since the previous run. The global steps (imputation plan, years imputation,
+    dummies vocabulary, DANE features, feature selection and bins) are recomputed over all the rows.
+    The first delta run after a full run computes every row and starts the caches.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    previous_prefix : str, optional
+        Prefix of the previous run, by default ''
+    stages : list, optional
+        Stages to run after the curation, 'predictive' and/or 'descriptive'. If None runs both, by default None'''
+    stages = ['predictive', 'descriptive'] if stages is None else stages
+    print('process curated data of the changed contracts...')
+    dane_enriched, dane_dict, business_dict = curated.read_data(prefix)
+    dane_enriched = dane_enriched.set_index(row_key_col)
+    base_curated = curated.drop_curated_cols(dane_enriched)
+    plan = curated.imputation_plan(base_curated, dane_dict, business_dict)
+    sets = curated.split_sets(curated.apply_imputation_plan(base_curated, plan))
+    curated.save_sets(sets, prefix)
+    if 'predictive' in stages:
+        for set_ in ['train', 'deploy']:
+            print(f'getting {set_} dataset of the changed contracts...')
+            file_path = os.path.join(output_path, 'predictive_mining', f'{set_}_set', f'{prefix}_{set_}_without_featuring.csv')
+            #sets are read back like in the full run, so the values are the ones kept by the CSV
+            rows = predictive.read_data(file_path).set_axis(sets[set_].index)
+            dataset_ = cached_row_features(rows, predictive_partition, f'{set_}_predictive', prefix, previous_prefix)
+            dataset_ = dataset_.reset_index(drop=True)
+            dataset_ = dataset_.assign(anios=dataset_.anios.fillna(data_tools.numeric_fill_value(dataset_.anios)))
+            vocabulary = data_tools.prediction_vocabulary(set_, lambda: data_tools.dummy_vocabulary(dataset_, predictive.cat_cols), prefix)
+            dataset_ = data_tools.get_dummies(dataset_, predictive.cat_cols, vocabulary=vocabulary)
+            predictive.save_prediction_dataset(dataset_, set_, file_path, prefix)
+    if 'descriptive' in stages:
+        print('processing descriptive sets of the changed contracts...')
+        file_path = os.path.join(output_path, 'descriptive_mining', f'{prefix}_descriptive_without_featuring.csv')
+        rows = descriptive.read_data(file_path).set_axis(sets['descriptive'].index)
+        dataset_ = cached_row_features(rows, descriptive.descriptive_row_features, 'descriptive', prefix, previous_prefix)
+        dataset = descriptive.descriptive_global_features(dataset_.reset_index(drop=True))
+        descriptive.build_descriptive_sets(dataset, file_path, prefix)
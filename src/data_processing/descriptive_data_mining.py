@@ -1,9 +1,11 @@
-import os
+import json, os
 from typing import Tuple
 import pandas as pd, numpy as np
 import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
 
 cat_cols = ['Desc_Cargo', 'Proyecto', 'genero', 'id_tipo_contrato', 'id_estado_civil', 'id_turno', 'NMB_LC_CM']
+quartils = [0, .25, .5, .75, 1.]
 
 def read_data(prefix: str='') -> Tuple[pd.DataFrame]:
     '''reads the enriched dane database and the dictionaries of variables
@@ -16,9 +18,9 @@ def read_data(prefix: str='') -> Tuple[pd.DataFrame]:
     Tuple[pd.DataFrame]
         Tuple with the DataFrames: dane_enriched, dane_dict, business_dict'''
     training_set = os.path.join(data_tools.output_path, 'databases', f'{prefix}_dane_enriched_db.csv')
-    dane_enriched = pd.read_csv(
+    dane_enriched = data_tools.read_csv_dates(
         training_set,
-        parse_dates=['fecha_ingreso', 'fecha_final', 'fecha_retiro', 'fecha_nacimiento']
+        ['fecha_ingreso', 'fecha_final', 'fecha_retiro', 'fecha_nacimiento']
     )
     dane_dict = pd.read_excel(
         os.path.join(data_tools.input_path, 'DICCIONARIO_DATOS_DANE.xlsx'),
@@ -33,12 +35,13 @@ def read_data(prefix: str='') -> Tuple[pd.DataFrame]:
     return dane_enriched, dane_dict, business_dict
 
 def read_data(file_path: str) -> pd.DataFrame:
-    dataset = pd.read_csv(
+    dataset = data_tools.read_csv_dates(
             file_path,
-            parse_dates=['fecha_nacimiento', 'fecha_ingreso', 'fecha_retiro']
+            ['fecha_nacimiento', 'fecha_ingreso', 'fecha_retiro']
         )
     return dataset
 
+@instrumented
 def drop_unvariant_cols(dataset: pd.DataFrame) -> pd.DataFrame:
     '''Drop unvariant columns in the DataFrame
     Parameters
@@ -59,25 +62,40 @@ def drop_unvariant_cols(dataset: pd.DataFrame) -> pd.DataFrame:
     dataset_ = dataset_cats.join(dataset_num)
     return dataset_
 
-def descriptive_base_processing(prefix: str=''):
-    '''Process the descriptive base data.
+def descriptive_row_features(dataset: pd.DataFrame, now=None) -> pd.DataFrame:
+    '''Compute the row-wise features of the descriptive base: years, permanence contract time and
+    outliers marking. It does not need global statistics, so it can run over partitions.
     Parameters
     ----------
-    prefix : str, optional
-        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    dataset : pd.DataFrame
+        DataFrame coming from the curated descriptive set
+    now : datetime.datetime, optional
+        Reference date of the years. If None uses the current time, by default None
     Returns
     -------
     pd.DataFrame
-        DataFrame processed and ready to use in descriptive modeling'''
-    dataset = read_data(prefix)
-    dataset_ = data_tools.years_computing(dataset)
+        DataFrame with row-wise features and missing values in place of invalid values'''
+    dataset_ = data_tools.years_computing(dataset, now)
     #computing permanence contract time
-    dataset_['permanencia'] = (dataset_['fecha_retiro']-dataset_['fecha_ingreso']).dt.days.astype(int)
+    dataset_['permanencia'] = (dataset_['fecha_retiro']-dataset_['fecha_ingreso']).dt.days
     dataset_.loc[dataset_.permanencia<=0, 'permanencia'] = np.nan
-    dataset_ = data_tools.input_numeric_col(dataset_, 'permanencia').drop(['fecha_ingreso', 'fecha_retiro'], axis=1)
-    #removing outliers
-    print('     removing outliers...')
-    dataset_ = data_tools.outliers_remotion(dataset_)
+    dataset_ = dataset_.drop(['fecha_ingreso', 'fecha_retiro'], axis=1)
+    dataset_ = data_tools.mark_outliers(dataset_)
+    return dataset_
+
+def descriptive_global_features(dataset_: pd.DataFrame) -> pd.DataFrame:
+    '''Compute the features of the descriptive base that need the whole dataset: missing values
+    imputation, DANE features and unvariant columns remotion.
+    Parameters
+    ----------
+    dataset_ : pd.DataFrame
+        DataFrame as returned by descriptive_row_features
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame processed and ready to use in descriptive modeling'''
+    dataset_ = data_tools.input_numeric_col(dataset_, 'permanencia')
+    dataset_ = data_tools.input_numeric_col(dataset_, 'anios')
     cat_vars = cat_cols.copy()
     cat_vars.append('causa_retiro')
     dataset_cats = dataset_[cat_vars]
@@ -87,26 +105,141 @@ def descriptive_base_processing(prefix: str=''):
     dataset_ = drop_unvariant_cols(dataset_)
     return dataset_
 
-def numeric_binner(dataset: pd.DataFrame) -> pd.DataFrame:
+@instrumented
+def descriptive_base_processing(prefix: str='', backend: str='pandas'):
+    '''Process the descriptive base data.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    backend : str, optional
+        Dataframe engine of the reading and row-wise features, 'pandas' or 'polars', by default 'pandas'
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame processed and ready to use in descriptive modeling'''
+    print('     removing outliers...')
+    if backend=='polars':
+        from src.commons import polars_tools
+        lf = polars_tools.scan_csv_dates(prefix, ['fecha_nacimiento', 'fecha_ingreso', 'fecha_retiro'])
+        dataset_ = polars_tools.collect(polars_tools.descriptive_row_features(lf))
+    else:
+        dataset = read_data(prefix)
+        dataset_ = descriptive_row_features(dataset)
+    dataset_ = descriptive_global_features(dataset_)
+    return dataset_
+
+def fit_bin_edges(dataset_num: pd.DataFrame, quantiles: list=quartils) -> dict:
+    '''Compute the quantile bin edges of every numeric column in a single pass.
+    Parameters
+    ----------
+    dataset_num : pd.DataFrame
+        DataFrame with numeric columns only
+    quantiles : list, optional
+        Quantiles defining the bin edges, by default quartils
+    Returns
+    -------
+    dict
+        Dictionary with the column names as keys and the sorted unique bin edges as values'''
+    values = dataset_num.to_numpy(dtype=float)
+    edges = np.nanquantile(values, quantiles, axis=0)
+    return {col: np.unique(edges[:, j]).tolist() for j, col in enumerate(dataset_num.columns)}
+
+def apply_bin_edges(dataset_num: pd.DataFrame, bin_edges: dict) -> pd.DataFrame:
+    '''Bin numeric columns into integer codes using precomputed bin edges. Bins are right closed
+    like pd.qcut and values out of the fitted range fall in the first or last bin, so incoming
+    batches are binned consistently with the training data.
+    Parameters
+    ----------
+    dataset_num : pd.DataFrame
+        DataFrame with the numeric columns present in bin_edges
+    bin_edges : dict
+        Dictionary with the bin edges by column, as returned by fit_bin_edges
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with int8 bin codes, -1 for missing values'''
+    codes = {}
+    for col, edges in bin_edges.items():
+        values = dataset_num[col].to_numpy(dtype=float)
+        edges = np.asarray(edges, dtype=float)
+        col_codes = np.searchsorted(edges, values, side='left')-1
+        col_codes = np.clip(col_codes, 0, max(len(edges)-2, 0)).astype(np.int8)
+        col_codes[np.isnan(values)] = -1
+        codes[col] = col_codes
+    return pd.DataFrame(codes, index=dataset_num.index)
+
+def bin_labels(bin_edges: dict) -> pd.DataFrame:
+    '''Build the label table of the bin codes.
+    Parameters
+    ----------
+    bin_edges : dict
+        Dictionary with the bin edges by column, as returned by fit_bin_edges
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the columns variable, code and label (interval notation)'''
+    variables, codes, labels = [], [], []
+    for col, edges in bin_edges.items():
+        if len(edges)==1:
+            edges = edges*2
+        for code in range(len(edges)-1):
+            left = '[' if code==0 else '('
+            variables.append(col)
+            codes.append(code)
+            labels.append(f'{left}{edges[code]:.3f}, {edges[code+1]:.3f}]')
+    return pd.DataFrame({'variable': variables, 'code': codes, 'label': labels})
+
+def save_bin_edges(bin_edges: dict, file_path: str) -> None:
+    '''Save the bin edges to a JSON file.
+    Parameters
+    ----------
+    bin_edges : dict
+        Dictionary with the bin edges by column
+    file_path : str
+        Path of the JSON file'''
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(bin_edges, indent=4))
+
+def load_bin_edges(file_path: str) -> dict:
+    '''Load the bin edges from a JSON file.
+    Parameters
+    ----------
+    file_path : str
+        Path of the JSON file
+    Returns
+    -------
+    dict
+        Dictionary with the bin edges by column'''
+    with open(file_path, 'r', encoding='utf-8') as f:
+        bin_edges = json.loads(f.read())
+    return bin_edges
+
+@instrumented
+def numeric_binner(dataset: pd.DataFrame, bin_edges: dict=None) -> Tuple[pd.DataFrame, dict]:
     '''Generate a categorical DataFrame by binning numeric variables into quartiles.
     Parameters
     ----------
     dataset : pd.DataFrame
         DataFrame to process
+    bin_edges : dict, optional
+        Stored bin edges to apply to a new batch. If None the edges are computed from dataset, by default None
     Returns
     -------
-    pd.DataFrame
-        Categorical DataFrame with binned numeric variables'''
+    Tuple[pd.DataFrame, dict]
+        Categorical DataFrame with numeric variables as bin codes and the bin edges used'''
     cat_vars = cat_cols.copy()
     cat_vars.append('causa_retiro')
     dataset_cats = dataset[cat_vars]
     dataset_num = dataset.drop(cat_vars, axis=1)
-    quartils = [0, .25, .5, .75, 1.]
-    dataset_num = dataset_num.apply(lambda col: pd.qcut(col, q=quartils, duplicates="drop"))
+    if bin_edges is None:
+        bin_edges = fit_bin_edges(dataset_num)
+    dataset_num = apply_bin_edges(dataset_num, bin_edges)
     dataset_ = dataset_num.join(dataset_cats)
-    return dataset_
+    return dataset_, bin_edges
 
-def save_data(dataset_cluster: pd.DataFrame, categorical_db: pd.DataFrame, file_path: str, prefix: str='') -> None:
+@instrumented
+def save_data(dataset_cluster: pd.DataFrame, categorical_db: pd.DataFrame, bin_edges: dict, file_path: str, prefix: str='') -> None:
     dataset_cluster.to_csv(
         os.path.join(os.path.dirname(file_path), f'{prefix}_description_numeric.csv'),
         index=0
@@ -115,28 +248,53 @@ def save_data(dataset_cluster: pd.DataFrame, categorical_db: pd.DataFrame, file_
         os.path.join(os.path.dirname(file_path), f'{prefix}_description_categorical.csv'),
         index=0
     )
+    bin_edges = {col: edges for col, edges in bin_edges.items() if col in categorical_db.columns}
+    save_bin_edges(bin_edges, os.path.join(os.path.dirname(file_path), f'{prefix}_description_bin_edges.json'))
+    bin_labels(bin_edges).to_csv(
+        os.path.join(os.path.dirname(file_path), f'{prefix}_description_bin_labels.csv'),
+        index=0
+    )
 
-def process_descriptive_sets(prefix: str='') -> None:
-    '''Process and save the descriptive datasets.
+def build_descriptive_sets(dataset: pd.DataFrame, file_path: str, prefix: str='') -> None:
+    '''Build and save the numeric (dummies) and categorical (quantils) descriptive datasets.
     Parameters
     ----------
+    dataset : pd.DataFrame
+        DataFrame processed and ready to use in descriptive modeling
+    file_path : str
+        Path of the descriptive set without featuring, used to locate the outputs
     prefix : str, optional
         Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
     returns
     -------
     None
         Saves the processed datasets to CSV files'''
-    print('processing descriptive sets...')
-    file_path = os.path.join(data_tools.output_path, 'descriptive_mining', f'{prefix}_descriptive_without_featuring.csv')
-    dataset = descriptive_base_processing(file_path)
     print('     getting dummies...')
     dataset_cluster = data_tools.get_dummies(dataset, cat_cols)
     dataset_cluster = dataset_cluster.drop(data_tools.cols_high_correlated, axis=1)
     print('     generating categorical db (quantils)...')
-    categorical_db = numeric_binner(dataset)
+    categorical_db, bin_edges = numeric_binner(dataset)
     categorical_db = categorical_db.drop(data_tools.cols_high_correlated[1:], axis=1)
     print('     saving datasets...')
-    save_data(dataset_cluster, categorical_db, file_path, prefix=prefix)
+    save_data(dataset_cluster, categorical_db, bin_edges, file_path, prefix=prefix)
+
+@instrumented
+def process_descriptive_sets(prefix: str='', backend: str='pandas') -> None:
+    '''Process and save the descriptive datasets.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    backend : str, optional
+        Dataframe engine, 'pandas' or 'polars' (lazy query plan, same outputs), by default 'pandas'
+    returns
+    -------
+    None
+        Saves the processed datasets to CSV files'''
+    print('processing descriptive sets...')
+    file_path = os.path.join(data_tools.output_path, 'descriptive_mining', f'{prefix}_descriptive_without_featuring.csv')
+    dataset = descriptive_base_processing(file_path, backend)
+    build_descriptive_sets(dataset, file_path, prefix)
 
 if __name__=='__main__':
     process_descriptive_sets()
\ No newline at end of file
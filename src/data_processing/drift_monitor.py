@@ -0,0 +1,200 @@
+import json, os
+import pandas as pd, numpy as np
+import src.commons.tools as data_tools
+from src.data_processing import curated, feature_scoring
+from src.commons.instrumentation import instrumented
+
+#PSI thresholds of the drift levels
+psi_levels = [(.1, 'stable'), (.25, 'moderate'), (np.inf, 'significant')]
+smoothing = 1e-4
+
+def fit_reference_sketch(dataset: pd.DataFrame, features: list=None, bins: int=10, max_categories: int=10) -> dict:
+    '''Build the reference sketch of the model features at training time. Numeric features keep
+    the counts by quantile bin of the training data and features with few values (e.g. dummies)
+    keep the frequency of every category.
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        Training dataset
+    features : list, optional
+        Features to sketch. If None all the columns are used, by default None
+    bins : int, optional
+        Number of quantile bins of the numeric features, by default 10
+    max_categories : int, optional
+        Features with this number of unique values or less are sketched as categorical, by default 10
+    Returns
+    -------
+    dict
+        Sketch with the bins or categories and the counts of every feature'''
+    features = dataset.columns.tolist() if features is None else features
+    sketch = {'rows': 0, 'features': {}}
+    for feature in features:
+        values = dataset[feature]
+        if values.nunique()<=max_categories:
+            sketch['features'][feature] = {'type': 'categorical', 'rows': 0, 'counts': {}}
+        else:
+            edges = np.unique(np.nanquantile(values.to_numpy(dtype=float), np.linspace(0, 1, bins+1)[1:-1]))
+            sketch['features'][feature] = {'type': 'numeric', 'edges': edges.tolist(), 'rows': 0, 'counts': [0]*(len(edges)+2)}
+    return update_sketch(sketch, dataset)
+
+def empty_sketch(reference: dict) -> dict:
+    '''Build a sketch with the bins of the reference sketch and no counts'''
+    sketch = {'rows': 0, 'features': {}}
+    for feature, summary in reference['features'].items():
+        if summary['type']=='numeric':
+            sketch['features'][feature] = {'type': 'numeric', 'edges': summary['edges'], 'rows': 0, 'counts': [0]*len(summary['counts'])}
+        else:
+            sketch['features'][feature] = {'type': 'categorical', 'rows': 0, 'counts': {}}
+    return sketch
+
+def sketch_subset(sketch: dict, features: list) -> dict:
+    '''Sketch with only some features, e.g. the reference restricted to the variables of a model'''
+    return {**sketch, 'features': {feature: summary for feature, summary in sketch['features'].items() if feature in set(features)}}
+
+def update_sketch(sketch: dict, batch: pd.DataFrame) -> dict:
+    '''Add a batch of rows to a sketch. Only the counts are kept, so batches can be streamed
+    through the sketch without holding them in memory. The last numeric bin counts missing values.
+    Features absent from the batch are not counted, so the report can tell them apart.
+    Parameters
+    ----------
+    sketch : dict
+        Sketch to update in place
+    batch : pd.DataFrame
+        Batch of rows with the sketched features
+    Returns
+    -------
+    dict
+        The updated sketch'''
+    sketch['rows'] += len(batch)
+    for feature, summary in sketch['features'].items():
+        if feature not in batch.columns:
+            continue
+        summary['rows'] = summary.get('rows', 0)+len(batch)
+        if summary['type']=='numeric':
+            values = pd.to_numeric(batch[feature], errors='coerce').to_numpy(dtype=float)
+            codes = np.searchsorted(summary['edges'], values, side='right')
+            codes[np.isnan(values)] = len(summary['counts'])-1
+            counts = np.bincount(codes, minlength=len(summary['counts']))
+            summary['counts'] = (np.asarray(summary['counts'])+counts).tolist()
+        else:
+            values = batch[feature]
+            #numeric categories as float, so 1 and 1.0 (e.g. read from a CSV with missing values) match
+            values = values.astype(float).astype(str) if pd.api.types.is_numeric_dtype(values) else values.astype(str)
+            for value, count in values.value_counts().items():
+                summary['counts'][value] = summary['counts'].get(value, 0)+int(count)
+    return sketch
+
+def compare_counts(reference: np.ndarray, current: np.ndarray, ordered: bool) -> tuple:
+    '''PSI and (for ordered bins) KS statistic between two count vectors'''
+    p = (reference+smoothing)/(reference+smoothing).sum()
+    q = (current+smoothing)/(current+smoothing).sum()
+    psi = float(np.sum((q-p)*np.log(q/p)))
+    ks = float(np.max(np.abs(np.cumsum(q)-np.cumsum(p)))) if ordered else None
+    return psi, ks
+
+def drift_report(reference: dict, sketch: dict) -> pd.DataFrame:
+    '''Compare the sketch of a deploy batch with the training reference.
+    Parameters
+    ----------
+    reference : dict
+        Reference sketch, as returned by fit_reference_sketch
+    sketch : dict
+        Sketch of the deploy batches, built from empty_sketch(reference)
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the PSI, KS statistic (numeric features) and drift level by feature. Features
+        absent from the batches are reported as 'missing' and, without rows, every feature as
+        'insufficient data', both without PSI'''
+    features, psis, kss, levels = [], [], [], []
+    for feature, summary in reference['features'].items():
+        current = sketch['features'].get(feature, {'rows': 0})
+        if not sketch['rows'] or not current.get('rows', sketch['rows']):
+            features.append(feature)
+            psis.append(None)
+            kss.append(None)
+            levels.append('insufficient data' if not sketch['rows'] else 'missing')
+            continue
+        if summary['type']=='numeric':
+            psi, ks = compare_counts(np.asarray(summary['counts'], dtype=float), np.asarray(current['counts'], dtype=float), True)
+        else:
+            categories = sorted(set(summary['counts'])|set(current['counts']))
+            psi, ks = compare_counts(
+                np.array([summary['counts'].get(category, 0) for category in categories], dtype=float),
+                np.array([current['counts'].get(category, 0) for category in categories], dtype=float),
+                False
+            )
+        features.append(feature)
+        psis.append(round(psi, 4))
+        kss.append(None if ks is None else round(ks, 4))
+        levels.append(next(level for threshold, level in psi_levels if psi<threshold))
+    return pd.DataFrame({'feature': features, 'psi': psis, 'ks': kss, 'drift': levels})
+
+def monitor_csv(file_path: str, reference: dict, chunksize: int=10000) -> pd.DataFrame:
+    '''Stream a deploy CSV in chunks through a sketch and compare it with the reference.
+    Parameters
+    ----------
+    file_path : str
+        Path of the deploy CSV
+    reference : dict
+        Reference sketch
+    chunksize : int, optional
+        Rows read by chunk, by default 10000
+    Returns
+    -------
+    pd.DataFrame
+        Drift report, as returned by drift_report'''
+    sketch = empty_sketch(reference)
+    for chunk in pd.read_csv(file_path, chunksize=chunksize, usecols=lambda col: col in reference['features']):
+        update_sketch(sketch, chunk)
+    return drift_report(reference, sketch)
+
+def save_sketch(sketch: dict, file_path: str) -> None:
+    '''Save a sketch to a JSON file'''
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(sketch, indent=4))
+
+def load_sketch(file_path: str) -> dict:
+    '''Load a sketch from a JSON file'''
+    with open(file_path, 'r', encoding='utf-8') as f:
+        sketch = json.loads(f.read())
+    return sketch
+
+def reference_path(prefix: str='') -> str:
+    '''Path of the training reference sketch of a run'''
+    return os.path.join(data_tools.output_path, 'models', f'{prefix}_drift_reference.json')
+
+@instrumented
+def monitor_drift(featured_dataset: pd.DataFrame, set_: str, file_path: str, prefix: str='', features: list=None) -> pd.DataFrame:
+    '''Save the reference sketch of the train dataset, or the drift report of the deploy dataset
+    against the reference of the same prefix.
+    Parameters
+    ----------
+    featured_dataset : pd.DataFrame
+        The processed prediction dataset
+    set_ : str
+        Dataset processed, 'train' or 'deploy'
+    file_path : str
+        The path to the CSV file of the dataset, used to locate the drift report
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    features : list, optional
+        Features of the reference sketch, the scored variables. If None uses the selected features
+        of the run, by default None
+    Returns
+    -------
+    pd.DataFrame
+        The drift report of the deploy dataset, None for the train dataset'''
+    if set_=='train':
+        print('     sketching features for drift monitoring...')
+        features = feature_scoring.load_selected_features(prefix) if features is None else features
+        features = featured_dataset.columns.drop(['retiro', curated.contract_col], errors='ignore').tolist() if features is None else features
+        save_sketch(fit_reference_sketch(featured_dataset, features), reference_path(prefix))
+        return None
+    if not os.path.exists(reference_path(prefix)):
+        return None
+    print('     computing feature drift...')
+    reference = load_sketch(reference_path(prefix))
+    report = drift_report(reference, update_sketch(empty_sketch(reference), featured_dataset))
+    report.to_csv(os.path.join(os.path.dirname(file_path), f'{prefix}_drift_report.csv'), index=0)
+    return report
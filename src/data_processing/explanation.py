@@ -0,0 +1,184 @@
+import hashlib, json, os, pickle, shutil, tempfile
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd, numpy as np
+import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
+
+#state of the permutation workers, loaded once by process
+worker = {}
+
+def load_model(model_path: str) -> tuple:
+    '''Load a pickled (model, variables) tuple'''
+    with open(model_path, 'rb') as f:
+        model, variables = pickle.load(f)
+    return model, list(variables)
+
+def init_worker(model_path: str, data_path: str, target_path: str, variables: list, scoring: str) -> None:
+    '''Load the model and memory-map the features and target in a permutation worker'''
+    from sklearn.metrics import get_scorer
+    worker['model'], _ = load_model(model_path)
+    worker['X'] = np.load(data_path, mmap_mode='r')
+    worker['y'] = np.load(target_path, mmap_mode='r')
+    worker['variables'] = variables
+    worker['scorer'] = get_scorer(scoring)
+
+def permuted_score(task: tuple) -> tuple:
+    '''Score the model with one feature permuted. The task is (feature index, repeat, seed)'''
+    feature, repeat, seed = task
+    rng = np.random.default_rng([seed, feature, repeat])
+    #the input is assembled from views of the memory-mapped columns, only the permuted one is new
+    columns = {variable: worker['X'][:, k] for k, variable in enumerate(worker['variables'])}
+    columns[worker['variables'][feature]] = rng.permutation(worker['X'][:, feature])
+    X = pd.DataFrame(columns, copy=False)
+    return feature, repeat, worker['scorer'](worker['model'], X, np.asarray(worker['y']))
+
+@instrumented
+def permutation_importance(
+    model_path: str,
+    dataset: pd.DataFrame,
+    target: str='retiro',
+    n_repeats: int=5,
+    scoring: str='accuracy',
+    n_jobs: int=None,
+    seed: int=0,
+    cache_dir: str=None
+    ) -> dict:
+    '''Compute the permutation importance of a pickled (model, variables) tuple. Every feature x
+    repeat permutation is scored in a process pool whose workers share the data through memory
+    mapped files. Results are cached by model, dataset and parameters.
+    Parameters
+    ----------
+    model_path : str
+        Path of the pickle with the (model, variables) tuple, like models/perceptron_model.pkl
+    dataset : pd.DataFrame
+        Dataset with the model variables and the target, like {prefix}_non_correlated_dataset_train.csv
+    target : str, optional
+        Target column, by default 'retiro'
+    n_repeats : int, optional
+        Permutations by feature, by default 5
+    scoring : str, optional
+        sklearn scorer name, by default 'accuracy'
+    n_jobs : int, optional
+        Number of worker processes. If None uses the number of CPUs, by default None
+    seed : int, optional
+        Random seed of the permutations, by default 0
+    cache_dir : str, optional
+        Directory of the cached results. If None uses output/models/explanations, by default None
+    Returns
+    -------
+    dict
+        Dictionary with the model hash, the baseline score, the importance mean and std by feature
+        and the training means of the features (baseline used by row_attributions)'''
+    from src.data_processing import predictive_data_mining as predictive
+    cache_dir = os.path.join(data_tools.output_path, 'models', 'explanations') if cache_dir is None else cache_dir
+    model_key = data_tools.file_hash(model_path)
+    model, variables = load_model(model_path)
+    X, y = predictive.model_variables(dataset, variables), dataset[target].astype(int)
+    key = hashlib.sha256(f'{model_key}{data_tools.dataset_hash(pd.concat([X, y], axis=1))}{n_repeats}{scoring}{seed}'.encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f'{model_key[:16]}_{key[:16]}.json')
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.loads(f.read())
+
+    from sklearn.metrics import get_scorer
+    baseline_score = get_scorer(scoring)(model, X, y.to_numpy())
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        data_path, target_path = os.path.join(tmp_dir, 'X.npy'), os.path.join(tmp_dir, 'y.npy')
+        np.save(data_path, X.to_numpy())
+        np.save(target_path, y.to_numpy())
+        tasks = [(feature, repeat, seed) for feature in range(len(variables)) for repeat in range(n_repeats)]
+        scores = np.zeros((len(variables), n_repeats))
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=init_worker,
+            initargs=(model_path, data_path, target_path, variables, scoring)
+        ) as executor:
+            for feature, repeat, score in executor.map(permuted_score, tasks, chunksize=max(1, len(tasks)//32)):
+                scores[feature, repeat] = score
+    finally:
+        shutil.rmtree(tmp_dir)
+    drops = baseline_score-scores
+    result = {
+        'model_hash': model_key,
+        'scoring': scoring,
+        'baseline_score': float(baseline_score),
+        'importances': {
+            variable: {'mean': float(drops[k].mean()), 'std': float(drops[k].std())}
+            for k, variable in enumerate(variables)
+        },
+        'feature_means': X.mean().to_dict()
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(result, indent=4))
+    #latest explanation of the model, looked up by model hash when scoring
+    shutil.copyfile(cache_path, os.path.join(cache_dir, f'{model_key[:16]}.json'))
+    return result
+
+def importances_frame(result: dict) -> pd.DataFrame:
+    '''Permutation importances as a DataFrame sorted by mean importance'''
+    importances = pd.DataFrame(result['importances']).T.rename_axis('feature').reset_index()
+    return importances.sort_values('mean', ascending=False, ignore_index=True)
+
+def load_explanation(model_path: str, cache_dir: str) -> dict:
+    '''Latest cached explanation of a pickled model, None if it was not explained yet'''
+    cache_path = os.path.join(cache_dir, f'{data_tools.file_hash(model_path)[:16]}.json')
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path, 'r', encoding='utf-8') as f:
+        return json.loads(f.read())
+
+def row_attributions(model, X: pd.DataFrame, feature_means: dict) -> pd.DataFrame:
+    '''Attribution of every feature to the predicted probability of every row: the change of the
+    probability when the feature is replaced by its training mean.
+    Parameters
+    ----------
+    model : sklearn estimator
+        Fitted classifier with predict_proba
+    X : pd.DataFrame
+        Rows to explain with the model variables
+    feature_means : dict
+        Training means of the variables
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the attributions, same shape as X'''
+    probability = model.predict_proba(X)[:, 1]
+    attributions = {}
+    for feature in X.columns:
+        probability_mean = model.predict_proba(X.assign(**{feature: feature_means[feature]}))[:, 1]
+        attributions[feature] = probability-probability_mean
+    return pd.DataFrame(attributions, index=X.index)
+
+def top_factors(attributions: pd.DataFrame, top: int=3) -> pd.Series:
+    '''Names of the features with the highest absolute attribution of every row'''
+    order = np.argsort(-attributions.abs().to_numpy(), axis=1)[:, :top]
+    names = attributions.columns.to_numpy()[order]
+    return pd.Series([', '.join(row) for row in names], index=attributions.index)
+
+@instrumented
+def explain_model(model_path: str, prefix: str='', n_repeats: int=5, n_jobs: int=None) -> pd.DataFrame:
+    '''Compute and save the permutation importance of a pickled model over the train dataset of a run.
+    Parameters
+    ----------
+    model_path : str
+        Path of the pickle with the (model, variables) tuple
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    n_repeats : int, optional
+        Permutations by feature, by default 5
+    n_jobs : int, optional
+        Number of worker processes, by default None
+    Returns
+    -------
+    pd.DataFrame
+        Permutation importances sorted by mean importance'''
+    print('explaining model...')
+    file_path = os.path.join(data_tools.output_path, 'predictive_mining', 'train_set', f'{prefix}_non_correlated_dataset_train.csv')
+    dataset = pd.read_csv(file_path)
+    print('     computing permutation importance...')
+    result = permutation_importance(model_path, dataset, n_repeats=n_repeats, n_jobs=n_jobs)
+    importances = importances_frame(result)
+    importances.to_csv(os.path.join(data_tools.output_path, 'models', f'{prefix}_permutation_importance.csv'), index=0)
+    return importances
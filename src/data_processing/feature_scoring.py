@@ -0,0 +1,131 @@
+import hashlib, json, os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd, numpy as np
+import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
+
+score_cols = ['f_score', 'f_pvalue', 'mutual_info', 'correlation']
+
+def score_block(task: tuple) -> pd.DataFrame:
+    '''Univariate scores of a block of features against a binary target. The task is
+    (features, X, y, seed). Mutual information is computed feature by feature with its own seed, so
+    the scores do not depend on how the features are split in blocks.'''
+    from sklearn.feature_selection import f_classif, mutual_info_classif
+    features, X, y, seed = task
+    #scores need finite values; missing values are left by the mean of the feature
+    X = np.where(np.isnan(X), np.nanmean(X, axis=0), X)
+    f_score, f_pvalue = f_classif(X, y)
+    mutual_info = [
+        mutual_info_classif(
+            X[:, [k]], y, discrete_features=len(np.unique(X[:, k]))<=2, random_state=seed+k
+        )[0] for k in range(X.shape[1])
+    ]
+    Xc, yc = X-X.mean(axis=0), y-y.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlation = (Xc*yc[:, None]).sum(axis=0)/np.sqrt((Xc**2).sum(axis=0)*(yc**2).sum())
+    return pd.DataFrame(
+        {'f_score': f_score, 'f_pvalue': f_pvalue, 'mutual_info': mutual_info, 'correlation': correlation},
+        index=pd.Index(features, name='feature')
+    )
+
+@instrumented
+def score_features(
+    dataset: pd.DataFrame,
+    target: str='causa_retiro',
+    n_jobs: int=None,
+    seed: int=0,
+    cache_dir: str=None
+    ) -> pd.DataFrame:
+    '''Score every candidate feature against the target with the ANOVA F test (f_classif), mutual
+    information and the Pearson correlation. Blocks of features are scored in a process pool and the
+    scores are cached by dataset hash.
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        Dataset with the candidate features and the target
+    target : str, optional
+        Binary target column, by default 'causa_retiro'
+    n_jobs : int, optional
+        Number of worker processes. If None uses the number of CPUs, by default None
+    seed : int, optional
+        Random seed of the mutual information estimator, by default 0
+    cache_dir : str, optional
+        Directory of the cached scores. If None uses output/models/feature_scores, by default None
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame indexed by feature with the F score and p-value, mutual information, correlation
+        and rank (mean percentile of the F score, mutual information and absolute correlation)'''
+    cache_dir = os.path.join(data_tools.output_path, 'models', 'feature_scores') if cache_dir is None else cache_dir
+    features = dataset.columns.drop(target).tolist()
+    key = hashlib.sha256(f'{data_tools.dataset_hash(dataset)}{target}{seed}'.encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f'{key[:16]}.csv')
+    if os.path.exists(cache_path):
+        return pd.read_csv(cache_path, index_col='feature')
+
+    X, y = dataset[features].to_numpy(dtype=float), dataset[target].to_numpy(dtype=int)
+    n_blocks = min(len(features), 4*(os.cpu_count() if n_jobs is None else n_jobs))
+    blocks = [block for block in np.array_split(np.arange(len(features)), n_blocks) if len(block)]
+    tasks = [([features[k] for k in block], X[:, block], y, seed+block[0]) for block in blocks]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        scores = pd.concat(executor.map(score_block, tasks))
+    scores = rank_scores(scores)
+    os.makedirs(cache_dir, exist_ok=True)
+    scores.to_csv(cache_path)
+    return scores
+
+def rank_scores(scores: pd.DataFrame) -> pd.DataFrame:
+    '''Rank features by the mean percentile of the F score, mutual information and absolute
+    correlation, e.g. to rank together the scores of two score_features calls'''
+    return scores.assign(rank=pd.concat([
+        scores.f_score.rank(pct=True), scores.mutual_info.rank(pct=True), scores.correlation.abs().rank(pct=True)
+    ], axis=1).mean(axis=1))
+
+def relevant_features(scores: pd.DataFrame, min_correlation: float=.05, min_mutual_info: float=.01) -> list:
+    '''Features related with the target: absolute correlation over min_correlation (the linear
+    relevance rule of the training notebook) or mutual information over min_mutual_info (non
+    linear relations)'''
+    relevant = (scores.correlation.abs()>min_correlation)|(scores.mutual_info>min_mutual_info)
+    return relevant[relevant].index.tolist()
+
+def non_redundant_features(correlated_features: pd.DataFrame, scores: pd.DataFrame) -> list:
+    '''Drop one feature of every highly correlated pair, keeping the feature with the higher rank.
+    Parameters
+    ----------
+    correlated_features : pd.DataFrame
+        Pairs of highly correlated features, as returned by get_high_correlated_features
+    scores : pd.DataFrame
+        Feature scores, as returned by score_features
+    Returns
+    -------
+    list
+        The scored features that are not redundant, sorted by rank'''
+    correlated = {}
+    for v1, v2 in zip(correlated_features.variable1, correlated_features.variable2):
+        correlated.setdefault(v1, set()).add(v2)
+        correlated.setdefault(v2, set()).add(v1)
+    kept = []
+    for feature in scores.sort_values('rank', ascending=False, kind='stable').index:
+        if not correlated.get(feature, set())&set(kept):
+            kept.append(feature)
+    return kept
+
+def selected_features_path(prefix: str='') -> str:
+    '''Path of the selected features of a run'''
+    return os.path.join(data_tools.output_path, 'models', f'{prefix}_selected_features.json')
+
+def save_selected_features(features: list, scores: pd.DataFrame, prefix: str='') -> None:
+    '''Save the selected features of the train dataset with their scores'''
+    selection = {
+        'features': features,
+        'scores': scores.loc[features, score_cols+['rank']].round(6).to_dict(orient='index')
+    }
+    with open(selected_features_path(prefix), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(selection, indent=4))
+
+def load_selected_features(prefix: str='') -> list:
+    '''Selected features of a run, None if the train dataset was not processed yet'''
+    if not os.path.exists(selected_features_path(prefix)):
+        return None
+    with open(selected_features_path(prefix), 'r', encoding='utf-8') as f:
+        return json.loads(f.read())['features']
@@ -1,16 +1,29 @@
-import os, requests, time, tqdm
-from dotenv import load_dotenv
-import pandas as pd, geopandas as gpd, numpy as np
+import json, os, time, tqdm
+import pandas as pd, numpy as np
 
 from src.commons.tools import input_path, output_path
-
-load_dotenv()
+from src.commons.instrumentation import instrumented
+from src.data_processing import address_resolver
 
 location_drops = [
     'id_ciudad', 'id_area', 'direccion', 'id_ciudad_residencia', 'barrio',
     'id_departamento_exp', 'id_departamento_res'
 ]
-here_api_key = os.environ.get('HERE_API_KEY')
+
+#key of every contract across runs, stored in the geocoded and DANE enriched databases so the rows
+#of a run can be matched with the ones of a previous run (see delta)
+row_key_col = 'row_key'
+
+def row_keys(df: pd.DataFrame) -> pd.Series:
+    '''Key of every row: the contract id and its occurrence, so repeated ids are matched in order.
+    It must be computed over the whole precurated data, before any row is dropped'''
+    return df['id_contrato'].astype(str)+'#'+df.groupby('id_contrato').cumcount().astype(str)
+
+def get_here_api_key() -> str:
+    ''' Read the Here API key from the environment, loading the .env file on first use.'''
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.environ.get('HERE_API_KEY')
 
 def extract_data(result: dict, cities: list, districts: list, latitudes: list, longitudes: list) -> None:
     ''' Extract relevant data from geocoding result. This receives the Here API response
@@ -48,26 +61,52 @@ def extract_data(result: dict, cities: list, districts: list, latitudes: list, l
         latitudes.append(None)
         longitudes.append(None)
         
-def geocode_precurated(precurated, prefix: str='') -> pd.DataFrame:
-    ''' Geocode the addresses in the precurated dataframe using the Here API.
+@instrumented
+def geocode_precurated(precurated, prefix: str='', resolve_locally: bool=True, min_confidence: float=.5) -> pd.DataFrame:
+    ''' Geocode the addresses in the precurated dataframe. Addresses of the Bogotá nomenclature are
+    resolved offline with the gazetteer of address_resolver and only the unparsed or low confidence
+    ones are sent to the Here API, whose results are learnt by the gazetteer.
     Parameters
     ----------
     precurated : pd.DataFrame
         DataFrame containing the precurated data with address information.
     prefix : str, optional
         Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    resolve_locally : bool, optional
+        Whether to resolve the addresses with the gazetteer before the Here API, by default True
+    min_confidence : float, optional
+        Minimum confidence of an offline resolution, by default .5
     Returns
     -------
     pd.DataFrame
-        DataFrame with geocoded information including city, district, latitude, and longitude.'''
+        DataFrame with geocoded information including city, district, latitude, and longitude, and the
+        row key of every contract (computed here if precurated has no row_key column).'''
+    import requests
+    if row_key_col not in precurated.columns:
+        precurated = precurated.assign(**{row_key_col: row_keys(precurated)})
     department, city = 'Cundinamarca', 'Bogotá'
+    here_api_key = get_here_api_key()
     cities, districts, latitudes, longitudes = [], [], [], []
+    gazetteer = address_resolver.load_gazetteer()
+    if resolve_locally:
+        local = address_resolver.resolve_addresses(precurated.direccion, gazetteer)
+        local = local.confidence.to_numpy()>=min_confidence, local
+    else:
+        local = np.zeros(len(precurated), dtype=bool), None
+    remote_seconds, remote_requests = 0., 0
 
     base_url = 'https://geocode.search.hereapi.com/v1/geocode?limit=2&q={full_address}&apiKey={here_api_key}'
 
     df, k_limit = precurated, 1
     pbar = tqdm.tqdm(range(len(df)))
     for i in pbar:
+        if local[0][i]:
+            resolved = local[1].iloc[i]
+            cities.append(resolved.city)
+            districts.append(resolved.district)
+            latitudes.append(resolved.latitude)
+            longitudes.append(resolved.longitude)
+            continue
         address, district = df.direccion.iloc[i], df.barrio.iloc[i]
         if pd.isna(address) or pd.isnull(address):
             full_address = None
@@ -78,6 +117,7 @@ def geocode_precurated(precurated, prefix: str='') -> pd.DataFrame:
                 full_address = f'{address}, {district}, {city}, {department}'
         query = base_url.format(full_address=full_address, here_api_key=here_api_key).replace(' ', '%20')
         if not full_address is None:
+            start = time.perf_counter()
             result = requests.get(query).json()
             extract_data(result, cities, districts, latitudes, longitudes)
             k = 0
@@ -92,6 +132,8 @@ def geocode_precurated(precurated, prefix: str='') -> pd.DataFrame:
                 districts.append(None)
                 latitudes.append(None)
                 longitudes.append(None)
+            remote_seconds += time.perf_counter()-start
+            remote_requests += 1
         else:
             cities.append(None)
             districts.append(None)
@@ -102,6 +144,22 @@ def geocode_precurated(precurated, prefix: str='') -> pd.DataFrame:
             assign(district=districts).\
                 assign(latitude=latitudes).\
                     assign(longitude=longitudes)
+    remote = ~local[0]
+    gazetteer = address_resolver.update_gazetteer(gazetteer, df.direccion[remote], geocoded[remote])
+    gazetteer.to_csv(address_resolver.gazetteer_path(), index=0)
+    seconds_by_request = remote_seconds/remote_requests if remote_requests else None
+    report = {
+        'addresses': len(df),
+        'resolved_locally': int(local[0].sum()),
+        'fraction_resolved_locally': round(float(local[0].mean()), 4) if len(df) else None,
+        'remote_requests': remote_requests,
+        'remote_seconds': round(remote_seconds, 2),
+        #requests avoided, at the mean time of the requests of this run
+        'seconds_saved': None if seconds_by_request is None else round(local[0].sum()*seconds_by_request, 2)
+    }
+    print(f"     {report['resolved_locally']} addresses resolved locally ({report['fraction_resolved_locally']}), {report['seconds_saved']} seconds saved")
+    with open(os.path.join(output_path, 'databases', f'{prefix}_geocoding_report.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(report, indent=4))
     geocoded = geocoded.drop(location_drops, axis=1)
     geocoded.to_csv(
             os.path.join(output_path, 'databases', f'{prefix}_geocoded.csv'),
@@ -110,13 +168,22 @@ def geocode_precurated(precurated, prefix: str='') -> pd.DataFrame:
         )
     return geocoded
 
-def enrich_with_dane():
+@instrumented
+def enrich_with_dane(geocoded: pd.DataFrame=None, prefix: str=''):
     ''' Enrich the geocoded data with DANE microdata by performing a spatial join.
+    Parameters
+    ----------
+    geocoded : pd.DataFrame, optional
+        Geocoded rows to enrich. If None the {prefix}_geocoded.csv database is read, by default None
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
     Returns
     -------
     pd.DataFrame
         DataFrame enriched with DANE microdata.'''
-    geocoded = pd.read_csv(os.path.join(output_path, 'databases', 'geocoded.csv'))
+    import geopandas as gpd
+    if geocoded is None:
+        geocoded = pd.read_csv(os.path.join(output_path, 'databases', f'{prefix}_geocoded.csv'))
     geocoded = geocoded[~geocoded.latitude.isnull()]
     # Convert geocode into GeoDataFrame with geometry from lat/lon
     print('         charging DANE data...')
@@ -143,6 +210,7 @@ def enrich_with_dane():
     geocoded_dane = pd.concat(dfs)
     return geocoded_dane
 
+@instrumented
 def save_results(df: pd.DataFrame, prefix: str=''):
     ''' Save the enriched DataFrame to a CSV file.
     Parameters
@@ -161,6 +229,7 @@ def save_results(df: pd.DataFrame, prefix: str=''):
         sep=','
     )
 
+@instrumented
 def geocoding(geocode_data=False, merge_dane=False, prefix: str='') -> pd.DataFrame:
     ''' Geocode and optionally enrich the precurated data with DANE microdata.
     Parameters
@@ -180,10 +249,10 @@ def geocoding(geocode_data=False, merge_dane=False, prefix: str='') -> pd.DataFr
     precurated = pd.read_csv(os.path.join(output_path, 'databases', f'{prefix}_precurated.csv'))
     if geocode_data:
         print('     gecoding precurated data...')
-        data['geocoded'] = geocode_precurated(precurated)
+        data['geocoded'] = geocode_precurated(precurated, prefix)
     if merge_dane:
         print('     merging precurated geocoded data with DANE...')
-        df = enrich_with_dane()
+        df = enrich_with_dane(prefix=prefix)
         print('     saving data...')
         save_results(df, prefix)
     data['geocoded_dane'] = pd.read_csv(os.path.join(output_path, 'databases', f'{prefix}_dane_enriched_db.csv'))
@@ -0,0 +1,162 @@
+import copy, json, os, pickle, tempfile, time, warnings
+import pandas as pd, numpy as np
+import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
+from src.data_processing import curated, predictive_data_mining as predictive
+
+target = 'retiro'
+contract_col = curated.contract_col
+
+def rows_path(model_path: str) -> str:
+    '''Path of the keys of the contracts the model was trained on, next to the model'''
+    return f'{os.path.splitext(model_path)[0]}_contracts.npy'
+
+def contract_keys(dataset: pd.DataFrame) -> np.ndarray:
+    '''Hash of the contract id, its occurrence and its closure (the target) of every row. The featured
+    values are not part of the key, they change between runs (e.g. the years computed from the
+    current date or the KNN imputed DANE ratios)'''
+    if contract_col not in dataset.columns:
+        raise KeyError(f'{contract_col} not in the dataset, run the predictive stage to carry it into the train dataset')
+    contracts = dataset[contract_col].astype(str)
+    occurrences = dataset.groupby(contract_col, sort=False).cumcount().astype(str)
+    return pd.util.hash_array((contracts+'#'+occurrences+'#'+dataset[target].astype(str)).to_numpy(dtype=object))
+
+def load_trained_rows(model_path: str) -> np.ndarray:
+    '''Keys of the contracts the model was trained on, None if they were not recorded yet'''
+    if not os.path.exists(rows_path(model_path)):
+        return None
+    return np.load(rows_path(model_path))
+
+def atomic_save(obj, file_path: str) -> None:
+    '''Save an object in a temporary file of the same folder and move it to file_path, so readers
+    never load a partially written file'''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(obj, np.ndarray):
+                np.save(f, obj)
+            else:
+                pickle.dump(obj, f)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def evaluate(model, X: pd.DataFrame, y: np.ndarray) -> dict:
+    '''Accuracy and ROC AUC of a fitted classifier'''
+    from sklearn.metrics import accuracy_score, roc_auc_score
+    metrics = {'accuracy': accuracy_score(y, model.predict(X))}
+    metrics['roc_auc'] = roc_auc_score(y, model.predict_proba(X)[:, 1]) if len(np.unique(y))>1 else None
+    return {key: None if value is None else round(float(value), 4) for key, value in metrics.items()}
+
+def partial_fit_pipeline(model, X: pd.DataFrame, y: np.ndarray, epochs: int=10, seed: int=0):
+    '''Update a copy of a (scaler, MLP) pipeline with new rows: the scaler statistics are updated with
+    partial_fit and the MLP weights with epochs of partial_fit over the shuffled rows.
+    Returns
+    -------
+    sklearn Pipeline
+        The updated copy of the model'''
+    model = copy.deepcopy(model)
+    scaler, classifier = model.steps[0][1], model.steps[-1][1]
+    scaler.partial_fit(X)
+    X_scaled = scaler.transform(X)
+    rng = np.random.default_rng(seed)
+    for _ in range(epochs):
+        order = rng.permutation(len(y))
+        classifier.partial_fit(X_scaled[order], y[order])
+    return model
+
+@instrumented
+def update_model(
+    model_path: str,
+    dataset: pd.DataFrame,
+    holdout_size: float=.2,
+    epochs: int=10,
+    tolerance: float=.01,
+    seed: int=0
+    ) -> dict:
+    '''Update a pickled (model, variables) tuple with the contracts closed since it was trained.
+    A stratified holdout of the labelled contracts is kept out of the update; the updated model
+    replaces the pickle (atomically) only if its holdout accuracy and ROC AUC do not drop more
+    than tolerance from the current model. The keys of the trained contracts (contract_keys) are
+    kept next to the model; when they are missing, the current contracts are recorded as trained
+    and the model is not updated.
+    Parameters
+    ----------
+    model_path : str
+        Path of the pickle with the (model, variables) tuple, like models/perceptron_model.pkl
+    dataset : pd.DataFrame
+        Labelled dataset with the contract id, the model variables and the target, like {prefix}_non_correlated_dataset_train.csv
+    holdout_size : float, optional
+        Fraction of the contracts kept for validation, by default .2
+    epochs : int, optional
+        Passes of partial_fit over the new contracts, by default 10
+    tolerance : float, optional
+        Allowed drop of the holdout metrics, by default .01
+    seed : int, optional
+        Random seed of the holdout and the shuffles, by default 0
+    Returns
+    -------
+    dict
+        Dictionary with the new contracts, the holdout metrics of the current and updated models,
+        the update time and whether the model was replaced'''
+    from sklearn.model_selection import train_test_split
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with open(model_path, 'rb') as f:
+            model, variables = pickle.load(f)
+    X = predictive.model_variables(dataset, variables)
+    y = dataset[target].astype(int).to_numpy()
+    keys = contract_keys(dataset)
+    trained = load_trained_rows(model_path)
+    report = {'model': model_path, 'rows': len(dataset), 'new_rows': 0, 'swapped': False}
+    if trained is None:
+        print('     no trained rows recorded, recording the current contracts...')
+        atomic_save(np.unique(keys), rows_path(model_path))
+        return report
+    new = ~np.isin(keys, trained)
+    report['new_rows'] = int(new.sum())
+    if not new.any():
+        return report
+
+    stratify = y if np.bincount(y).min()>1 else None
+    _, holdout = train_test_split(np.arange(len(y)), test_size=holdout_size, random_state=seed, stratify=stratify)
+    update = new.copy()
+    update[holdout] = False
+    report['update_rows'] = int(update.sum())
+    if not update.any():
+        return report
+    start = time.perf_counter()
+    candidate = partial_fit_pipeline(model, X[update], y[update], epochs, seed)
+    report['update_seconds'] = round(time.perf_counter()-start, 4)
+    report['current'] = evaluate(model, X.iloc[holdout], y[holdout])
+    report['updated'] = evaluate(candidate, X.iloc[holdout], y[holdout])
+    report['swapped'] = all(
+        report['updated'][metric]>=report['current'][metric]-tolerance
+        for metric in report['current'] if report['current'][metric] is not None
+    )
+    if report['swapped']:
+        atomic_save((candidate, variables), model_path)
+        atomic_save(np.union1d(trained, keys[update]), rows_path(model_path))
+    return report
+
+@instrumented
+def incremental_training(model_path: str, prefix: str='', **kwargs) -> dict:
+    '''Update the model with the new contracts of the train dataset of a run and save the report.
+    Parameters
+    ----------
+    model_path : str
+        Path of the pickle with the (model, variables) tuple
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    dict
+        The update report, as returned by update_model'''
+    print('updating model with new contracts...')
+    file_path = os.path.join(data_tools.output_path, 'predictive_mining', 'train_set', f'{prefix}_non_correlated_dataset_train.csv')
+    report = update_model(model_path, pd.read_csv(file_path), **kwargs)
+    print(f"     {report['new_rows']} new contracts, model {'replaced' if report['swapped'] else 'kept'}")
+    with open(os.path.join(data_tools.output_path, 'models', f'{prefix}_model_update.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(report, indent=4))
+    return report
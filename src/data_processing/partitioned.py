@@ -0,0 +1,231 @@
+import os, re
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
+import src.data_processing.curated as curated
+import src.data_processing.predictive_data_mining as predictive
+import src.data_processing.descriptive_data_mining as descriptive
+
+partition_col = 'Proyecto'
+
+def split_partitions(df: pd.DataFrame, key: str=partition_col) -> dict:
+    '''Split a DataFrame into partitions by the values of a column. The original index is kept,
+    so the partitions can be merged back in the original order.
+    Parameters
+    ----------
+    df : pd.DataFrame
+        DataFrame to split
+    key : str, optional
+        Column to partition by, by default partition_col ('Proyecto')
+    Returns
+    -------
+    dict
+        Dictionary with the partition values as keys and the partitions as values'''
+    return {value: partition for value, partition in df.groupby(key, sort=True, dropna=False)}
+
+def merge_partitions(partitions: dict) -> pd.DataFrame:
+    '''Merge the partitions back into a single DataFrame in the original row order.
+    Parameters
+    ----------
+    partitions : dict
+        Dictionary with the partitions
+    Returns
+    -------
+    pd.DataFrame
+        Merged DataFrame'''
+    return pd.concat(partitions.values()).sort_index()
+
+def map_partitions(func, partitions: dict, n_jobs: int=None, **kwargs) -> dict:
+    '''Apply a function to every partition in a process pool.
+    Parameters
+    ----------
+    func : callable
+        Module level function receiving a partition (and kwargs) and returning a DataFrame
+    partitions : dict
+        Dictionary with the partitions
+    n_jobs : int, optional
+        Number of worker processes. If None uses the number of CPUs, by default None
+    Returns
+    -------
+    dict
+        Dictionary with the processed partitions'''
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {key: executor.submit(func, partition, **kwargs) for key, partition in partitions.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+def partition_slug(value: str) -> str:
+    '''Build a file name friendly identifier of a partition value'''
+    return re.sub(r'[^0-9a-zA-Z]+', '-', str(value)).strip('-').lower()
+
+def save_partitions(partitions: dict, name: str, prefix: str='') -> None:
+    '''Save every partition to output/partitions as {prefix}_{partition}_{name}.csv
+    Parameters
+    ----------
+    partitions : dict
+        Dictionary with the partitions
+    name : str
+        Name of the dataset
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    None'''
+    for key, partition in partitions.items():
+        partition.to_csv(
+            os.path.join(data_tools.output_path, 'partitions', f'{prefix}_{partition_slug(key)}_{name}.csv'),
+            index=0
+        )
+
+def curate_partition(partition: pd.DataFrame, plan: dict) -> dict:
+    '''Curation stage of a partition: drop columns, input missing values and split sets.
+    Parameters
+    ----------
+    partition : pd.DataFrame
+        Partition of the DANE enriched data
+    plan : dict
+        Global imputation plan, as returned by curated.imputation_plan
+    Returns
+    -------
+    dict
+        Dictionary with the partition sets: train, deploy, descriptive'''
+    base_curated = curated.drop_curated_cols(partition)
+    base_curated = curated.apply_imputation_plan(base_curated, plan)
+    return curated.split_sets(base_curated)
+
+def predictive_partition(partition: pd.DataFrame, now=None) -> pd.DataFrame:
+    '''Row-wise featuring stage of a predictive partition: years (at the date now, by default the
+    current time) and outliers marking'''
+    dataset_ = data_tools.years_computing(partition, now)
+    return data_tools.mark_outliers(dataset_)
+
+def dummies_partition(partition: pd.DataFrame, anios: float, vocabulary: dict) -> pd.DataFrame:
+    '''Global statistics stage of a predictive partition: years imputation and dummies with a
+    fixed vocabulary'''
+    partition = partition.assign(anios=partition.anios.fillna(anios))
+    return data_tools.get_dummies(partition, predictive.cat_cols, vocabulary=vocabulary)
+
+@instrumented
+def curate_partitioned(prefix: str='', n_jobs: int=None) -> dict:
+    '''Curate data by partitions. Imputation values are computed over the whole data and applied in
+    parallel by partition.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    n_jobs : int, optional
+        Number of worker processes, by default None
+    Returns
+    -------
+    dict
+        Dictionary with the partitions of every set (train, deploy, descriptive)'''
+    print('process curated data by partitions...')
+    print('     reading inputs...')
+    dane_enriched, dane_dict, business_dict = curated.read_data(prefix)
+    print('     computing global imputation values...')
+    plan = curated.imputation_plan(curated.drop_curated_cols(dane_enriched), dane_dict, business_dict)
+    print('     input missing values by partition...')
+    results = map_partitions(curate_partition, split_partitions(dane_enriched), n_jobs, plan=plan)
+    sets = {set_: {key: result[set_] for key, result in results.items()} for set_ in ['train', 'deploy', 'descriptive']}
+    print('     saving sets...')
+    for set_, partitions in sets.items():
+        save_partitions(partitions, f'{set_}_without_featuring', prefix)
+    curated.save_sets({set_: merge_partitions(partitions) for set_, partitions in sets.items()}, prefix)
+    return sets
+
+@instrumented
+def predictive_partitioned(partitions: dict, set_: str, prefix: str='', n_jobs: int=None) -> pd.DataFrame:
+    '''Build the train or deploy prediction dataset from its partitions. Row-wise features and
+    dummies run in parallel by partition, while the years imputation value and the dummies
+    vocabulary are computed over all the partitions (the deploy set reuses the train vocabulary). Feature selection needs the whole dataset so
+    it runs over the merged partitions.
+    Parameters
+    ----------
+    partitions : dict
+        Dictionary with the partitions of the curated set
+    set_ : str
+        Dataset to process, 'train' or 'deploy'
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    n_jobs : int, optional
+        Number of worker processes, by default None
+    Returns
+    -------
+    pd.DataFrame
+        The processed prediction dataset'''
+    print(f'getting {set_} dataset by partitions...')
+    file_path = os.path.join(data_tools.output_path, 'predictive_mining', f'{set_}_set', f'{prefix}_{set_}_without_featuring.csv')
+    print('     computing features and removing outliers...')
+    partitions = map_partitions(predictive_partition, partitions, n_jobs)
+    anios = data_tools.numeric_fill_value(pd.concat([partition.anios for partition in partitions.values()]))
+    vocabulary = data_tools.prediction_vocabulary(
+        set_, lambda: data_tools.dummy_vocabulary(list(partitions.values()), predictive.cat_cols), prefix
+    )
+    print('     getting dummies...')
+    partitions = map_partitions(dummies_partition, partitions, n_jobs, anios=anios, vocabulary=vocabulary)
+    save_partitions(partitions, f'{set_}_featured', prefix)
+    return predictive.save_prediction_dataset(merge_partitions(partitions), set_, file_path, prefix)
+
+@instrumented
+def descriptive_partitioned(partitions: dict, prefix: str='', n_jobs: int=None) -> None:
+    '''Build the descriptive datasets from its partitions. Row-wise features run in parallel by
+    partition; imputation, DANE features, dummies and quantile bins run over the merged data.
+    Parameters
+    ----------
+    partitions : dict
+        Dictionary with the partitions of the curated descriptive set
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    n_jobs : int, optional
+        Number of worker processes, by default None'''
+    print('processing descriptive sets by partitions...')
+    file_path = os.path.join(data_tools.output_path, 'descriptive_mining', f'{prefix}_descriptive_without_featuring.csv')
+    print('     removing outliers...')
+    partitions = map_partitions(descriptive.descriptive_row_features, partitions, n_jobs)
+    #the curated partitions keep the index of the enriched data, the global steps expect a range index
+    dataset = descriptive.descriptive_global_features(merge_partitions(partitions).reset_index(drop=True))
+    descriptive.build_descriptive_sets(dataset, file_path, prefix)
+
+def read_curated_partitions(prefix: str='') -> dict:
+    '''Read the curated sets saved by a previous curated stage and split them into partitions.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    dict
+        Dictionary with the partitions of every set (train, deploy, descriptive)'''
+    sets = {
+        set_: predictive.read_data(os.path.join(data_tools.output_path, 'predictive_mining', f'{set_}_set', f'{prefix}_{set_}_without_featuring.csv'))
+        for set_ in ['train', 'deploy']
+    }
+    sets['descriptive'] = descriptive.read_data(os.path.join(data_tools.output_path, 'descriptive_mining', f'{prefix}_descriptive_without_featuring.csv'))
+    return {set_: split_partitions(dataset) for set_, dataset in sets.items()}
+
+@instrumented
+def process_partitioned(prefix: str='', n_jobs: int=None, stages: list=None) -> None:
+    '''Run the curation, featuring and descriptive stages partitioned by project (Proyecto) in a
+    process pool. Inputs are the DANE enriched data of the geocoding stage and outputs are the same
+    files of the sequential pipeline plus the partitioned files in output/partitions.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    n_jobs : int, optional
+        Number of worker processes. If None uses the number of CPUs, by default None
+    stages : list, optional
+        Stages to run among 'curated', 'predictive' and 'descriptive'. Without the curated stage the
+        sets are read from its saved outputs. If None runs the three, by default None'''
+    stages = ['curated', 'predictive', 'descriptive'] if stages is None else stages
+    sets = curate_partitioned(prefix, n_jobs) if 'curated' in stages else None
+    if sets is None and ('predictive' in stages or 'descriptive' in stages):
+        sets = read_curated_partitions(prefix)
+    if 'predictive' in stages:
+        predictive_partitioned(sets['train'], 'train', prefix, n_jobs)
+        predictive_partitioned(sets['deploy'], 'deploy', prefix, n_jobs)
+    if 'descriptive' in stages:
+        descriptive_partitioned(sets['descriptive'], prefix, n_jobs)
+
+if __name__=='__main__':
+    process_partitioned()
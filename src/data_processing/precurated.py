@@ -19,19 +19,15 @@
 # - Se halla la desviación estándar y se observa que es alta, por lo que se decide tomar como métrica para la línea base.
 # - La métrica de la línea base es la desviación estándar del tiempo de permanencia en días, considerando los puntos antes mencionados.
 
-import json, os
+import os
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from src.commons.tools import input_path, output_path
+from src.commons.tools import input_path, output_path, read_config, normalize_dates
+from src.commons.instrumentation import instrumented
 
-plt.style.use('seaborn-v0_8')
 pd.set_option('display.max_columns', None)
 
-
-with open(os.path.join(input_path, 'colum-cleaning.json'), 'r', encoding='utf-8') as f:
-    cols = json.loads(f.read())
-
+@instrumented
 def read_inputs() -> dict:
     ''' Read input data files and return them in a dictionary.
     Returns
@@ -44,6 +40,7 @@ def read_inputs() -> dict:
         df_: DataFrame containing raw employee data from 'Empleados_Activos_Retirados_V1.csv'.'
         df: Merged DataFrame of df_ and employees on 'id.1'.'
         identifiers: DataFrame containing identifier columns from df.'''
+    cols = read_config('colum-cleaning.json')
     df_inputs = {}
     df_inputs['employees_'] = pd.read_csv(os.path.join(input_path, 'Empleados_AR.csv'), encoding='latin-1', sep=';', low_memory=False)
     df_inputs['drops'] = pd.read_csv(os.path.join(input_path, 'Retiros_Causa.csv'), encoding='latin-1', low_memory=False)
@@ -60,6 +57,7 @@ def read_inputs() -> dict:
     df_inputs['identifiers'] = df_inputs['df'][cols['idents']]
     return df_inputs
 
+@instrumented
 def build_raw_data(df_inputs: dict) -> dict:
     ''' Build raw data by cleaning and merging input dataframes.
     Parameters
@@ -71,6 +69,7 @@ def build_raw_data(df_inputs: dict) -> dict:
     dict
         A dictionary containing the cleaned and merged raw dataframes.
         df: Cleaned and merged DataFrame.'''
+    cols = read_config('colum-cleaning.json')
     df = df_inputs['df'].drop(cols['drop_cols'], axis=1)
     df = df.drop(cols['useless_cols'], axis=1)
     df = df.drop(cols['duplicated_cols'], axis=1)
@@ -81,10 +80,7 @@ def build_raw_data(df_inputs: dict) -> dict:
     complement = complement.join(df_inputs['employees_'][['id.1', 'salario_mes']].set_index('id.1'), on='id.1', how='inner')  #Adding salary and contract columns                                                                  #Adding 'Activo' value to causa_retiro column
     df = pd.concat([df, complement])                                                                                          #Putting it together
 
-    df = df.replace('1/01/2500', '1/01/1900')
-    for column in cols['dates']:
-        df[column] = df[column].str.replace(' 0:00', '')
-        df[column] = pd.to_datetime(df[column], format='%d/%m/%Y')
+    df = normalize_dates(df, cols['dates'])
     df = df.rename({
         'id.1': 'id_contrato',
         'fecha_ingreso.1': 'fecha_ingreso',
@@ -96,6 +92,7 @@ def build_raw_data(df_inputs: dict) -> dict:
     df_inputs['df'] = df
     return df_inputs
 
+@instrumented
 def build_precurated_data(df_inputs: dict) -> dict:
     ''' Build precurated data by filtering and cleaning the raw data.
     Parameters
@@ -108,6 +105,7 @@ def build_precurated_data(df_inputs: dict) -> dict:
         A dictionary containing the precurated dataframes.
         operative_stuff: Filtered and cleaned DataFrame for operative employees.
         days: Series containing the number of days each operative employee stayed in the company.'''
+    cols = read_config('colum-cleaning.json')
     operative_stuff = df_inputs['df'][
         (df_inputs['df'].Planta=='OPERATIVOS')&
         (df_inputs['df'].Proyecto.isin(cols['projects']))
@@ -117,6 +115,7 @@ def build_precurated_data(df_inputs: dict) -> dict:
     df_inputs['days'] = days[(days>0)&(days<120)]
     return df_inputs
 
+@instrumented
 def define_base_line(df_inputs: dict) -> dict:
     ''' Define the baseline by creating a histogram of the days employees stayed in the
     company and calculating the standard deviation.
@@ -128,6 +127,8 @@ def define_base_line(df_inputs: dict) -> dict:
     -------
     plt.figure
         A matplotlib figure containing the histogram of days employees stayed in the company.'''
+    import matplotlib.pyplot as plt
+    plt.style.use('seaborn-v0_8')
     desvest = round(float(df_inputs['days'].std()), 2)
     fig, ax = plt.subplots()
     counts, bins, _ = ax.hist(df_inputs['days'], bins=15, edgecolor='black', alpha=0.7)
@@ -150,7 +151,8 @@ def define_base_line(df_inputs: dict) -> dict:
     ax.set_ylabel('Frecuencia')
     return fig
 
-def save_preprocess(df_inputs: dict, fig: plt.figure, prefix: str='') -> None:
+@instrumented
+def save_preprocess(df_inputs: dict, fig: 'plt.figure', prefix: str='') -> None:
     ''' Save the preprocessed data and the baseline figure.
     Parameters
     ----------
@@ -180,6 +182,7 @@ def save_preprocess(df_inputs: dict, fig: plt.figure, prefix: str='') -> None:
         encoding='utf-8'
     )
 
+@instrumented
 def preprocess_data(prefix: str=''):
     ''' Preprocess the data by reading input files, building raw and precurated data,
     defining the baseline, and saving the results.
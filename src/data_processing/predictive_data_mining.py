@@ -1,12 +1,14 @@
 import json, os
 import pandas as pd, numpy as np
-from scipy import stats
 import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
+from src.data_processing import curated, drift_monitor, feature_scoring
 
 pd.set_option("display.max_columns", None)
 
 cat_cols = ['Desc_Cargo', 'Proyecto', 'genero']
 
+@instrumented
 def read_data(file_path: str) -> pd.DataFrame:
     '''Read dataset from the specified file path.
     Parameters
@@ -17,9 +19,9 @@ def read_data(file_path: str) -> pd.DataFrame:
     -------
     pd.DataFrame
         The loaded dataset as a pandas DataFrame.'''
-    dataset = pd.read_csv(
+    dataset = data_tools.read_csv_dates(
         file_path,
-        parse_dates=['fecha_nacimiento']
+        ['fecha_nacimiento']
     )
     return dataset
 
@@ -49,6 +51,7 @@ def get_high_correlated_features(df: pd.DataFrame) -> pd.DataFrame:
     hyper_correlated = pd.DataFrame({'variable1': v1, 'variable2': v2, 'correlation': corr}).drop_duplicates()
     return hyper_correlated
 
+@instrumented
 def drop_non_variant_cols(dataset_: pd.DataFrame) -> pd.DataFrame:
     '''Drop columns with no variation in the dataset.
     Parameters
@@ -66,8 +69,9 @@ def drop_non_variant_cols(dataset_: pd.DataFrame) -> pd.DataFrame:
     dataset_ = dataset_[dataset_.columns[~dataset_.columns.isin(no_variation_cols)]]
     return dataset_
 
-def dropping_irrelevant_variables(dataset_: pd.DataFrame, file_path: str) -> pd.DataFrame:
-    '''Drop irrelevant predictors from the dataset based on correlation with the target variable.
+@instrumented
+def dropping_irrelevant_variables(dataset_: pd.DataFrame, file_path: str, scores: pd.DataFrame) -> pd.DataFrame:
+    '''Drop irrelevant predictors from the dataset based on their univariate scores against the target variable.
     Parameters
     ----------
     dataset_ : pd.DataFrame
@@ -75,64 +79,154 @@ def dropping_irrelevant_variables(dataset_: pd.DataFrame, file_path: str) -> pd.
         from which to drop irrelevant predictors.
     file_path : str
         The path to the CSV file containing the curated dataset without feature engineering,
-        used to determine the location for saving the correlation matrix.'''
-    #Droping columns with no correlation with objective variable ('causa_retiro')
+        used to determine the location for saving the correlation matrix.
+    scores : pd.DataFrame
+        The feature scores, as returned by feature_scoring.score_features.'''
+    #Droping columns with no relation with objective variable ('causa_retiro')
     corr_matrix = dataset_.corr()
     corr_matrix.to_excel(os.path.join(os.path.dirname(file_path), 'correlation_matrix.xlsx'), index=0)
-    relevant_variables = corr_matrix.loc['causa_retiro'].abs()
-    relevant_variables = relevant_variables[relevant_variables>0.05].index.tolist()
-    dataset_ = dataset_[relevant_variables]
+    relevant_variables = feature_scoring.relevant_features(scores)
+    dataset_ = dataset_[relevant_variables+['causa_retiro']]
     return dataset_
 
-def dropping_redundant_variables(dataset_: pd.DataFrame) -> pd.DataFrame:
-    '''Drop highly correlated predictors from the dataset.
+@instrumented
+def dropping_redundant_variables(dataset_: pd.DataFrame, scores: pd.DataFrame) -> pd.DataFrame:
+    '''Drop highly correlated predictors from the dataset, keeping the best scored predictor of every pair.
     Parameters
     ----------
     dataset_ : pd.DataFrame
         The dataset with feature engineering, outliers remotion and dummies creation,
         from which to drop highly correlated predictors.
+    scores : pd.DataFrame
+        The feature scores, as returned by feature_scoring.score_features.
     Returns
     -------
     pd.DataFrame
         The dataset with highly correlated predictors removed.'''
     #Droping highly correlated columns
-    print('         computing dane features...')
-    featured_dataset = data_tools.feature_dane(dataset_)
-    correlated_features = get_high_correlated_features(featured_dataset) #use this to get highly correlated variables
-    featured_dataset = featured_dataset.drop(data_tools.cols_high_correlated, axis=1)
+    correlated_features = get_high_correlated_features(dataset_)
+    selected = feature_scoring.non_redundant_features(correlated_features, scores.loc[scores.index.isin(dataset_.columns)])
+    featured_dataset = dataset_[[col for col in dataset_.columns if col in selected]+['causa_retiro']]
     scope = featured_dataset.causa_retiro
     featured_dataset = featured_dataset.drop('causa_retiro', axis=1)
     featured_dataset['retiro'] = scope
     return featured_dataset
 
-def process_deploy_set(dataset_: pd.DataFrame) -> pd.DataFrame:
-    '''Process the deploy dataset by computing features and aligning it with the training dataset schema.
+def deployed_variables() -> list:
+    '''Variables of the deployed model, from the schema of data-mining-schema.json without the target.
+    None if the schema is not in the inputs'''
+    schema_path = os.path.join(data_tools.input_path, 'data-mining-schema.json')
+    if not os.path.exists(schema_path):
+        return None
+    with open(schema_path) as f:
+        return [col for col in json.loads(f.read())['schema'] if col!='retiro']
+
+def scored_variables(prefix: str='') -> list:
+    '''Variables of the deploy dataset and of the drift reference: the variables of the deployed
+    model, or the features selected on the train dataset of the run if there is no schema (the
+    selection only changes the scored variables once a model is trained on it)'''
+    deployed = deployed_variables()
+    return feature_scoring.load_selected_features(prefix) if deployed is None else deployed
+
+@instrumented
+def process_deploy_set(dataset_: pd.DataFrame, prefix: str='') -> pd.DataFrame:
+    '''Process the deploy dataset by computing features and aligning it with the variables of the
+    deployed model (data-mining-schema.json). Without a schema it uses the features selected on the
+    train dataset of the same prefix.
     Parameters
     ----------
     dataset_ : pd.DataFrame
         The deploy dataset with feature engineering, outliers remotion and dummies creation.
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
     Returns
     -------
     pd.DataFrame
-        The processed deploy dataset aligned with the training dataset schema.'''
+        The processed deploy dataset aligned with the deployed model schema.'''
+    variables = scored_variables(prefix)
+    if variables is None:
+        raise FileNotFoundError('data-mining-schema.json is not in the inputs and the train dataset was not processed')
     print('         computing dane features...')
     featured_dataset = data_tools.feature_dane(dataset_)
     featured_dataset = featured_dataset.drop('causa_retiro', axis=1)
     featured_dataset['retiro'] = '?'
-    schema = os.path.join('..', 'input', 'data-mining-schema.json')
-    with open(schema) as f:
-        schema = json.loads(f.read())
-    missing_cols = list(set(schema['schema'])-set(featured_dataset.columns))
-    for col in missing_cols:
-        featured_dataset[col] = 0
-    featured_dataset = featured_dataset[schema['schema']]
-    return featured_dataset
+    return align_variables(featured_dataset, variables)[variables+['retiro']]
 
-def process_prediction_dataset(file_path: str, prefix: str='') -> pd.DataFrame:
-    '''Process the prediction dataset by reading, computing features, removing outliers,
-    getting dummies, and saving the processed dataset.
+def align_variables(dataset: pd.DataFrame, variables: list) -> pd.DataFrame:
+    '''Add the variables missing in a featured dataset that are dummies (categories without rows in
+    the dataset) as 0 columns; any other missing variable raises a KeyError.
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        Featured dataset
+    variables : list
+        Variables to align with
+    Returns
+    -------
+    pd.DataFrame
+        The dataset with every variable'''
+    missing = [var for var in variables if var not in dataset.columns]
+    not_dummies = [var for var in missing if not var.startswith(tuple(f'{col}_' for col in cat_cols))]
+    if not_dummies:
+        raise KeyError(f'variables not in the dataset: {not_dummies}')
+    return dataset.assign(**{var: 0 for var in missing})
+
+def model_variables(dataset: pd.DataFrame, variables: list) -> pd.DataFrame:
+    '''Align a featured dataset with the variables of a model. Missing dummy columns are categories
+    without rows in the dataset and are filled with 0, any other missing variable raises a KeyError.
+    Parameters
+    ----------
+    dataset : pd.DataFrame
+        Featured dataset, like {prefix}_non_correlated_dataset_train.csv
+    variables : list
+        Variables of the model, in order
+    Returns
+    -------
+    pd.DataFrame
+        float DataFrame with the variables of the model'''
+    return align_variables(dataset, variables)[list(variables)].astype(float)
+
+def check_model_variables(model_path: str, prefix: str='') -> None:
+    '''Check that the train dataset of a run has the variables of a pickled (model, variables) tuple,
+    before the stages that use both (explanation, incremental and export).
+    Parameters
+    ----------
+    model_path : str
+        Path of the pickle with the (model, variables) tuple
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    None'''
+    import pickle, warnings
+    file_path = os.path.join(data_tools.output_path, 'predictive_mining', 'train_set', f'{prefix}_non_correlated_dataset_train.csv')
+    if not os.path.exists(file_path):
+        return
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with open(model_path, 'rb') as f:
+            _, variables = pickle.load(f)
+    try:
+        align_variables(pd.read_csv(file_path, nrows=0), list(variables))
+    except KeyError as error:
+        raise ValueError(
+            f'{model_path} was trained on variables that the train dataset {os.path.basename(file_path)} does not have '
+            f'({error.args[0]}): add the model variables to data-mining-schema.json or retrain the model on the selected features'
+        ) from None
+
+def select_features(dataset_: pd.DataFrame, set_: str, file_path: str, prefix: str='') -> pd.DataFrame:
+    '''Select the final features of the train or deploy dataset. The features selected on the train
+    dataset are saved in output/models/{prefix}_selected_features.json; the train dataset also keeps
+    the variables of the deployed model and the deploy dataset has only those (see scored_variables).
+    The candidates are filtered for relevance before the DANE features (KNN imputation) are computed,
+    then only the DANE ratios are scored. The contract id is not a feature, it is kept as the first
+    column of the train dataset.
     Parameters
     ----------
+    dataset_ : pd.DataFrame
+        The dataset with feature engineering, outliers remotion and dummies creation.
+    set_ : str
+        Dataset to process, 'train' or 'deploy'.
     file_path : str
         The path to the CSV file containing the curated dataset without feature engineering.
     prefix : str, optional
@@ -140,44 +234,136 @@ def process_prediction_dataset(file_path: str, prefix: str='') -> pd.DataFrame:
     Returns
     -------
     pd.DataFrame
-        The processed prediction dataset.'''
-    set_ = os.path.basename(file_path).split('_')[1]
-    print(f'getting {set_} dataset...')
-    dataset = read_data(file_path)
-    print('     computing features...')
-    dataset_ = data_tools.years_computing(dataset)
-    print('     removing outliers...')
-    dataset_ = data_tools.outliers_remotion(dataset_)
-    print('     getting dummies...')
-    dataset_ = data_tools.get_dummies(dataset_, cat_cols)
+        The dataset with the selected features.'''
+    contracts = dataset_[curated.contract_col].to_numpy() if curated.contract_col in dataset_.columns else None
+    dataset_ = dataset_.drop([col for col in [curated.contract_col] if col in dataset_.columns], axis=1)
     if set_=='train':
         print('     dropping unvariant cols...')
         dataset_ = drop_non_variant_cols(dataset_)
+        #the DANE counts are candidates only through their ratios to the DANE totals
+        counts = np.unique([var for value in data_tools.feature_bars.values() for var in value]).tolist()
+        print('     scoring features...')
+        scores = feature_scoring.score_features(dataset_.drop(counts, axis=1))
+        relevant = feature_scoring.relevant_features(scores)
+        #the variables of the deployed model are kept in the train dataset, to evaluate and update it
+        deployed = deployed_variables() or []
+        candidates = [col for col in dataset_.columns if (col in relevant or col in deployed) and col not in counts+['causa_retiro']]
+        print('     computing dane features of the relevant features...')
+        dane_cols = counts+[col for col in data_tools.total_counting if col not in candidates+counts]
+        dataset_ = data_tools.feature_dane(dataset_[candidates+dane_cols+['causa_retiro']])
+        featured_candidates = dataset_
+        ratios = [col for col in dataset_.columns if col not in candidates+dane_cols+['causa_retiro']]
+        print('     scoring dane features...')
+        scores = feature_scoring.rank_scores(pd.concat([scores, feature_scoring.score_features(dataset_[ratios+['causa_retiro']])]))
         print('     dropping irrelevant variables...')
-        dataset_ = dropping_irrelevant_variables(dataset_, file_path)
+        dataset_ = dropping_irrelevant_variables(dataset_, file_path, scores)
         print('     dropping redundant variables...')
-        featured_dataset = dropping_redundant_variables(dataset_)
+        featured_dataset = dropping_redundant_variables(dataset_, scores)
+        if featured_dataset.columns.equals(pd.Index(['retiro'])):
+            raise ValueError('no feature is relevant and non redundant, the train dataset would only have the target')
+        feature_scoring.save_selected_features(featured_dataset.columns.drop('retiro').tolist(), scores, prefix)
+        extra = [col for col in deployed if col not in featured_dataset.columns]
+        featured_dataset = align_variables(featured_dataset.join(featured_candidates[[col for col in extra if col in featured_candidates.columns]]), extra)
+        featured_dataset = featured_dataset[featured_dataset.columns.drop('retiro').tolist()+['retiro']]
+        if contracts is not None:
+            #the rows are kept in order by the selection, feature_dane only resets the index
+            featured_dataset.insert(0, curated.contract_col, contracts)
     else:
         print('     processing deploy dataset...')
-        featured_dataset = process_deploy_set(dataset_)
+        featured_dataset = process_deploy_set(dataset_, prefix)
+    return featured_dataset
+
+@instrumented
+def lazy_prediction_dataset(file_path: str, prefix: str='') -> pd.DataFrame:
+    '''Read the dataset, compute years, remove outliers and get dummies in a single Polars query plan.
+    Parameters
+    ----------
+    file_path : str
+        The path to the CSV file containing the curated dataset without feature engineering.
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    pd.DataFrame
+        The dataset with feature engineering, outliers remotion and dummies creation, like the pandas steps.'''
+    from src.commons import polars_tools
+    lf = polars_tools.scan_csv_dates(file_path, ['fecha_nacimiento'])
+    lf = polars_tools.outliers_remotion(polars_tools.years_computing(lf))
+    set_ = os.path.basename(file_path).split('_')[1]
+    vocabulary = data_tools.prediction_vocabulary(set_, lambda: polars_tools.dummy_vocabulary(lf, cat_cols), prefix)
+    return polars_tools.collect(polars_tools.get_dummies(lf, cat_cols, vocabulary=vocabulary))
+
+@instrumented
+def process_prediction_dataset(file_path: str, prefix: str='', backend: str='pandas') -> pd.DataFrame:
+    '''Process the prediction dataset by reading, computing features, removing outliers,
+    getting dummies, and saving the processed dataset.
+    Parameters
+    ----------
+    file_path : str
+        The path to the CSV file containing the curated dataset without feature engineering.
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    backend : str, optional
+        Dataframe engine of the reading, features, outliers and dummies steps, 'pandas' or 'polars', by default 'pandas'
+    Returns
+    -------
+    pd.DataFrame
+        The processed prediction dataset.'''
+    set_ = os.path.basename(file_path).split('_')[1]
+    print(f'getting {set_} dataset...')
+    if backend=='polars':
+        print('     computing features, removing outliers and getting dummies with the polars backend...')
+        dataset_ = lazy_prediction_dataset(file_path, prefix)
+    else:
+        dataset = read_data(file_path)
+        print('     computing features...')
+        dataset_ = data_tools.years_computing(dataset)
+        print('     removing outliers...')
+        dataset_ = data_tools.outliers_remotion(dataset_)
+        print('     getting dummies...')
+        vocabulary = data_tools.prediction_vocabulary(set_, lambda: data_tools.dummy_vocabulary(dataset_, cat_cols), prefix)
+        dataset_ = data_tools.get_dummies(dataset_, cat_cols, vocabulary=vocabulary)
+    return save_prediction_dataset(dataset_, set_, file_path, prefix)
+
+def save_prediction_dataset(dataset_: pd.DataFrame, set_: str, file_path: str, prefix: str='') -> pd.DataFrame:
+    '''Select the features of a prediction dataset with dummies, save it and monitor its drift.
+    Parameters
+    ----------
+    dataset_ : pd.DataFrame
+        The dataset with feature engineering, outliers remotion and dummies creation.
+    set_ : str
+        Dataset to process, 'train' or 'deploy'.
+    file_path : str
+        The path to the CSV file containing the curated dataset without feature engineering.
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    Returns
+    -------
+    pd.DataFrame
+        The processed prediction dataset.'''
+    featured_dataset = select_features(dataset_, set_, file_path, prefix)
     print(f'    saving {set_} dataset')
     featured_dataset.to_csv(os.path.join(os.path.dirname(file_path), f'{prefix}_non_correlated_dataset_{set_}.csv'), index=0)
+    drift_monitor.monitor_drift(featured_dataset, set_, file_path, prefix, scored_variables(prefix))
     return featured_dataset
 
-def get_train_deploy_datasets(prefix: str=''):
+@instrumented
+def get_train_deploy_datasets(prefix: str='', backend: str='pandas'):
     '''Generate and save the train and deploy datasets by processing the respective CSV files.
     Parameters
     ----------
     prefix : str, optional
         Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    backend : str, optional
+        Dataframe engine, 'pandas' or 'polars' (lazy query plan, same outputs), by default 'pandas'
     Returns
     -------
     None
         The function saves the processed train and deploy datasets to CSV files and does not return any value.'''
     file_path = os.path.join(data_tools.output_path, 'predictive_mining', 'train_set', f'{prefix}_train_without_featuring.csv')
-    process_prediction_dataset(file_path, prefix)
+    process_prediction_dataset(file_path, prefix, backend)
     file_path = os.path.join(data_tools.output_path, 'predictive_mining', 'deploy_set', f'{prefix}_deploy_without_featuring.csv')
-    process_prediction_dataset(file_path, prefix)
+    process_prediction_dataset(file_path, prefix, backend)
     
 if __name__=='__main__':
     get_train_deploy_datasets()
\ No newline at end of file
@@ -0,0 +1,364 @@
+#Lightweight profiling reports of the pipeline datasets, replacing the ydata_profiling reports of the
+#notebooks. Column statistics are computed in a single pass over the CSV chunks; histograms, quantiles
+#and correlations come from a uniform reservoir sample of the rows. Profiles are cached by file hash.
+import datetime, hashlib, html, json, os
+import pandas as pd, numpy as np
+import src.commons.tools as data_tools
+from src.commons.instrumentation import instrumented
+
+profiling_path = os.path.join(data_tools.output_path, 'profiling')
+#datasets profiled by the stage: name -> path of the CSV, formatted with the prefix
+profiled_datasets = {
+    'prediction': os.path.join(data_tools.output_path, 'predictive_mining', 'train_set', '{prefix}_non_correlated_dataset_train.csv'),
+    'asociation': os.path.join(data_tools.output_path, 'descriptive_mining', '{prefix}_description_categorical.csv')
+}
+quantiles = [.05, .25, .5, .75, .95]
+#categorical columns keep this number of most frequent values in the profile
+top_values = 5
+#values counted by the top values counter, counts are exact up to this number of distinct values
+counted_values = 256
+#hashes kept by the distinct count sketch, counts are exact up to this number of distinct values
+distinct_sketch_size = 1024
+#version of the profile statistics, part of the cache key so older cached profiles are recomputed
+profile_version = 3
+
+class DistinctSketch:
+    '''K minimum values sketch of the number of distinct values: only the k smallest 64-bit hashes
+    of the values are kept. The count is exact up to k distinct values, above it is estimated from
+    the k-th smallest hash (relative error around 1/sqrt(k))'''
+    def __init__(self, k: int=distinct_sketch_size):
+        self.k = k
+        self.hashes = np.empty(0, dtype=np.uint64)
+
+    def update(self, values: pd.Series) -> None:
+        '''Add a chunk of non missing values'''
+        hashes = pd.util.hash_array(values.to_numpy())
+        self.hashes = np.unique(np.concatenate([self.hashes, hashes]))[:self.k]
+
+    def estimate(self) -> int:
+        '''Number of distinct values'''
+        if len(self.hashes)<self.k:
+            return len(self.hashes)
+        return int(round((self.k-1)*2.**64/(float(self.hashes[-1])+1)))
+
+class TopValues:
+    '''Space saving counter of the most frequent values: only k values are counted, a value out of
+    the counter replaces the least counted ones and starts from their count. The counts are exact
+    up to k distinct values, above it they overestimate by at most the smallest count kept'''
+    def __init__(self, k: int=counted_values):
+        self.k = k
+        self.counts = pd.Series(dtype=float)
+
+    def update(self, counts: pd.Series) -> None:
+        '''Add the value counts of a chunk'''
+        floor = self.counts.min() if len(self.counts)>=self.k else 0
+        values = self.counts.index.union(counts.index)
+        counts = self.counts.reindex(values, fill_value=floor)+counts.reindex(values, fill_value=0)
+        self.counts = counts.sort_values(ascending=False, kind='stable').head(self.k)
+
+    def top(self, n: int) -> pd.Series:
+        '''The n most counted values, in order of value on ties'''
+        return self.counts.sort_index().sort_values(ascending=False, kind='stable').head(n)
+
+class ColumnStats:
+    '''Streaming statistics of a column. Chunks are merged with the parallel variance formula (Chan
+    et al.), so the mean and standard deviation are exact without keeping the values. The type is
+    decided by the first chunk with values; a numeric column with values that are not numbers in a
+    later chunk turns categorical, with its distinct and top values of the previous chunks derived
+    from their sample'''
+    def __init__(self):
+        self.numeric = None
+        self.count, self.missing = 0, 0
+        self.mean, self.m2 = 0., 0.
+        self.min, self.max, self.zeros = np.inf, -np.inf, 0
+        self.distinct = DistinctSketch()
+        self.top_values = TopValues()
+
+    def update(self, values: pd.Series, sample: pd.Series=None) -> None:
+        '''Add a chunk of values. sample holds the sampled values of the previous chunks, used if
+        the column turns categorical'''
+        present = values.dropna()
+        self.missing += len(values)-len(present)
+        if not len(present):
+            return
+        if self.numeric is None:
+            self.numeric = pd.api.types.is_numeric_dtype(present)
+        if self.numeric:
+            numbers = pd.to_numeric(present, errors='coerce')
+            if numbers.notna().all():
+                self.update_numeric(numbers.to_numpy(dtype=float))
+                return
+            self.to_categorical(sample)
+        present = present.astype(str)
+        self.distinct.update(present)
+        self.top_values.update(present.value_counts())
+        self.count += len(present)
+
+    def to_categorical(self, sample: pd.Series=None) -> None:
+        '''Restart the statistics of a numeric column as categorical. The hashes and counts of the
+        numbers are not mixed with the strings: the distinct and top values of the previous chunks
+        are derived from their sample, written without trailing zeros, with the counts scaled to
+        the rows seen'''
+        self.numeric = False
+        self.mean, self.m2 = 0., 0.
+        self.min, self.max, self.zeros = np.inf, -np.inf, 0
+        self.distinct, self.top_values = DistinctSketch(), TopValues()
+        previous = pd.Series(dtype=float) if sample is None else pd.to_numeric(sample, errors='coerce').dropna()
+        if len(previous):
+            previous = previous.map(lambda number: np.format_float_positional(number, trim='-'))
+            self.distinct.update(previous)
+            self.top_values.update((previous.value_counts()*self.count/len(previous)).round())
+
+    def update_numeric(self, x: np.ndarray) -> None:
+        '''Add a chunk of non missing numbers'''
+        self.distinct.update(pd.Series(x))
+        n, mean = len(x), x.mean()
+        delta = mean-self.mean
+        total = self.count+n
+        self.m2 += ((x-mean)**2).sum()+delta**2*self.count*n/total
+        self.mean += delta*n/total
+        self.count = total
+        self.min, self.max = min(self.min, x.min()), max(self.max, x.max())
+        self.zeros += int((x==0).sum())
+
+    def summary(self) -> dict:
+        '''Statistics of the column, JSON serializable'''
+        rows = self.count+self.missing
+        summary = {
+            'type': 'numeric' if self.numeric else 'categorical',
+            'count': self.count,
+            'missing': self.missing,
+            'missing_share': round(self.missing/rows, 4) if rows else 0.,
+            'distinct': self.distinct.estimate()
+        }
+        if self.numeric and self.count:
+            summary.update({
+                'mean': float(self.mean),
+                'std': float(np.sqrt(self.m2/(self.count-1))) if self.count>1 else 0.,
+                'min': float(self.min),
+                'max': float(self.max),
+                'zeros': self.zeros
+            })
+        if not self.numeric:
+            top = self.top_values.top(top_values)
+            summary['top_values'] = [[str(value), int(count)] for value, count in top.items()]
+        return summary
+
+def reservoir_update(sample: pd.DataFrame, chunk: pd.DataFrame, size: int, rng: np.random.Generator) -> pd.DataFrame:
+    '''Keep a uniform sample of size rows of all the chunks seen: every row gets a random key and the
+    rows with the smallest keys are kept, which is equivalent to reservoir sampling'''
+    chunk = chunk.assign(_key=rng.random(len(chunk)))
+    sample = chunk if sample is None else pd.concat([sample, chunk])
+    return sample.nsmallest(size, '_key') if len(sample)>size else sample
+
+def sample_statistics(sample: pd.DataFrame, columns: dict, bins: int, correlation_threshold: float) -> tuple:
+    '''Quantiles and histograms of the numeric columns and their most correlated pairs, over the sample'''
+    numeric = [col for col, stats in columns.items() if stats['type']=='numeric' and stats['count']]
+    for col in numeric:
+        values = sample[col].dropna().to_numpy(dtype=float)
+        if not len(values):
+            continue
+        columns[col]['quantiles'] = dict(zip(map(str, quantiles), np.quantile(values, quantiles).round(6).tolist()))
+        counts, edges = np.histogram(values, bins=min(bins, max(int(columns[col]['distinct']), 1)))
+        columns[col]['histogram'] = {'counts': counts.tolist(), 'edges': edges.round(6).tolist()}
+    correlations = sample[numeric].astype(float).corr().to_numpy() if len(numeric)>1 else np.empty((0, 0))
+    pairs = [
+        [numeric[i], numeric[j], round(float(correlations[i, j]), 4)]
+        for i, j in zip(*np.triu_indices(len(numeric), k=1))
+        if abs(correlations[i, j])>=correlation_threshold
+    ]
+    return columns, sorted(pairs, key=lambda pair: -abs(pair[2]))
+
+def alerts(profile: dict) -> list:
+    '''Warnings of the profile: constant columns, columns mostly missing and highly correlated pairs'''
+    warnings = []
+    for col, stats in profile['columns'].items():
+        if stats['distinct']<=1:
+            warnings.append(f'{col} is constant')
+        if stats['missing_share']>.5:
+            warnings.append(f"{col} has {stats['missing_share']:.0%} missing values")
+    warnings.extend(f'{a} is highly correlated with {b} (r={r})' for a, b, r in profile['correlations'] if abs(r)>=.9)
+    return warnings
+
+@instrumented
+def profile_csv(
+    file_path: str,
+    sample_size: int=10000,
+    chunksize: int=50000,
+    bins: int=20,
+    correlation_threshold: float=.5,
+    seed: int=0,
+    cache_dir: str=None
+    ) -> dict:
+    '''Profile a CSV file in a single streaming pass. Counts, missing values, mean, standard
+    deviation, min and max are exact, distinct and top values are exact up to distinct_sketch_size
+    and counted_values distinct values and estimated above them; quantiles, histograms and
+    correlations are computed over a reservoir sample of the rows. The profile is cached by file hash and parameters.
+    Parameters
+    ----------
+    file_path : str
+        Path of the CSV file
+    sample_size : int, optional
+        Rows of the reservoir sample. If None all the rows are kept, by default 10000
+    chunksize : int, optional
+        Rows read by chunk, by default 50000
+    bins : int, optional
+        Maximum bins of the histograms, by default 20
+    correlation_threshold : float, optional
+        Minimum absolute Pearson correlation of the reported pairs, by default .5
+    seed : int, optional
+        Random seed of the sample, by default 0
+    cache_dir : str, optional
+        Directory of the cached profiles. If None uses output/profiling/cache, by default None
+    Returns
+    -------
+    dict
+        Dictionary with the rows, the statistics by column, the correlated pairs and the alerts'''
+    cache_dir = os.path.join(profiling_path, 'cache') if cache_dir is None else cache_dir
+    digest = data_tools.file_hash(file_path)
+    key = hashlib.sha256(f'{profile_version}{digest}{sample_size}{bins}{correlation_threshold}{seed}'.encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f'{key[:16]}.json')
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.loads(f.read())
+
+    rng = np.random.default_rng(seed)
+    stats, sample, rows = None, None, 0
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        if stats is None:
+            stats = {col: ColumnStats() for col in chunk.columns}
+        for col, col_stats in stats.items():
+            col_stats.update(chunk[col], None if sample is None else sample[col])
+        rows += len(chunk)
+        sample = reservoir_update(sample, chunk, rows if sample_size is None else sample_size, rng)
+    stats = stats or {}
+    sample = pd.DataFrame(columns=list(stats)) if sample is None else sample.drop('_key', axis=1)
+    columns = {col: col_stats.summary() for col, col_stats in stats.items()}
+    for col, col_stats in stats.items():
+        if col_stats.numeric:
+            sample[col] = pd.to_numeric(sample[col], errors='coerce')
+    columns, correlations = sample_statistics(sample, columns, bins, correlation_threshold)
+    profile = {
+        'file': os.path.basename(file_path),
+        'file_hash': digest,
+        'rows': rows,
+        'sample_rows': len(sample),
+        'missing_cells': sum(col['missing'] for col in columns.values()),
+        'columns': columns,
+        'correlations': correlations
+    }
+    profile['alerts'] = alerts(profile)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(profile, indent=4))
+    return profile
+
+def histogram_svg(histogram: dict, width: int=160, height: int=40) -> str:
+    '''Inline SVG bar chart of a histogram'''
+    counts = histogram['counts']
+    peak = max(max(counts), 1)
+    bar = width/len(counts)
+    bars = ''.join(
+        f'<rect x="{i*bar:.1f}" y="{height-count/peak*height:.1f}" width="{max(bar-1, 1):.1f}" height="{count/peak*height:.1f}"/>'
+        for i, count in enumerate(counts)
+    )
+    return f'<svg width="{width}" height="{height}" class="histogram">{bars}</svg>'
+
+def format_value(value) -> str:
+    '''Number with 4 significant digits, or the escaped value'''
+    if isinstance(value, float):
+        return f'{value:.4g}'
+    return html.escape(str(value))
+
+def render_html(profile: dict, title: str) -> str:
+    '''Render a profile as a self contained HTML page (no scripts nor external resources)
+    Parameters
+    ----------
+    profile : dict
+        Profile, as returned by profile_csv
+    title : str
+        Title of the report
+    Returns
+    -------
+    str
+        The HTML page'''
+    overview = {
+        'Rows': profile['rows'],
+        'Columns': len(profile['columns']),
+        'Missing cells': profile['missing_cells'],
+        'Sampled rows': profile['sample_rows'],
+        'File': profile['file'],
+        'SHA-256': profile['file_hash'][:16]
+    }
+    rows = []
+    for col, stats in profile['columns'].items():
+        if stats['type']=='numeric':
+            details = ' '.join(
+                f'<b>{name}</b> {format_value(stats[name])}' for name in ['mean', 'std', 'min', 'max', 'zeros'] if name in stats
+            )
+            if 'quantiles' in stats:
+                details += '<br>'+' '.join(f'<b>p{float(q)*100:g}</b> {format_value(value)}' for q, value in stats['quantiles'].items())
+            chart = histogram_svg(stats['histogram']) if 'histogram' in stats else ''
+        else:
+            details = '<br>'.join(f'{format_value(value)} <i>({count})</i>' for value, count in stats['top_values'])
+            chart = ''
+        rows.append(
+            f"<tr><td><b>{html.escape(col)}</b><br><i>{stats['type']}</i></td>"
+            f"<td>{stats['missing_share']:.1%}</td><td>{stats['distinct']}</td><td>{details}</td><td>{chart}</td></tr>"
+        )
+    correlations = ''.join(
+        f'<tr><td>{html.escape(a)}</td><td>{html.escape(b)}</td><td>{r}</td></tr>' for a, b, r in profile['correlations']
+    )
+    return f'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>
+body {{font-family: sans-serif; margin: 2em; color: #222}}
+table {{border-collapse: collapse; margin-bottom: 2em}}
+td, th {{border-bottom: 1px solid #ddd; padding: 4px 8px; text-align: left; vertical-align: top; font-size: 13px}}
+.histogram rect {{fill: #4c78a8}}
+.alert {{color: #b35900}}
+</style></head><body>
+<h1>{html.escape(title)}</h1>
+<p>Generated {datetime.datetime.now():%Y-%m-%d %H:%M}</p>
+<h2>Overview</h2>
+<table>{''.join(f'<tr><th>{name}</th><td>{html.escape(str(value))}</td></tr>' for name, value in overview.items())}</table>
+<h2>Alerts</h2>
+<ul>{''.join(f'<li class="alert">{html.escape(alert)}</li>' for alert in profile['alerts']) or '<li>None</li>'}</ul>
+<h2>Variables</h2>
+<table><tr><th>Variable</th><th>Missing</th><th>Distinct</th><th>Statistics</th><th>Histogram (sample)</th></tr>{''.join(rows)}</table>
+<h2>Correlations (sample)</h2>
+<table><tr><th>Variable</th><th>Variable</th><th>Pearson r</th></tr>{correlations}</table>
+</body></html>
+'''
+
+@instrumented
+def profile_datasets(prefix: str='', datasets: list=None, **kwargs) -> dict:
+    '''Profile the pipeline datasets and save their HTML reports to output/profiling as
+    {prefix}_{dataset}_profiling.html. Datasets not generated yet are skipped.
+    Parameters
+    ----------
+    prefix : str, optional
+        Prefix to identify the files input-output. Like an unique identifier to make a trace between tests, by default ''
+    datasets : list, optional
+        Names of the datasets to profile (keys of profiled_datasets). If None profiles all, by default None
+    Returns
+    -------
+    dict
+        Dictionary with the paths of the reports by dataset'''
+    print('profiling datasets...')
+    os.makedirs(profiling_path, exist_ok=True)
+    reports = {}
+    for name in profiled_datasets if datasets is None else datasets:
+        file_path = profiled_datasets[name].format(prefix=prefix)
+        if not os.path.exists(file_path):
+            print(f'     {name} dataset not found, skipping...')
+            continue
+        print(f'     profiling {name} dataset...')
+        profile = profile_csv(file_path, **kwargs)
+        reports[name] = os.path.join(profiling_path, f'{prefix}_{name}_profiling.html')
+        with open(reports[name], 'w', encoding='utf-8') as f:
+            f.write(render_html(profile, f'{name.capitalize()} dataset profiling'))
+    return reports
+
+if __name__=='__main__':
+    profile_datasets()